@@ -33,8 +33,9 @@ import sys # for argv, passed to QApplication
 import platform # for mac detection
 import argparse # for a command-line filename or --version argument
 import atexit # temp workaround for pyinstaller
+import multiprocessing # for the pool of worker processes
 
-from PyQt4.QtCore import (Qt, QSettings, QString )
+from PyQt4.QtCore import (Qt, QSettings, QString, QTimer )
 from PyQt4.QtGui import ( QApplication, QFont, QFontDatabase )
 
 # A note on variable names: since we started working from Summerfield's code
@@ -181,6 +182,9 @@ import pqPages # page and folio table
 pqPages.IMC = IMC
 IMC.pageTable = pqPages.pagedb()
 
+import pqToken # word and tag tokenizer for the census and highlighter
+pqToken.IMC = IMC
+
 import pqEdit # the main edit widget plus save and load metadata
 pqEdit.IMC = IMC
 
@@ -229,12 +233,24 @@ pqMsgs.noteEvent("Done with most imports, opening settings")
 # * Windows : in the Registry under /Software/PGDP.
 IMC.settings = QSettings()
 
-pqMsgs.noteEvent("Creating spellchecker (which loads a dict)")
+pqMsgs.noteEvent("Creating spellchecker")
 
 import pqSpell # Spell-check routines (which use the settings)
 pqSpell.IMC = IMC
 
-# create the spellcheck, loading the last-set dictionary
+# Fork our worker processes now, while ours is the only thread: a process
+# forked later, from the census thread say, gets a copy of whatever locks
+# the dictionary loader or Qt's threads held at that instant, and may hang
+# on them. First the workers that run the Find panel's regex searches, and
+# the process that forks their replacements, then the pool shared by the
+# word census, spellcheck and reflow, which starts threads of its own. On Windows a forked process would start by re-running
+# this file, so there, everything is done in this process.
+pqFind.startWorkers()
+if hasattr(os, 'fork') :
+    IMC.pool = multiprocessing.Pool()
+
+# create the spellcheck, which will load the last-set dictionary in a thread
+# once the main window is up (see startLoading below).
 IMC.spellCheck = pqSpell.makeSpellCheck()
 
 pqMsgs.noteEvent("Creating main window...")
@@ -245,6 +261,8 @@ IMC.mainWindow = pqMain.MainWindow()
 
 IMC.mainWindow.show()
 
+pqMsgs.noteEvent("Main window shown")
+
 # If we are invoked from a command line and a filename was given,
 # try to open it. If there is a problem, for example if the file is
 # not found, there will be a popup diagnostic that the user will
@@ -261,6 +279,16 @@ IMC.mainWindow.show()
 if args.filename:
     IMC.mainWindow.loadFile(args.filename, None)
 
+# Start loading the main dictionary as soon as the event loop has painted
+# the window. The Hunspell binding holds the GIL while it loads a dict, so a
+# load started earlier would hold up the building of the window, not overlap
+# it. (If a file was opened above, its census already needed the dict and
+# this does nothing.)
+QTimer.singleShot(0, IMC.spellCheck.startLoading)
+
 pqMsgs.noteEvent("Starting the app (event loop)")
 
 app.exec_()
+
+if IMC.pool is not None :
+    IMC.pool.terminate()
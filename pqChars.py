@@ -154,6 +154,12 @@ class myTableModel(QAbstractTableModel):
                     return QString("")
         elif (role == Qt.TextAlignmentRole) :
             return self.alignDict[index.column()]
+        elif (role == Qt.ToolTipRole) and (2 == index.column()) :
+            # the tooltip of a count says where the char is, if not too often
+            note = IMC.editWidget.occurrenceNote(u'char', unicode(qs))
+            if note is None :
+                note = self.tipDict[2]
+            return QString(note)
         elif (role == Qt.ToolTipRole) or (role == Qt.StatusTipRole) :
             if index.column() < 5 :
                 return QString(self.tipDict[index.column()])
@@ -246,8 +252,9 @@ class charsPanel(QWidget):
             # get reference to column 0
             qmi = qmi.sibling(qmi.row(),0)
         qs = qmi.data(Qt.DisplayRole).toString()
-        # Call for a find with respect case on, whole word and regex off
-        IMC.findPanel.censusFinder(qs,rep, False, False)
+        # Call for a find with respect case on, whole word and regex off,
+        # which the editor can do from the census.
+        IMC.findPanel.censusFinder(qs,rep, False, False, (u'char', unicode(qs)))
 
     # this slot gets the activated(row) signal from the combo-box.
     # Based on the row, set self.filterLambda to a lambda that will
@@ -280,6 +287,24 @@ class charsPanel(QWidget):
         self.model.endResetModel()
         self.setUpTableView()
 
+    # These slots receive the editor's incremental-census signals, sent when
+    # the user pauses after an edit, and as a census running in the background
+    # sends its results. If characters came or went, reset the
+    # model; otherwise just repaint the count column.
+    def censusWillChange(self, structural):
+        if structural :
+            self.model.beginResetModel()
+
+    def censusHasChanged(self, structural):
+        if structural :
+            self.model.endResetModel()
+        else :
+            rows = self.model.rowCount(QModelIndex())
+            if rows :
+                self.model.emit(SIGNAL("dataChanged(QModelIndex,QModelIndex)"),
+                                self.model.index(0,2),
+                                self.model.index(rows-1,2))
+
     # This slot receives the click of the refresh button. Tell the
     # model we are resetting everything so the view will suck up new
     # data. Then call our editor to rebuild the metadata.
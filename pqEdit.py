@@ -53,30 +53,44 @@ We monitor keyEvents and add keystroke commands as follows:
 
 We implement a syntax-highlighter (a standard Qt feature meant to allow
 program source syntax coloring) in order to provide scanno-hiliting and
-spell-check-twiddly-red-underlines.
+spell-check-twiddly-red-underlines. When the highlights change, the lines
+in view are redone at once and the rest a few at a time when Qt is idle.
+
+Once a full word and char census has been taken, a censusCache follows the
+document's contentsChange signal and keeps the census current as the user
+edits, so the Word and Char panels need not be refreshed by hand. The full
+census and spellcheck run in a censusWorker thread, so the user can go on
+working while they are done.
 '''
 
-from PyQt4.QtCore import (Qt, QChar, QCryptographicHash, QRect, QRegExp, QString, SIGNAL)
+from PyQt4.QtCore import (Qt, QChar, QCryptographicHash, QObject, QPoint, QRect,
+                          QRegExp, QString, QThread, QTimer, SIGNAL)
 from PyQt4.QtGui import (
     QApplication, QBrush, QColor, QFont, QFontInfo, QMessageBox,
     QPlainTextEdit, QSyntaxHighlighter, QProgressDialog,
-    QTextBlock, QTextCharFormat, QTextCursor,
+    QTextBlock, QTextBlockUserData, QTextCharFormat, QTextCursor,
     QTextDocument, QTextEdit
 )
 
 # get simple access to methods of the list objects
 from pqLists import *
 import pqMsgs
-from collections import defaultdict
+from pqToken import (LineKind_Skip, LineKind_Psep, LineKind_Text,
+                     censusScan, censusSpans, tokenFlags, wordSpans)
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, OrderedDict
+import difflib
+import multiprocessing
+import os
+import time
 
 # Define a syntax highlighter object which will be linked into our editor.
 # The edit init below instantiates this object and keeps addressability to it.
 class wordHighLighter(QSyntaxHighlighter):
-    def __init__(self, parent=None):
-        global reWord
-        super(wordHighLighter, self).__init__(parent)
-        # store a local reference to the global regex
-        self.wordMatch = reWord
+    def __init__(self, document, editor):
+        super(wordHighLighter, self).__init__(document)
+        self.editor = editor
         # Initialize text formats to apply to words from various lists.
         #  - Scanno candidates get a light lilac background.
         self.scannoFormat = QTextCharFormat()
@@ -86,29 +100,150 @@ class wordHighLighter(QSyntaxHighlighter):
         self.misspeltFormat = QTextCharFormat()
         self.misspeltFormat.setUnderlineStyle(QTextCharFormat.WaveUnderline)
         self.misspeltFormat.setUnderlineColor(QColor("red"))
+        # The generation of the highlights, counted up by refresh(). Each
+        # line is marked with the generation it was last highlighted in.
+        self.generation = 0
+        # The epoch of the lists, counted up by refresh(stale=True) when the
+        # census flags or the scannos may have changed anywhere. Each line
+        # keeps the spans of its scannos and misspelt words found in an epoch.
+        self.epoch = 0
+        # True while the document is loaded, when we do nothing.
+        self.quiet = False
+        # True when some lines may have highlights, so turning them off
+        # has to visit all lines.
+        self.shown = False
+        # The sweep of all lines after a refresh: a cursor on the next line
+        # to do, which stays in place through edits, and a timer to do a
+        # slice of lines whenever Qt is idle.
+        self.sweep = QTextCursor(document)
+        self.timer = QTimer()
+        self.timer.setInterval(0)
+        self.connect(self.timer, SIGNAL("timeout()"), self.slice)
+        # When the user scrolls during a sweep, do the lines now in view.
+        self.connect(editor.verticalScrollBar(), SIGNAL("valueChanged(int)"),
+                     self.scrolled)
 
-    # The linked QPlainTextEdit calls this function for every text line in the
-    # whole bloody document when highlighting is turned on via the View menu,
-    # at least to judge by the hang-time. Later it only calls us to look at a
-    # line as it changes in editing. Anyway it behooves us to be as quick as
-    # possible. We don't actually check spelling, we just use the flag that
-    # was set when the last spellcheck was done. In a new document there may
-    # be no word census yet.
-    # Note that either one or both of MC.scannoHiliteSwitch or IMC.spellingHiliteSwitch
-    # are ON, or else we are called against an empty document -- see setHighlight below.
+    # The linked QPlainTextEdit calls this function to look at a line as it
+    # changes in editing, and we call it (by way of rehighlightBlock) for
+    # every line when the highlights change, see refresh(). So it behooves
+    # us to be as quick as possible. We don't actually check spelling, we
+    # just use the flag that was set when the last spellcheck was done. In
+    # a new document there may be no word census yet. If neither of
+    # IMC.scannoHiliteSwitch and IMC.spellingHiliteSwitch is on, we set no
+    # formats, which clears any the line had.
+    # The words are found by pqToken.wordSpans, which gives us the words as
+    # python strings, as the lists want them. The spans of the scannos and
+    # misspelt words are kept in the line's mark, and used again while the
+    # line's text and the epoch are the same, as when the switches are
+    # toggled. See redo() and refresh() for when they are not.
     def highlightBlock(self, text):
-        # find each word in the text and test it against our lists
-        i = self.wordMatch.indexIn(text,0) # first word if any
-        while i >= 0:
-            l = self.wordMatch.matchedLength()
-            w = self.wordMatch.cap(0) # word as qstring
-            if IMC.scannoHiliteSwitch: # we are checking for scannos:
-                if IMC.scannoList.check(unicode(w)):
-                    self.setFormat(i,l,self.scannoFormat)
-            if IMC.spellingHiliteSwitch: # we are checking spelling:
+        if self.quiet :
+            return # loading a document, see PPTextEditor.load
+        mark = self.currentBlockUserData()
+        if mark is None :
+            mark = hiliteMark()
+            self.setCurrentBlockUserData(mark)
+        mark.generation = self.generation
+        if not (IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch) :
+            return
+        pyText = unicode(text)
+        textHash = hash(pyText)
+        if (mark.epoch != self.epoch) or (mark.textHash != textHash) :
+            # find each word in the text and test it against our lists
+            mark.scannos = []
+            mark.misspelt = []
+            for (i, l, w) in wordSpans(pyText, text.length()) :
+                if IMC.scannoList.check(w):
+                    mark.scannos.append((i,l))
                 if (IMC.wordCensus.getFlag(w) & IMC.WordMisspelt):
-                    self.setFormat(i,l,self.misspeltFormat)
-            i = self.wordMatch.indexIn(text,i+l) # advance to next word
+                    mark.misspelt.append((i,l))
+            mark.epoch = self.epoch
+            mark.textHash = textHash
+        if IMC.scannoHiliteSwitch: # we are showing scannos:
+            for (i, l) in mark.scannos :
+                self.setFormat(i,l,self.scannoFormat)
+        if IMC.spellingHiliteSwitch: # we are showing spelling:
+            for (i, l) in mark.misspelt :
+                self.setFormat(i,l,self.misspeltFormat)
+
+    # The highlights have changed: the switches were toggled or (stale) the
+    # census flags or the scanno list changed. QSyntaxHighlighter.rehighlight()
+    # would redo every line of the document before returning, which for a
+    # big book is a hang. Instead we start a new generation, do the lines in
+    # view now, and the rest in slices as the timer allows.
+    def refresh(self, stale=False):
+        if stale :
+            self.epoch += 1
+        self.timer.stop()
+        if not (IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch
+                or self.shown) :
+            return # nothing to show and nothing to clear
+        self.shown = True
+        self.generation += 1
+        self.sweep.setPosition(0)
+        self.inView()
+        self.timer.start()
+
+    # Forget the document, as before a new one is loaded.
+    def reset(self):
+        self.timer.stop()
+        self.shown = False
+
+    # Redo a line whose words have changed flags, finding its spans anew.
+    def redo(self, block):
+        mark = block.userData()
+        if mark is not None :
+            mark.epoch = None
+        self.rehighlightBlock(block)
+
+    # Redo a line if it was not done in the current generation.
+    def relight(self, block):
+        mark = block.userData()
+        if (mark is None) or (mark.generation != self.generation) :
+            self.rehighlightBlock(block)
+
+    # Redo the lines in view in the editor.
+    def inView(self):
+        block = self.editor.firstVisibleBlock()
+        offset = self.editor.contentOffset()
+        bottom = self.editor.viewport().height()
+        while block.isValid() :
+            if self.editor.blockBoundingGeometry(block).translated(offset).top() > bottom :
+                break
+            self.relight(block)
+            block = block.next()
+
+    def scrolled(self, value):
+        if self.timer.isActive() :
+            self.inView()
+
+    # Timer slot: redo lines from the sweep cursor for up to HiliteSliceSeconds.
+    def slice(self):
+        t0 = time.time()
+        block = self.sweep.block()
+        while block.isValid() and (time.time() - t0) < HiliteSliceSeconds :
+            self.relight(block)
+            block = block.next()
+        if block.isValid() :
+            self.sweep.setPosition(block.position())
+        else : # all done
+            self.timer.stop()
+            self.shown = IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch
+
+# The longest a slice of the highlight sweep holds up the event loop.
+HiliteSliceSeconds = 0.004
+
+# The mark on a line of the generation it was highlighted in, and the
+# spans (position, length) of its scannos and misspelt words, as of an epoch
+# and a text, known by its hash.
+class hiliteMark(QTextBlockUserData):
+    def __init__(self):
+        super(hiliteMark, self).__init__()
+        self.generation = None
+        self.epoch = None
+        self.textHash = None
+        self.scannos = []
+        self.misspelt = []
 
 # Define the editor as a subclass of QPlainTextEdit. Only one object of this
 # class is created, in ppqtMain. The fontsize arg is recalled from saved
@@ -124,12 +259,10 @@ class PPTextEditor(QPlainTextEdit):
         self.setCenterOnScroll(True)
         # Get a monospaced font as selected by the user with View>Font
         self.setFont(pqMsgs.getMonoFont(fontsize,True))
-        # instantiate our "syntax" highlighter object, but link it to an empty
-        # QTextDocument. We will redirect it to our actual document only after
-        # loading a document, as it relies on metadata, and then only when/if
-        # the IMC.*HiliteSwitch es are on.
-        self.nulDoc = QTextDocument() # make a null document
-        self.hiliter = wordHighLighter(self.nulDoc)
+        # instantiate our "syntax" highlighter object on our document. It
+        # does nothing while a document is loaded, as it relies on metadata,
+        # and it shows nothing unless the IMC.*HiliteSwitch es are on.
+        self.hiliter = wordHighLighter(self.document(), self)
         # all the metadata lists will be initialized when self.clear() is
         # called from pqMain, shortly.
         # save a regex for quickly finding if a selection is a single word
@@ -137,22 +270,191 @@ class PPTextEditor(QPlainTextEdit):
         self.menuWord = QString()
         # Create and initialize an SHA-1 hash machine
         self.cuisineart = QCryptographicHash(QCryptographicHash.Sha1)
+        # Create the incremental census that follows our document's edits.
+        self.census = censusCache(self)
+        # No census or spellcheck worker is running, see doCensus.
+        self.worker = None
+        self.censusJob = 0
+        self.workQueue = []
+        # True from the start of a census run until it completes; a run
+        # that is cancelled leaves the census tables part-counted.
+        self.censusPartial = False
+        self.connect(self.document(), SIGNAL("contentsChange(int,int,int)"),
+                     self.workerCheck)
+        # The matches of the find text marked by pqFind, as sorted arrays
+        # of start positions and lengths, see markMatches.
+        self.marks = None
+        self.markFormat = QTextCharFormat()
+        self.markFormat.setBackground(QBrush(QColor("#FFF3A6")))
+        self.connect(self.verticalScrollBar(), SIGNAL("valueChanged(int)"),
+                     self.drawMarks)
 
-    # switch on or off our text-highlighting. By switching the highlighter
-    # to a null document we remove highlighting; by switching it back to
-    # the real document, we cause re-highlighting of everything. This makes
-    # significant delay for a large document, so put up a status message
-    # during it by starting and ending a progress bar.
-    def setHighlight(self, onoff):
-        self.hiliter.setDocument(self.nulDoc) # turn off hiliting always
-        if onoff:
-            pqMsgs.showStatusMsg("Setting Scanno/Spelling Highlights...")
-            self.hiliter.setDocument(self.document())
-            pqMsgs.clearStatusMsg()
+    # Redo our text-highlighting after a change of the IMC switches, which
+    # the highlighter reads, or after the census or scannos change (stale).
+    # The lines in view change at once and the rest of the document in the
+    # background.
+    def setHighlight(self, stale=False):
+        self.hiliter.refresh(stale)
+
+    # Redo the highlights of just the lines where some words occur, after
+    # their flags changed, if the census knows where they are and they are
+    # not too many; otherwise all lines.
+    def rehighlightWords(self, words):
+        if not (words and IMC.spellingHiliteSwitch) :
+            return
+        blocks = self.census.blocksOf(words)
+        if (blocks is None) or (len(blocks) > RehighlightMaxLines) :
+            self.setHighlight(stale=True)
+            return
+        doc = self.document()
+        for bn in blocks :
+            qtb = doc.findBlockByNumber(bn)
+            if qtb.isValid() :
+                self.hiliter.redo(qtb)
+
+    # Some words have been added to the good words: they are good in any
+    # dictionary, so clear the misspelt flag of each, with any /dict
+    # suffix, redo their lines, and leave them to be verified again.
+    def wordsMadeGood(self, words):
+        changed = IMC.wordCensus.unverify(words)
+        for w in changed :
+            flag = IMC.wordCensus.getFlag(w)
+            if flag & IMC.WordMisspelt :
+                IMC.wordCensus.setflags(IMC.wordCensus.lookup(w),
+                                        flag & (0xff - IMC.WordMisspelt))
+        self.rehighlightWords(changed)
+
+    # Return the offset of the occurrence of a word or char of the census
+    # (kind u'word' or u'char') next, prior, first or last (button 0-3, as
+    # for pqFind) relative to a position: -1 if there is none, or None if
+    # the census can't say or the key is so common searching is quicker.
+    def findOccurrence(self, kind, key, position, button):
+        census = IMC.wordCensus if kind == u'word' else IMC.charCensus
+        if census.getCount(key) > OccurIndexMaxCount :
+            return None
+        return self.census.findOccurrence(kind, key, position, button)
+
+    # Return a note of how many times a word or char of the census occurs
+    # and on which pages, for the tooltips of the Words and Chars panels,
+    # or None if the census can't say or there are too many to list.
+    def occurrenceNote(self, kind, key):
+        census = IMC.wordCensus if kind == u'word' else IMC.charCensus
+        if census.getCount(key) > OccurNoteMaxCount :
+            return None
+        offsets = self.census.occurrences(kind, key)
+        if offsets is None :
+            return None
+        scans = []
+        for offset in offsets :
+            index = IMC.pageTable.getIndex(offset)
+            if index >= 0 :
+                scan = unicode(IMC.pageTable.getScan(index))
+                if not (scans and scans[-1] == scan) :
+                    scans.append(scan)
+        note = u'{0} occurrences'.format(len(offsets))
+        if scans :
+            note += u' on pages ' + u' '.join(scans)
+        return note
+
+    # Mark the matches of the find text, given as arrays of their starts,
+    # in order, and lengths, or clear the marks with None. The marks are
+    # extra selections, of which we make only as many as there are matches
+    # in view, however many matches there are: see drawMarks.
+    def markMatches(self, starts, lengths=None):
+        self.marks = None if starts is None else (starts, lengths)
+        self.drawMarks()
+
+    # Set the extra selections for the marked matches in view, when they
+    # are marked, or scrolled or resized into view. A match that begins in
+    # the line above the view may show in it, so start from that.
+    def drawMarks(self, *args):
+        selections = []
+        if self.marks is not None :
+            (starts, lengths) = self.marks
+            vp = self.viewport()
+            top = self.cursorForPosition(QPoint(0, 0))
+            top.movePosition(QTextCursor.PreviousBlock)
+            bot = self.cursorForPosition(QPoint(vp.width()-1, vp.height()-1))
+            bot.movePosition(QTextCursor.EndOfBlock)
+            for i in range(bisect_left(starts, top.position()),
+                           bisect_right(starts, bot.position())) :
+                sel = QTextEdit.ExtraSelection()
+                sel.cursor = QTextCursor(self.document())
+                sel.cursor.setPosition(starts[i])
+                sel.cursor.setPosition(starts[i] + lengths[i],
+                                       QTextCursor.KeepAnchor)
+                sel.format = self.markFormat
+                selections.append(sel)
+        self.setExtraSelections(selections)
+
+    # Redraw the marks in view when the view changes size.
+    def resizeEvent(self, event):
+        super(PPTextEditor, self).resizeEvent(event)
+        if self.marks is not None :
+            self.drawMarks()
+
+    # Replace the text of the document, which was old, with new, both
+    # QStrings of the whole document as a cursor's selectedText gives it
+    # (lines ended by \u2029), as one undoable edit. We change only the
+    # lines that differ, as difflib finds them, and only the chars of those
+    # that differ, so the document, its highlights and census are touched
+    # no more than need be. A page's cursor in a changed line would move to
+    # the end of what is put there, so the caller, who knows what made new,
+    # passes moved, where each page starts in new, and we put the cursors
+    # there after.
+    def applyText(self, old, new, moved):
+        oldQsl = old.split(IMC.QtLineDelim)
+        newQsl = new.split(IMC.QtLineDelim)
+        oldLines = [unicode(line) for line in oldQsl]
+        newLines = [unicode(line) for line in newQsl]
+        oldStarts = lineStarts(oldQsl)
+        newStarts = lineStarts(newQsl)
+        matcher = difflib.SequenceMatcher(None, oldLines, newLines)
+        ops = matcher.get_opcodes()
+        pages = IMC.pageTable
+        oldEnd = oldStarts[-1] - 1 # no \u2029 after the last line
+        newEnd = newStarts[-1] - 1
+        moved = [min(pos, newEnd) for pos in moved]
+        tc = QTextCursor(self.document())
+        tc.beginEditBlock()
+        for (tag, i1, i2, j1, j2) in reversed(ops) :
+            if tag == 'equal' :
+                continue
+            start = oldStarts[i1]
+            end = oldStarts[i2]
+            text = new.mid(newStarts[j1], newStarts[j2] - newStarts[j1])
+            if i2 == len(oldLines) : # the last op, there is no last \u2029
+                end = oldEnd
+                text = new.mid(newStarts[j1], newEnd - newStarts[j1])
+                if i1 == i2 : # lines added at the end go after a new one
+                    start = oldEnd
+                    text = QString(IMC.QtLineDelim) + text
+                elif j1 == j2 : # lines cut at the end take the one before
+                    start -= 1
+            # drop the chars the old and new text have in common at
+            # each end, so no more is changed than must be
+            was = old.mid(start, end - start)
+            head = 0
+            limit = min(was.size(), text.size())
+            while head < limit and was.at(head) == text.at(head) :
+                head += 1
+            tail = 0
+            while tail < limit - head and \
+            was.at(was.size() - 1 - tail) == text.at(text.size() - 1 - tail) :
+                tail += 1
+            tc.setPosition(start + head)
+            tc.setPosition(end - tail, QTextCursor.KeepAnchor)
+            tc.insertText(text.mid(head, text.size() - head - tail))
+        for (index, pos) in enumerate(moved) :
+            pages.setPosition(index, pos)
+        tc.endEditBlock()
 
     # Implement clear/new. Just toss everything we keep.
     def clear(self):
-        self.setHighlight(False)
+        self.hiliter.reset()
+        self.markMatches(None)
+        self.cancelCensus()
+        self.census.reset()
         self.document().clear()
         self.document().setModified(False)
         self.bookMarkList = \
@@ -167,6 +469,7 @@ class PPTextEditor(QPlainTextEdit):
         IMC.needSpellCheck = False
         IMC.needMetadataSave = 0x00
         IMC.staleCensus = 0x00
+        self.censusPartial = False
         IMC.bookSaveEncoding = QString(u'UTF-8')
         IMC.bookMainDict = IMC.spellCheck.mainTag
         # force a cursor "move" in order to create a cursorMoved signal that will
@@ -375,6 +678,7 @@ class PPTextEditor(QPlainTextEdit):
     # This slot receives the "someword -> good_words" context menu action
     def addToGW(self) :
         IMC.goodWordList.insert(self.menuWord)
+        self.wordsMadeGood(set([unicode(self.menuWord)]))
         IMC.needMetadataSave |= IMC.goodwordsChanged
         IMC.needSpellCheck = True
         IMC.mainWindow.setWinModStatus()
@@ -384,6 +688,8 @@ class PPTextEditor(QPlainTextEdit):
     # so we need to write the document and metadata regardless of whether
     # they've been modified. However we avoid rebuilding metadata if we can.
     def save(self, dataStream, metaStream):
+        # Make sure any edits since the last census pause are counted
+        self.census.flush()
         # Get the contents of the document as a QString
         doc_text = self.toPlainText()
         # Calculate the SHA-1 hash over the document and save it in both hash
@@ -438,10 +744,23 @@ class PPTextEditor(QPlainTextEdit):
                 metaStream << "{0} {1} {2}\n".format(unicode(w), n, f)
             metaStream << u"{{/CHARCENSUS}}\n"
         if IMC.wordCensus.size() :
+            # The dict keys the words were verified against are listed
+            # first, and a verified word is followed by the index of its key.
+            keys = {}
+            for (w, f, k) in IMC.wordCensus.items() :
+                if (k is not None) and (k not in keys) :
+                    keys[k] = len(keys)
+            metaStream << u"{{DICTKEYS "
+            metaStream << u' '.join(sorted(keys, key=keys.get))
+            metaStream << u"}}\n"
             metaStream << u"{{WORDCENSUS}}\n"
             for i in range(IMC.wordCensus.size()):
                 (w,n,f) = IMC.wordCensus.get(i)
-                metaStream << "{0} {1} {2}\n".format(unicode(w), n, f)
+                k = keys.get(IMC.wordCensus.getChecked(w))
+                if k is None :
+                    metaStream << "{0} {1} {2}\n".format(unicode(w), n, f)
+                else :
+                    metaStream << "{0} {1} {2} {3}\n".format(unicode(w), n, f, k)
             metaStream << u"{{/WORDCENSUS}}\n"
         metaStream << u"{{BOOKMARKS}}\n"
         for i in range(9): # 0..8
@@ -478,8 +797,11 @@ class PPTextEditor(QPlainTextEdit):
     # empty, hiliting is off, etc.
 
     def load(self, dataStream, metaStream, goodStream, badStream):
-        # Load the document file into the editor
+        # Load the document file into the editor, with the highlighter
+        # quiet; the lines get highlighted by setHighlight below.
+        self.hiliter.quiet = True
         self.setPlainText(dataStream.readAll())
+        self.hiliter.quiet = False
         # Initialize the hash value for the document, which will be equal unless
         # we read something different from the metadata file.
         self.cuisineart.reset()
@@ -499,11 +821,9 @@ class PPTextEditor(QPlainTextEdit):
         if IMC.metaHash != IMC.documentHash :
             pqMsgs.warningMsg(u"The document file and metadata file do not match!",
                               u"Bookmarks, page breaks and other metadata will be wrong! Strongly recommend you not edit or save this book.")
-        # restore hiliting if the user wanted it. Note this can cause a
-        # serious delay if the new book is large. However the alternative is
-        # to not set it on and then we are out of step with the View menu
-        # toggles, so the user has to set it off before loading, or suffer.
-        self.setHighlight(IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch)
+        # restore hiliting if the user wanted it. The lines in view are
+        # done at once and the rest of a big book in the background.
+        self.setHighlight()
         # set a different main dict if there was one in the metadata
         if IMC.bookMainDict is not None:
             IMC.spellCheck.setMainDict(IMC.bookMainDict)
@@ -516,10 +836,12 @@ class PPTextEditor(QPlainTextEdit):
         sectionRE = QRegExp( u"\{\{(" + '|'.join (
             ['PAGETABLE','CHARCENSUS','WORDCENSUS','BOOKMARKS',
              'NOTES','GOODWORDS','BADWORDS','CURSOR','VERSION',
-             'STALECENSUS','NEEDSPELLCHECK','ENCODING', 'DOCHASH', 'MAINDICT'] ) \
+             'STALECENSUS','NEEDSPELLCHECK','ENCODING', 'DOCHASH', 'MAINDICT',
+             'DICTKEYS'] ) \
                              + u")(.*)\}\}",
             Qt.CaseSensitive)
         metaVersion = 0 # base version
+        dictKeys = [] # from {{DICTKEYS}}, indexed by the word census
         while not metaStream.atEnd() :
             qline = metaStream.readLine().trimmed()
             if qline.isEmpty() : continue # allow blank lines between sections
@@ -545,6 +867,9 @@ class PPTextEditor(QPlainTextEdit):
                 elif section == u"MAINDICT" :
                     IMC.bookMainDict = QString(argument)
                     continue
+                elif section == u"DICTKEYS" :
+                    dictKeys = argument.split()
+                    continue
                 elif section == u"DOCHASH" :
                     IMC.metaHash = argument
                     continue
@@ -568,7 +893,10 @@ class PPTextEditor(QPlainTextEdit):
                     qline = metaStream.readLine()
                     while (not qline.startsWith(endsec)) and (not qline.isEmpty()):
                         parts = unicode(qline).split(' ')
-                        IMC.wordCensus.append(QString(parts[0]),int(parts[1]),int(parts[2]))
+                        key = None # older metadata has no dict key
+                        if len(parts) > 3 and int(parts[3]) < len(dictKeys) :
+                            key = dictKeys[int(parts[3])]
+                        IMC.wordCensus.append(QString(parts[0]),int(parts[1]),int(parts[2]),key)
                         qline = metaStream.readLine()
                     continue
                 elif section == u"BOOKMARKS":
@@ -619,47 +947,47 @@ class PPTextEditor(QPlainTextEdit):
 
     # Rebuild as much of the char/word census and spellcheck as we need to.
     # This is called from load, above, and from the Char and Word panels
-    # Refresh buttons. If page=True we are loading a doc for which there is
-    # no metadata file, so cache page definitions; otherwise just skip the
-    # page definitions (see doCensus). If the doc has changed we need to
-    # rerun the full char/word census. But if not, we might still need a
+    # Refresh buttons. The work is done in the background, see doCensus.
+    # If page=True we are loading a doc for which there is no metadata
+    # file, so cache page definitions; otherwise just skip the page
+    # definitions (see doCensus). If the doc has changed we need to rerun
+    # the full char/word census. But if not, we might still need a
     # spellcheck, if the dictionary has changed.
     def rebuildMetadata(self,page=False):
+        # Our callers have reset the census tables, so apply any pending
+        # incremental changes without telling them.
+        self.census.flush(False)
         if page or (0 != IMC.staleCensus) :
-            self.doCensus(page)
-        if IMC.needSpellCheck :
+            self.doCensus(page) # which includes a spellcheck
+        elif IMC.needSpellCheck :
             self.doSpellcheck()
 
-    # Go through vocabulary census and check the spelling (it would be a big
-    # waste of time to check every word as it was read). If the spellcheck
-    # is not up (i.e. it couldn't find a dictionary) we only mark as bad the
-    # words in the badwords list.
+    # Go through vocabulary census and check the spelling of the words that
+    # have not been verified against the dictionary that now decides them:
+    # new words, words of the main dict after a change of main dict, and
+    # words added to the good words. If the spellcheck is not up (i.e. it
+    # couldn't find a dictionary) we only mark as bad the words in the
+    # badwords list. The checking is done by a censusWorker thread on a
+    # copy of the words and their flags, and the flags come back in
+    # batches, see workerBatch.
     def doSpellcheck(self):
-        canspell = IMC.spellCheck.isUp()
-        nwords = IMC.wordCensus.size()
-        if 0 >= nwords : # could be zero in a null document
+        self.cancelCensus()
+        mainKey = IMC.spellCheck.dictKey() if IMC.spellCheck.isUp() else u''
+        words = [ (w, wflags) for (w, wflags, key) in IMC.wordCensus.items()
+                  if key != spellKey(w, mainKey) ]
+        if 0 == len(words) : # all verified, or a null document
+            IMC.needSpellCheck = False
             return
-        pqMsgs.startBar(nwords,"Checking spelling...")
-        for i in range(IMC.wordCensus.size()):
-            (qword, cnt, wflags) = IMC.wordCensus.get(i)
-            wflags = wflags & (0xff - IMC.WordMisspelt) # turn off flag if on
-            # some words have /dict-tag, split that out as string or ""
-            (w,x,d) = unicode(qword).partition("/")
-            if IMC.goodWordList.check(w):
-                pass
-            elif IMC.badWordList.check(w) :
-                wflags |= IMC.WordMisspelt
-            elif canspell : # check word in its optional dictionary
-                if not ( IMC.spellCheck.check(w,d) ) :
-                    wflags |= IMC.WordMisspelt
-            IMC.wordCensus.setflags(i,wflags)
-            if 0 == i & 0x1f :
-                pqMsgs.rollBar(i)
-        pqMsgs.endBar()
-        IMC.needMetadataSave |= IMC.wordlistsChanged
-        IMC.needSpellCheck = False
-        if IMC.spellingHiliteSwitch :
-            self.setHighlight(True) # force refresh of spell underlines
+        pqMsgs.startBar(len(words),"Checking spelling...")
+        self.startWorker(censusWorker(self, self.censusJob, words=words))
+
+    # The spellchecker calls this when a main dictionary it was loading has
+    # been installed. A census or spellcheck now running was started with
+    # the dict before, and is followed by a spellcheck (see drainWork);
+    # else the words not checked with the new dict are checked now.
+    def dictLoaded(self):
+        if self.worker is None :
+            self.doSpellcheck()
 
     # Scan the successive lines of the document and build the census of chars,
     # words, and (first time only) the table of page separators.
@@ -701,108 +1029,865 @@ class PPTextEditor(QPlainTextEdit):
     # go in the census but we check them for lang= attributes and set the alternate
     # spellcheck dictionary from them.
 
+    # The actual scan of the lines for words and HTML productions is done
+    # by pqToken.censusScan(), which is shared with the incremental census
+    # (by way of censusLine, below) and the parallel census.
+
+    # The scan runs in a censusWorker thread on a snapshot of the lines, so
+    # the user can go on working. Each batch of counts it sends back goes
+    # into IMC.wordCensus and IMC.charCensus and so to the Word and Char
+    # panels as it comes (see workerBatch), and the census is only marked
+    # fresh when the last line has been counted (see workerDone). Editing
+    # the document or opening another cancels the run, leaving the census
+    # stale. The page table, which is only made on opening a book that has
+    # no .meta file, is made here and now, as it has to be complete.
+
     def doCensus(self, page=False) :
-        global reLineSep, reTokens, reLang, qcLess
+        self.cancelCensus()
         # Clear the current census values
         IMC.wordCensus.clear()
         IMC.charCensus.clear()
-        # Count chars locally for speed
-        local_char_census = defaultdict(int)
-        # Name of current alternate dictionary
-        alt_dict = QString() # isEmpty when none
-        # Tag from which we set an alternate dict
-        alt_dict_tag = QString()
-        # Start the progress bar based on the number of lines in the document
-        pqMsgs.startBar(self.document().blockCount(),"Counting words and chars...")
-        # Find the first text block of interest, skipping an HTML header file
-        qtb = self.document().begin() # first text block
-        if IMC.bookType.startsWith(QString(u"htm")) \
-        and qtb.text().startsWith(QString(u"<!DOCTYPE")) :
-            while (qtb != self.document().end()) \
-            and (not qtb.text().startsWith(QString(u"<body"))) :
-                qtb = qtb.next()
-        # Scan all lines of the document to the end.
-        while qtb != self.document().end() :
-            qsLine = qtb.text() # text of line as qstring
-            dbg = qsLine.size()
-            dbg2 = qtb.length()
-            if reLineSep.exactMatch(qsLine): # this is a page separator line
-                if page :
-                    # We are doing page seps, it's for Open with no .meta seen,
-                    # the page table has been cleared. Store the page sep
-                    # data in the page table, with a textCursor to its start.
-                    qsfilenum = reLineSep.cap(1) # xxx from "File: xxx.png"
-                    qsproofers = reLineSep.cap(2) # \who\x\blah\etc
-                    # proofer names can contain spaces, replace with en-space char
-                    qsproofers.replace(QChar(" "),QChar(0x2002))
-                    # create a new TextCursor instance
-                    tcursor = QTextCursor(self.document())
-                    # point it to this text block
-                    tcursor.setPosition(qtb.position())
-                    # dump all that in the page table
-                    IMC.pageTable.loadPsep(tcursor, qsfilenum, qsproofers)
-                # else not doing pages, just ignore this psep line
-            else: # not psep, ordinary text line, count chars and words
-                pyLine = unicode(qsLine) # move into Python space to count
-                for c in pyLine :
-                    local_char_census[c] += 1
-                j = 0
-                while True:
-                    j = reTokens.indexIn(qsLine,j)
-                    if j < 0 : # no more word-like units
-                        break
-                    qsWord = reTokens.cap(0)
-                    j += qsWord.size()
-                    if qsWord.startsWith(qcLess) :
-                        # Examine a captured HTML production.
-                        if not reTokens.cap(2).isEmpty() :
-                            # HTML open tag, look for lang='dict'
-                            if 0 <= reLang.indexIn(reTokens.cap(3)) :
-                                # found it: save tag and dict name
-                                alt_dict_tag = QString(reTokens.cap(2))
-                                alt_dict = QString(reLang.cap(1))
-                                alt_dict.prepend(u'/') # make "/en_GB"
-                            # else no lang= attribute
-                        else:
-                            # HTML close tag, see if it closes alt dict use
-                            if reTokens.cap(5) == alt_dict_tag :
-                                # yes, matches open-tag for dict, clear it
-                                alt_dict_tag = QString()
-                                alt_dict = QString()
-                            # else no alt dict in use, or didn't match
-                    else : # did not start with "<", process as a word
-                        # Set the property flags, which is harder now we don't
-                        # look at every character. Use the QString facilities
-                        # rather than python because python .isalnum fails
-                        # for a hyphenated number "1850-1910".
-                        flag = 0
-                        if 0 != qsWord.compare(qsWord.toLower()) :
-                            flag |= IMC.WordHasUpper
-                        if 0 != qsWord.compare(qsWord.toUpper()) :
-                            flag |= IMC.WordHasLower
-                        if qsWord.contains(qcHyphen) :
-                            flag |= IMC.WordHasHyphen
-                        if qsWord.contains(qcApostrophe) or qsWord.contains(qcCurlyApostrophe) :
-                            flag |= IMC.WordHasApostrophe
-                        if qsWord.contains(reDigit) :
-                            flag |= IMC.WordHasDigit
-                        IMC.wordCensus.count(qsWord.append(alt_dict),flag)
-                # end "while any more words in this line"
-            # end of not-a-psep-line processing
+        self.census.reset()
+        doc = self.document()
+        # Take the text of all lines as python strings.
+        lines = []
+        qtb = doc.begin() # first text block
+        while qtb != doc.end() :
+            lines.append(unicode(qtb.text()))
+            if page and lines[-1].startswith(u'-----File: ') \
+            and reLineSep.exactMatch(qtb.text()) :
+                # We are doing page seps, it's for Open with no .meta seen,
+                # the page table has been cleared. Store the page sep
+                # data in the page table, with a textCursor to its start.
+                qsfilenum = reLineSep.cap(1) # xxx from "File: xxx.png"
+                qsproofers = reLineSep.cap(2) # \who\x\blah\etc
+                # proofer names can contain spaces, replace with en-space char
+                qsproofers.replace(QChar(" "),QChar(0x2002))
+                # create a new TextCursor instance
+                tcursor = QTextCursor(doc)
+                # point it to this text block
+                tcursor.setPosition(qtb.position())
+                # dump all that in the page table
+                IMC.pageTable.loadPsep(tcursor, qsfilenum, qsproofers)
             qtb = qtb.next() # move on to next block
-            if (0 == (qtb.blockNumber() & 255)) : #every 256th block
-                pqMsgs.rollBar(qtb.blockNumber()) # roll the bar
-                QApplication.processEvents()
-        # end of scanning all text blocks in the doc
-        pqMsgs.endBar()
-        # we accumulated the char counts in localCharCensus. Now read it out
-        # in sorted order and stick it in the IMC.charCensus list.
-        for one_char in sorted(local_char_census.keys()):
-            qc = QChar(ord(one_char)) # get to QChar for category() method
-            IMC.charCensus.append(QString(qc),local_char_census[one_char],qc.category())
-        IMC.needSpellCheck = True # after a census this is true
-        IMC.staleCensus = 0 # but this is no longer true
+        # Until the worker finishes, the census is incomplete.
+        IMC.staleCensus |= IMC.staleCensusAcquired
+        self.censusPartial = True
+        IMC.needSpellCheck = True
+        pqMsgs.startBar(len(lines),"Counting words and chars...")
+        self.startWorker(censusWorker(self, self.censusJob, lines=lines,
+                                      state=censusStart(doc.begin())))
+
+    # Start a census or spellcheck worker, which reports to the slots below.
+    # Each run has a job number and any signal from an earlier job (which
+    # was cancelled but may not have noticed yet) is ignored.
+    def startWorker(self, worker):
+        self.worker = worker
+        self.workQueue = []
+        self.connect(worker, SIGNAL("censusBatch"), self.workerBatch)
+        self.connect(worker, SIGNAL("censusDone"), self.workerDone)
+        self.connect(worker, SIGNAL("finished()"), worker.deleteLater)
+        worker.start(QThread.LowPriority)
+
+    def censusRunning(self):
+        return self.worker is not None
+
+    # False while a census run is counting, or after one was cancelled,
+    # when the census tables do not have all the document's counts.
+    def censusComplete(self):
+        return not self.censusPartial
+
+    # Cancel a census or spellcheck run, if one is going. If wait is True
+    # (we are quitting) wait for the thread to stop.
+    def cancelCensus(self, wait=False):
+        self.censusJob += 1
+        self.workQueue = []
+        if self.worker is not None :
+            worker = self.worker
+            self.worker = None
+            worker.cancel()
+            if wait :
+                worker.wait()
+            pqMsgs.endBar()
+
+    # Slot for the document's contentsChange signal: a real edit, which
+    # changes the document revision (unlike highlighting), cancels a run.
+    def workerCheck(self, pos, removed, added):
+        if (self.worker is not None) \
+        and (self.worker.revision != self.document().revision()) :
+            self.cancelCensus()
+
+    # Slots for the worker's signals. Batches are queued and applied in
+    # order; applying one resets the panel models, which may process events
+    # and so deliver the next signal before the first is done.
+    def workerBatch(self, job, done, wordDelta, charDelta, flags):
+        if job == self.censusJob :
+            pqMsgs.rollBar(done, False)
+            self.workQueue.append( (u'batch', wordDelta, charDelta, flags) )
+            self.drainWork()
+
+    def workerDone(self, job, records, lines):
+        if job == self.censusJob :
+            self.workQueue.append( (u'done', records, lines) )
+            self.drainWork()
+
+    def drainWork(self):
+        if self.census.flushing :
+            return # the loop below is active, it will get there
+        while self.workQueue :
+            work = self.workQueue.pop(0)
+            if work[0] == u'batch' :
+                self.census.apply(*work[1:], mainKey=self.worker.mainKey)
+                continue
+            # The run is complete: work has the census records of all lines
+            # and the lines of each word, or None from a spellcheck.
+            (x, records, lines) = work
+            worker = self.worker
+            self.worker = None
+            pqMsgs.endBar()
+            flagged = self.census.takeFlagged()
+            if records is not None :
+                # The incremental census can carry on from here.
+                self.census.prime(records, lines)
+                IMC.staleCensus = 0
+                self.censusPartial = False
+            # A spellcheck is still needed if the main dictionary changed,
+            # as when it was loaded during the run; it is done below.
+            IMC.needSpellCheck = worker.mainDict is not IMC.spellCheck.mainDict
+            IMC.needMetadataSave |= IMC.wordlistsChanged
+            IMC.mainWindow.setWinModStatus()
+            # Refresh the spell underlines: everywhere after a census, or
+            # where the words are whose flags a spellcheck changed.
+            if records is not None :
+                if IMC.spellingHiliteSwitch :
+                    self.setHighlight(stale=True)
+            else :
+                self.rehighlightWords(flagged)
+            if IMC.needSpellCheck :
+                self.doSpellcheck()
+
+# Return the offsets at which each of a QStringList of lines starts in the
+# text of them all, each but the last ended by \u2029, plus the offset just
+# past the end of that text and its (virtual) last \u2029.
+
+def lineStarts(qsl):
+    starts = [0]
+    pos = 0
+    for line in qsl :
+        pos += line.size() + 1
+        starts.append(pos)
+    return starts
+
+# The number of words or chars whose occurrences the census keeps, and the
+# most occurrences of one to find by way of the census rather than by
+# searching the document, which finds a common word sooner, and the most
+# to list the pages of in a tooltip.
+OccurCacheSize = 8
+OccurIndexMaxCount = 5000
+OccurNoteMaxCount = 500
+
+# A change of flags on words found in more lines than this refreshes the
+# highlights of all lines in the background rather than these lines now.
+RehighlightMaxLines = 1000
+
+# Incremental census: rather than let every edit make the census stale, we
+# follow the document's contentsChange(position, removed, added) signal and
+# keep the census current at a cost proportional to the edit.
+#
+# The cache is a list with one census record per text block, in block order,
+# as made by censusLine() below. Each line also has a serial number, and we
+# keep an inverted index of the serials of the lines each word occurs in, so
+# that when the flags of some words change we can find their lines (see
+# blocksOf) and redo just their highlights. It is primed by doCensus, and until then
+# (e.g. after loading census counts from a .meta file) we do nothing and
+# edits make the census stale in the old way.
+#
+# contentsChange tells us where the edit started and how many characters
+# were there before and after. From the document's block count before and
+# after we know which old records were replaced by which new blocks. We
+# rescan just the new blocks and note the difference in words and chars
+# as pending deltas. A scan that ends in a different lang= state than
+# before continues into the following lines until the state agrees again,
+# as when the user deletes the </span> that closed an alt-dictionary span.
+#
+# A QSyntaxHighlighter also signals contentsChange when it formats a line
+# (with removed == added). We recognize an unchanged line by comparing its
+# text and entry state to the cached record, and don't rescan it.
+#
+# The deltas are applied to IMC.wordCensus and IMC.charCensus only after
+# the user pauses typing. Then words that newly appear get their feature
+# flags and a spellcheck, and the Word and Char panels are told, with the
+# censusWillChange and censusHasChanged signals, whether rows came or went
+# (so the table must reset) or only counts changed.
+
+class censusCache(QObject):
+    def __init__(self, editor):
+        super(censusCache, self).__init__(editor)
+        self.editor = editor
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(750) # msec of quiet after an edit
+        self.connect(self.timer, SIGNAL("timeout()"), self.flush)
+        self.connect(editor.document(), SIGNAL("contentsChange(int,int,int)"),
+                     self.contentsChange)
+        self.flushing = False
+        self.reset()
+
+    # Forget everything: we are no longer following edits.
+    def reset(self):
+        self.timer.stop()
+        self.records = []
+        self.serials = [] # serial number of each line
+        self.lines = defaultdict(set) # word: serials of lines it is in
+        self.nextSerial = 0
+        self.live = False
+        self.wordDelta = defaultdict(int)
+        self.charDelta = defaultdict(int)
+        self.touched = set() # serials of lines to rehighlight after flush
+        self.flagged = set() # words whose misspelt flag changed in apply
+        self.occurs = OrderedDict() # (kind, key): offsets, see occurrences
+
+    def isLive(self):
+        return self.live
+
+    # Take the census records of all lines from doCensus, and the line
+    # numbers of each word, which serve as their first serials.
+    def prime(self, records, lines):
+        self.reset()
+        if len(records) == self.editor.document().blockCount() :
+            self.records = records
+            self.serials = range(len(records))
+            self.lines = lines
+            self.nextSerial = len(records)
+            self.live = True
+
+    # Return the block numbers of the lines with any of some words in order,
+    # or None if we are not following the census.
+    def blocksOf(self, words):
+        if not self.live :
+            return None
+        wanted = set()
+        for w in words :
+            wanted |= self.lines.get(w, set())
+        if not wanted :
+            return []
+        return [bn for (bn, serial) in enumerate(self.serials)
+                if serial in wanted]
+
+    # Return the sorted document offsets of the occurrences of a word (kind
+    # u'word', the word as counted, with any /dict suffix) or a char (kind
+    # u'char'), or None if we are not following the census. The offsets of
+    # the last few asked for are kept, and shifted as the document is
+    # edited, so that finding the next one is a binary search.
+    def occurrences(self, kind, key):
+        if not self.live :
+            return None
+        offsets = self.occurs.pop((kind, key), None)
+        if offsets is None :
+            if kind == u'word' :
+                blocks = self.blocksOf([key])
+            else :
+                blocks = [bn for (bn, record) in enumerate(self.records)
+                          if record[CenRec_Kind] == LineKind_Text
+                          and key in record[CenRec_Text]]
+            offsets = self.lineOffsets(kind, key, blocks)
+        self.occurs[(kind, key)] = offsets # most recently used
+        if len(self.occurs) > OccurCacheSize :
+            self.occurs.popitem(last=False)
+        return offsets
+
+    # Return the offsets of a word or char in some lines in order.
+    def lineOffsets(self, kind, key, blocks):
+        doc = self.editor.document()
+        offsets = array(b'l')
+        for bn in blocks :
+            record = self.records[bn]
+            if record[CenRec_Kind] != LineKind_Text :
+                continue
+            text = record[CenRec_Text]
+            qtb = doc.findBlockByNumber(bn)
+            base = qtb.position()
+            units = qtb.length() - 1
+            if kind == u'word' :
+                if key in record[CenRec_Words] :
+                    for (i, l, w) in censusSpans(text, record[CenRec_Entry], units) :
+                        if w == key :
+                            offsets.append(base + i)
+            else :
+                i = text.find(key)
+                while i >= 0 :
+                    if units != len(text) : # chars beyond the BMP before i
+                        offsets.append(base + i +
+                            sum(1 for c in text[:i] if ord(c) > 0xffff))
+                    else :
+                        offsets.append(base + i)
+                    i = text.find(key, i + 1)
+        return offsets
+
+    # Lines f to f+n-1 were just replaced by an edit that changed the
+    # length of the document by shift. Drop the old occurrences in those
+    # lines, find the new ones, and shift the ones after.
+    def shiftOccurs(self, f, n, shift):
+        doc = self.editor.document()
+        start = doc.findBlockByNumber(f).position()
+        after = doc.findBlockByNumber(f + n)
+        endNew = after.position() if after.isValid() else doc.characterCount()
+        endOld = endNew - shift
+        for (kind, key) in self.occurs.keys() :
+            offsets = self.occurs[(kind, key)]
+            i = bisect_left(offsets, start)
+            j = bisect_left(offsets, endOld)
+            tail = offsets[j:]
+            if shift :
+                tail = array(b'l', [x + shift for x in tail])
+            self.occurs[(kind, key)] = offsets[:i] \
+                + self.lineOffsets(kind, key, range(f, f + n)) + tail
+
+    # Return the offset of an occurrence of a word or char relative to a
+    # document position, for a Find button (0 next, 1 prior, 2 first,
+    # 3 last): -1 if there is none, or None if we can't say.
+    def findOccurrence(self, kind, key, position, button):
+        offsets = self.occurrences(kind, key)
+        if offsets is None :
+            return None
+        if button == 2 :
+            i = 0
+        elif button == 3 :
+            i = len(offsets) - 1
+        elif button == 0 : # the first starting after position
+            i = bisect_right(offsets, position)
+        else : # the last starting before position
+            i = bisect_left(offsets, position) - 1
+        if 0 <= i < len(offsets) :
+            return offsets[i]
+        return -1
+
+    # Return and forget the words whose misspelt flags apply has changed.
+    def takeFlagged(self):
+        flagged = self.flagged
+        self.flagged = set()
+        return flagged
+
+    # Slot for the document's contentsChange signal.
+    def contentsChange(self, pos, removed, added):
+        if not self.live :
+            return
+        doc = self.editor.document()
+        delta = doc.blockCount() - len(self.records)
+        first = doc.findBlock(pos)
+        if not first.isValid() :
+            first = doc.lastBlock()
+        last = doc.findBlock(pos + added)
+        if not last.isValid() :
+            last = doc.lastBlock()
+        f = first.blockNumber()
+        oldl = last.blockNumber() - delta # last old block replaced
+        if (oldl < f - 1) or (oldl >= len(self.records)) :
+            # Can't make sense of this change: give up following edits.
+            self.reset()
+            IMC.staleCensus |= IMC.staleCensusAcquired
+            return
+        if f == 0 :
+            state = censusStart(first)
+        else :
+            state = self.records[f-1][CenRec_Exit]
+        old = self.records[f:oldl+1]
+        oldSerials = self.serials[f:oldl+1]
+        new = []
+        newSerials = []
+        # Scan the lines of the edited region
+        qtb = first
+        while qtb.isValid() and (qtb.blockNumber() <= last.blockNumber()) :
+            bn = qtb.blockNumber()
+            qsLine = qtb.text()
+            if (delta == 0) and (self.records[bn][CenRec_Entry] == state) \
+            and (self.records[bn][CenRec_Text] == unicode(qsLine)) :
+                record = self.records[bn] # unchanged, e.g. just highlighted
+                serial = self.serials[bn]
+            else :
+                record = censusLine(qsLine, state)
+                serial = self.newSerial()
+                self.touched.add(serial)
+            new.append(record)
+            newSerials.append(serial)
+            state = record[CenRec_Exit]
+            qtb = qtb.next()
+        # If the scan state at the end of the region is not what it used to
+        # be, e.g. an edit opened or closed a lang= span, carry on until the
+        # state agrees with the entry state of an old line.
+        k = oldl + 1 # old record of qtb
+        while qtb.isValid() and (k < len(self.records)) \
+        and (self.records[k][CenRec_Entry] != state) :
+            old.append(self.records[k])
+            oldSerials.append(self.serials[k])
+            record = censusLine(qtb.text(), state)
+            serial = self.newSerial()
+            self.touched.add(serial)
+            new.append(record)
+            newSerials.append(serial)
+            state = record[CenRec_Exit]
+            qtb = qtb.next()
+            k += 1
+        self.records[f:k] = new
+        self.serials[f:k] = newSerials
+        if old == new : # nothing really changed
+            return
+        if self.occurs :
+            self.shiftOccurs(f, len(new), added - removed)
+        # Move the lines of the words in the index.
+        for (record, serial) in zip(old, oldSerials) :
+            for w in record[CenRec_Words] :
+                serials = self.lines.get(w)
+                if serials is not None :
+                    serials.discard(serial)
+                    if not serials :
+                        del self.lines[w]
+        for (record, serial) in zip(new, newSerials) :
+            for w in record[CenRec_Words] :
+                self.lines[w].add(serial)
+        changed = False
+        for record in old :
+            if record[CenRec_Kind] == LineKind_Text :
+                changed = True
+                for c in record[CenRec_Text] :
+                    self.charDelta[c] -= 1
+                for w in record[CenRec_Words] :
+                    self.wordDelta[w] -= 1
+        for record in new :
+            if record[CenRec_Kind] == LineKind_Text :
+                changed = True
+                for c in record[CenRec_Text] :
+                    self.charDelta[c] += 1
+                for w in record[CenRec_Words] :
+                    self.wordDelta[w] += 1
+        if changed :
+            self.timer.start() # restart the quiet-time clock
+
+    def newSerial(self):
+        self.nextSerial += 1
+        return self.nextSerial - 1
+
+    # Apply the pending deltas to the census lists. Normally called from
+    # the timer, so notify the panels. Called with notify=False from
+    # rebuildMetadata, whose callers are already resetting the panels.
+    def flush(self, notify=True):
+        self.timer.stop()
+        if self.flushing : # a panel called processEvents during a flush
+            self.timer.start()
+            return
+        wordDelta = dict( (w,n) for (w,n) in self.wordDelta.iteritems() if n )
+        charDelta = dict( (c,n) for (c,n) in self.charDelta.iteritems() if n )
+        touched = self.touched
+        self.wordDelta = defaultdict(int)
+        self.charDelta = defaultdict(int)
+        self.touched = set()
+        if not (wordDelta or charDelta) :
+            return
+        newMisspelt = self.apply(wordDelta, charDelta, {}, notify)
+        # The lines with new misspellings were highlighted before we knew
+        # they were misspelt, so do them again. Edits since may have moved
+        # them, so find them by serial, as blocksOf does; a line edited
+        # again has a new serial, which is in touched too.
+        if newMisspelt and IMC.spellingHiliteSwitch :
+            doc = self.editor.document()
+            for (bn, serial) in enumerate(self.serials) :
+                if serial in touched :
+                    self.editor.hiliter.redo(doc.findBlockByNumber(bn))
+
+    # Apply word and char deltas to the census lists, and tell the panels
+    # unless notify is False. Flags gives the flags of new words, when known,
+    # and new flags for words already counted, as from a spellcheck. A flag
+    # of None means, check it here. The words given flags are marked as
+    # verified; mainKey is the key of the main dict the flags were found
+    # with, by default the current one. Return True if any new word is
+    # misspelt.
+    def apply(self, wordDelta, charDelta, flags={}, notify=True, mainKey=None):
+        # Rows come or go if a count goes from or to zero.
+        structural = False
+        for (census, deltas) in ((IMC.wordCensus, wordDelta),
+                                 (IMC.charCensus, charDelta)) :
+            for (w, n) in deltas.iteritems() :
+                c = census.getCount(w)
+                if (c == 0) or (c + n <= 0) :
+                    structural = True
+                    break
+        self.flushing = True
+        if notify :
+            self.emit(SIGNAL("censusWillChange"),structural)
+        canspell = IMC.spellCheck.isUp()
+        if mainKey is None :
+            mainKey = IMC.spellCheck.dictKey() if canspell else u''
+        # Words to check here are checked together, one dict at a time.
+        verdicts = {}
+        if canspell :
+            verdicts = spellVerdicts(
+                [w for (w, n) in wordDelta.iteritems()
+                    if n > 0 and flags.get(w) is None
+                    and not IMC.wordCensus.getCount(w)] +
+                [w for (w, flag) in flags.iteritems()
+                    if flag is None and w not in wordDelta] )
+        newMisspelt = False
+        for (w, n) in wordDelta.iteritems() :
+            if n < 0 :
+                IMC.wordCensus.uncount(w, -n)
+            elif IMC.wordCensus.getCount(w) :
+                IMC.wordCensus.count(w, 0, n)
+            else : # a new word: get its features and check its spelling
+                flag = flags.get(w)
+                if flag is None :
+                    flag = spellFlags(w, tokenFlags(w), canspell,
+                                      verdicts.get(w))
+                newMisspelt |= 0 != (flag & IMC.WordMisspelt)
+                IMC.wordCensus.count(QString(w), flag, n)
+                IMC.wordCensus.setChecked(w, spellKey(w, mainKey))
+        for (w, flag) in flags.iteritems() :
+            if w not in wordDelta : # a word already counted: new flags
+                row = IMC.wordCensus.lookup(w)
+                if row is not None :
+                    old = IMC.wordCensus.getFlag(w)
+                    if flag is None :
+                        flag = spellFlags(w, old, canspell, verdicts.get(w))
+                    if (flag ^ old) & IMC.WordMisspelt :
+                        self.flagged.add(w)
+                    IMC.wordCensus.setflags(row, flag)
+                    IMC.wordCensus.setChecked(w, spellKey(w, mainKey))
+        for (c, n) in charDelta.iteritems() :
+            if n < 0 :
+                IMC.charCensus.uncount(c, -n)
+            else :
+                qc = QChar(ord(c))
+                IMC.charCensus.count(QString(qc), qc.category(), n)
         IMC.needMetadataSave |= IMC.wordlistsChanged
+        if notify :
+            self.emit(SIGNAL("censusHasChanged"),structural)
+        self.flushing = False
+        return newMisspelt
+
+# The census worker: a thread that takes a census of a snapshot of the
+# lines of the document (lines=) or checks the spelling of a list of
+# (word, flags) pairs (words=), and sends the results back to the editor in
+# batches with the signal censusBatch(job, done, wordDelta, charDelta, flags),
+# where done is the number of lines or words finished. At the end it sends
+# censusDone(job, records, lines) with the census records of all lines and
+# the line numbers of each word (see wordLines), or None, None
+# after a spellcheck. It checks for cancel between batches, and a cancelled
+# worker sends no censusDone.
+#
+# The worker checks spelling in the main dictionary only. A word with an
+# alt dictionary suffix gets a flag of None, and is checked in the GUI
+# thread when the batch is applied, because loading an alt dictionary may
+# put up a message.
+
+class censusWorker(QThread):
+    def __init__(self, editor, job, lines=None, state=None, words=None):
+        super(censusWorker, self).__init__(editor)
+        self.job = job
+        self.lines = lines
+        self.state = state
+        self.words = words
+        self.cancelled = False
+        self.revision = editor.document().revision()
+        # Ask about the main dict here in the GUI thread. If it is still
+        # being loaded, isUp() is False, and the words are checked again
+        # when it is, see dictLoaded.
+        self.canspell = IMC.spellCheck.isUp()
+        self.mainDict = IMC.spellCheck.mainDict
+        self.mainKey = IMC.spellCheck.dictKey() if self.canspell else u''
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.lines is not None :
+            self.runCensus()
+        else :
+            self.runSpellcheck()
+
+    def runCensus(self):
+        canspell = self.canspell
+        records = []
+        seen = set() # words that have had their flags sent
+        wordDelta = defaultdict(int)
+        charDelta = defaultdict(int)
+        flags = {}
+        if (IMC.pool is not None) and (len(self.lines) >= ParallelCensusMinLines) :
+            batches = poolCensus(self.lines, self.state, IMC.pool)
+        else :
+            batches = censusBatches(self.lines, self.state, 512)
+        sent = time.time()
+        try :
+            for (done, recs, words, chars) in batches :
+                if self.cancelled :
+                    return
+                records.extend(recs)
+                new = [w for w in words if w not in seen]
+                seen.update(new)
+                flags.update(self.spellcheck(
+                    [(w, tokenFlags(w)) for w in new], canspell))
+                for (w, n) in words.iteritems() :
+                    wordDelta[w] += n
+                for (c, n) in chars.iteritems() :
+                    charDelta[c] += n
+                if (time.time() - sent) >= CensusBatchSeconds :
+                    self.emit(SIGNAL("censusBatch"), self.job, done,
+                              dict(wordDelta), dict(charDelta), flags)
+                    wordDelta = defaultdict(int)
+                    charDelta = defaultdict(int)
+                    flags = {}
+                    sent = time.time()
+        finally :
+            batches.close() # if cancelled, drop any chunks still to come
+        self.emit(SIGNAL("censusBatch"), self.job, len(self.lines),
+                  dict(wordDelta), dict(charDelta), flags)
+        self.emit(SIGNAL("censusDone"), self.job, records, wordLines(records))
+
+    def runSpellcheck(self):
+        canspell = self.canspell
+        flags = {}
+        sent = time.time()
+        # Take the words in groups of 4096, each of which checkAll may send
+        # to the spellcheck process pool.
+        for i in range(0, len(self.words), 4096) :
+            if self.cancelled :
+                return
+            group = self.words[i:i+4096]
+            # Send all the flags, changed or not, so the words are marked
+            # as verified.
+            flags.update(self.spellcheck(group, canspell))
+            if (time.time() - sent) >= CensusBatchSeconds :
+                self.emit(SIGNAL("censusBatch"), self.job, i, {}, {}, flags)
+                flags = {}
+                sent = time.time()
+        if self.cancelled :
+            return
+        self.emit(SIGNAL("censusBatch"), self.job, len(self.words), {}, {}, flags)
+        self.emit(SIGNAL("censusDone"), self.job, None, None)
+
+    # Given a list of (word, flags) pairs, where a word may have a /dict
+    # suffix, return a dict of their flags with the misspelt flag set as
+    # need be. The words of each dictionary are checked as a batch by
+    # IMC.spellCheck.checkAll. A word of an alt dict that could not be
+    # checked gets a flag of None, to be checked in the GUI thread.
+    def spellcheck(self, pairs, canspell):
+        flags = {}
+        verdicts = {}
+        if canspell :
+            groups = defaultdict(list)
+            for (w, wflags) in pairs :
+                (word, x, tag) = w.partition(u'/')
+                groups[tag].append(word)
+            results = IMC.spellCheck.checkAll(groups)
+            for (tag, words) in groups.iteritems() :
+                suffix = u'/' + tag if tag else u''
+                for (word, verdict) in zip(words, results[tag]) :
+                    verdicts[word + suffix] = verdict
+        for (w, wflags) in pairs :
+            verdict = verdicts.get(w)
+            if canspell and (verdict is None) and (u'/' in w) :
+                flags[w] = None
+            else :
+                flags[w] = spellFlags(w, wflags, canspell, verdict)
+        return flags
+
+# Make the inverted index of the census records of all lines: for each word,
+# the set of the numbers of the lines it is in.
+
+def wordLines(records):
+    lines = defaultdict(set)
+    for (bn, record) in enumerate(records) :
+        for w in record[CenRec_Words] :
+            lines[w].add(bn)
+    return lines
+
+# The worker sends results about this often (seconds), which sets how often
+# the Word and Char panels are refreshed during a census.
+CensusBatchSeconds = 0.5
+
+# Take the census of a list of python strings, whose first line has the scan
+# state given, in one pass, yielding the results every size lines as a
+# tuple (n, records, words, chars): the number of lines done so far, the
+# census records of the lines since the last batch, and dicts of the counts
+# of their words and chars.
+
+def censusBatches(lines, state, size):
+    records = []
+    words = defaultdict(int)
+    chars = defaultdict(int)
+    n = 0
+    for (line, record) in zip(lines, censusScan(lines, state)) :
+        if record[0] == LineKind_Text :
+            for c in line :
+                chars[c] += 1
+            for w in record[3] :
+                words[w] += 1
+        records.append( (line,) + record )
+        n += 1
+        if len(records) == size :
+            yield (n, records, dict(words), dict(chars))
+            records = []
+            words = defaultdict(int)
+            chars = defaultdict(int)
+    if records :
+        yield (n, records, dict(words), dict(chars))
+
+# The parallel census is used when ppqt could fork the pool of worker
+# processes, IMC.pool (on Windows each worker would start by re-running
+# ppqt.py), and the book has ParallelCensusMinLines lines or more. That
+# figure is a guess; the pool has not been timed against the serial scan on
+# more than one processor. We never fork here, in the census thread. The
+# snapshot of lines is cut into chunks at page separators
+# (see censusChunks) and each process scans and counts chunks with
+# censusChunk, returning the census records of its lines (less the text,
+# which we have) and the counts.
+#
+# A chunk's scan depends on the lang= and HTML-header state at its start,
+# which is known only when the chunk before it is finished. So the first
+# chunk gets the true starting state and the others get the state of no
+# alt dictionary and no header, which is nearly always right because
+# lang= spans seldom cross a page boundary. As the results come back in
+# order, any chunk whose guessed entry state was wrong is scanned over
+# with the right one. Thus the result is the same as the serial census.
+ParallelCensusMinLines = 4000
+# The entry state a worker assumes for a chunk other than the first.
+CensusNeutralState = (False, u'', u'')
+
+# Divide the lines of a snapshot into about n chunks, as a list of (a, b)
+# line-index pairs. Chunks begin at a page separator line when there is one
+# near the ideal cut, else wherever the ideal cut falls; any cut is correct
+# (see the parallel census note above) but lang= spans are unlikely to cross a page.
+
+def censusChunks(lines, n):
+    size = max(len(lines) // max(n,1), 1)
+    chunks = []
+    a = 0
+    while a < len(lines) :
+        b = min(a + size, len(lines))
+        # look ahead up to a quarter-chunk for the next page separator
+        limit = min(b + size // 4, len(lines))
+        for c in xrange(b, limit) :
+            if lines[c].startswith(u'-----File: ') :
+                b = c
+                break
+        chunks.append( (a, b) )
+        a = b
+    return chunks
+
+# Count a list of python strings, whose first line has the scan state given,
+# with a pool of processes, yielding the results of each chunk in order as
+# censusBatches does. The pool is shared, so if we are closed early, the
+# chunks not yet taken are left to finish and their results are dropped.
+
+def poolCensus(lines, state, pool):
+    chunks = censusChunks(lines, 4 * multiprocessing.cpu_count())
+    jobs = [ (lines[a:b], state if a == 0 else CensusNeutralState)
+             for (a, b) in chunks ]
+    for ((a, b), result) in zip(chunks, pool.imap(censusChunk, jobs)) :
+        (recs, words, chars) = result
+        # state is now the exit state of the prior chunk, or the true
+        # starting state for the first.
+        if recs[0][CenRec_Entry - 1] != state : # guessed wrong, do it over
+            (recs, words, chars) = censusChunk((lines[a:b], state))
+        records = []
+        for (line, (kind, entry, state, lwords)) in zip(lines[a:b], recs) :
+            records.append( (line, kind, entry, state, lwords) )
+        yield (b, records, words, chars)
+
+# This runs in a worker process of the parallel census. Given a list of
+# python strings and the scan state at the start of the first, return
+# the census records of the lines, less their text, and dicts of the
+# counts of words and of chars.
+
+def censusChunk(job):
+    (lines, state) = job
+    words = defaultdict(int)
+    chars = defaultdict(int)
+    recs = []
+    for (line, record) in zip(lines, censusScan(lines, state)) :
+        if record[0] == LineKind_Text :
+            for c in line :
+                chars[c] += 1
+            for w in record[3] :
+                words[w] += 1
+        recs.append(record)
+    return (recs, dict(words), dict(chars))
+
+# The census record of one line is a tuple:
+CenRec_Text = 0 # the line as a Python unicode string
+CenRec_Kind = 1 # one of the LineKind values of pqToken
+CenRec_Entry = 2 # the scan state at the start of the line
+CenRec_Exit = 3 # the scan state at the end of the line
+CenRec_Words = 4 # tuple of the words of the line, with any /dict suffix
+# The kinds of line are LineKind_Skip, part of an HTML header, not counted;
+# LineKind_Psep, a page separator line, not counted; and LineKind_Text, a
+# line of text whose chars and words are counted.
+#
+# The scan state is a tuple (skipping, alt_dict_tag, alt_dict) where skipping
+# is True while in an HTML header; alt_dict_tag is the name of the HTML tag
+# with a lang= attribute ("span"); and alt_dict is the "/fr_FR" suffix we
+# add to words inside that tag. The tag and suffix are u'' if none.
+#
+# censusStart() returns the initial scan state given the first block: if this
+# is an HTML file with a <!DOCTYPE first line, we skip until we see <body>.
+
+def censusStart(qtb):
+    skipping = IMC.bookType.startsWith(QString(u"htm")) \
+               and qtb.text().startsWith(QString(u"<!DOCTYPE"))
+    return (skipping, u'', u'')
+
+# Scan one line for the census, given the state of the scan at its start,
+# and return its census record.
+
+def censusLine(qsLine, state):
+    pyLine = unicode(qsLine)
+    return (pyLine,) + next(censusScan([pyLine], state))
+
+# Set or clear the misspelt flag of a word, given as a python string possibly
+# with a /dict suffix, and optionally the dictionary's verdict on it if that
+# is known. If the spellcheck is not up (i.e. it couldn't find a
+# dictionary) we only mark as bad the words in the badwords list.
+
+def spellFlags(word, wflags, canspell, verdict=None):
+    wflags = wflags & (0xff - IMC.WordMisspelt) # turn off flag if on
+    # some words have /dict-tag, split that out as string or ""
+    (w,x,d) = word.partition("/")
+    if IMC.goodWordList.check(w):
+        pass
+    elif IMC.badWordList.check(w) :
+        wflags |= IMC.WordMisspelt
+    elif canspell : # check word in its optional dictionary
+        if verdict is None : # unless we were told the verdict
+            verdict = IMC.spellCheck.check(w,d)
+        if not verdict :
+            wflags |= IMC.WordMisspelt
+    return wflags
+
+# The key of the dictionary that decides the spelling of a word, given as
+# a python string possibly with a /dict suffix, when the key of the main
+# dict is mainKey. When the spellcheck is not up, mainKey is u'' and only
+# the good and bad words count, so every word's key is u''.
+
+def spellKey(word, mainKey):
+    if not mainKey :
+        return u''
+    (w,x,d) = word.partition("/")
+    return IMC.spellCheck.dictKey(d) if d else mainKey
+
+# Get the dictionary verdicts on a list of words, given as python strings
+# possibly with /dict suffixes, as a dict of word:verdict. The words are
+# grouped by dictionary so that each one is fetched from the pool of
+# loaded dicts (or loaded) just once, however its words are interleaved.
+
+def spellVerdicts(words):
+    groups = {}
+    for word in words :
+        (w,x,d) = word.partition("/")
+        groups.setdefault(d, []).append((word, w))
+    verdicts = {}
+    for (d, pairs) in groups.iteritems() :
+        results = IMC.spellCheck.checkMany([w for (word, w) in pairs], d)
+        for ((word, w), verdict) in zip(pairs, results) :
+            verdicts[word] = verdict
+    return verdicts
 
 # Regex to exactly match all of a page separator line. Note that the proofer
 # names can contain almost any junk; proofer names can be null (\name\\name);
@@ -827,7 +1912,7 @@ xp_word = "(\\w*(\\[..\\])?\\w+)+"
 
 xp_hyap = "(" + xp_word + "[\\'\\-\u2019])*" + xp_word
 
-# reWord is used by the syntax highlighter above.
+# reWord is used by the case-changing commands above.
 
 reWord = QRegExp(xp_hyap, Qt.CaseInsensitive)
 
@@ -846,24 +1931,66 @@ xp_any = xp_start + '|' + xp_end + '|' + xp_hyap
 
 reTokens = QRegExp(xp_any, Qt.CaseInsensitive)
 
+# The census now uses the python regexes of pqToken, which match the same
+# tokens as reWord and reTokens (see the unit test in pqToken) in a single
+# pass over many lines.
+
 # When reTokens matches an HTML close tag, reTokens.cap(5) is the closed tag name.
 # When reTokens matches an HTML open tag, reTokens.cap(2) is the tag name
 # ("i" or "span" or "div"), reTokens.cap(3) has whatever attributes it had
-# (class='x', lang='en_GB'). We scan that for lang='value' (optional quotes).
-
-reLang = QRegExp(u'''lang=[\\'\\"]*([\\w\\-]+)[\\'\\"]*''')
-
-# The 'value' matched by reLang.cap(0) is a language designation but we require
-# it to be a dictionary tag such as 'en_US' or 'fr_FR'. It is not clear from
-# the W3C docs whether all (or any) of our dic tags are language designations.
+# (class='x', lang='en_GB'). The census scans that for lang='value' (optional
+# quotes). The 'value' is a language designation but we require it to be a
+# dictionary tag such as 'en_US' or 'fr_FR'. It is not clear from the W3C docs
+# whether all (or any) of our dic tags are language designations.
 
 # According to W3C (http://www.w3.org/TR/html401/struct/dirlang.html) you can
 # put lang= into any tag, esp. span, para, div, td, and so forth.
 # We save the dict tag as an alternate dictionary for all words until the
 # matching close tag is seen.
 
-reDigit = QRegExp(u'\\d')
-qcLess = QChar(u"<")
-qcHyphen = QChar(u"-")
-qcApostrophe = QChar(u"'")
-qcCurlyApostrophe = QChar(8217) # aka \u2019
\ No newline at end of file
+if __name__ == "__main__":
+    # Time the serial census scan and the process pool, on a book named on
+    # the command line or else on a synthetic book of ~2MB with a few French
+    # spans, some of which cross a page boundary, and check they agree.
+    #   python pqEdit.py [book.txt]
+    import io
+    import random
+    import sys
+    if len(sys.argv) > 1 :
+        lines = io.open(sys.argv[1], encoding='UTF-8').read().split(u'\n')
+    else :
+        random.seed(1)
+        vocab = u"the of and to in a is that it was he for on are with as his " \
+                u"mother-in-law's bric-a-brac ph[oe]nix 1850-1910 Einstein " \
+                u"couldn't \u00e9t\u00e9 \u00c6sop M\u00fcller don\u2019t".split()
+        lines = []
+        for page in range(600) :
+            lines.append(u'-----File: {0:03d}.png---\\JulietS\\-----'.format(page))
+            for l in range(45) :
+                line = u' '.join(random.choice(vocab) for w in range(9))
+                if random.random() < 0.005 :
+                    line = u'<span lang="fr_FR">' + line
+                elif random.random() < 0.005 :
+                    line = line + u'</span>'
+                lines.append(line)
+    print(u'{0} lines, {1} chars, {2} processors'.format(
+        len(lines), sum(len(l) for l in lines), multiprocessing.cpu_count()))
+    pool = multiprocessing.Pool() # as ppqt makes IMC.pool, before timing
+    t0 = time.time()
+    (recs, words, chars) = censusChunk((lines, CensusNeutralState))
+    t1 = time.time()
+    records = []
+    pwords = defaultdict(int)
+    pchars = defaultdict(int)
+    for (n, recs_n, words_n, chars_n) in poolCensus(lines, CensusNeutralState, pool) :
+        records.extend(recs_n)
+        for (w, k) in words_n.iteritems() :
+            pwords[w] += k
+        for (c, k) in chars_n.iteritems() :
+            pchars[c] += k
+    t2 = time.time()
+    print(u'serial {0:.2f}s, parallel {1:.2f}s'.format(t1 - t0, t2 - t1))
+    same = (words == dict(pwords)) and (chars == dict(pchars)) and \
+        ([r[1:] for r in records] == recs)
+    print(u'results identical' if same else u'RESULTS DIFFER')
+    pool.terminate()
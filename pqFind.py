@@ -36,9 +36,9 @@ layouts manually rather than using the designer's unreadable output.)
 
 Widget Design for the Find UI
 
-At the top of the pane is a row of five checkboxes for case, whole-word,
-in-selection, regex, and greedy. Whole-word is ignored for regex (use \b\w+\b),
-and greedy is ignored for non-regex.
+At the top of the pane is a row of six checkboxes for case, whole-word,
+in-selection, regex, greedy, and as-you-type. Whole-word is ignored for regex
+(use \b\w+\b), and greedy is ignored for non-regex.
 
 Below the checkboxes is the Find lineEdit, which has syntax checking for regex
 and turns pink when an invalid regex is being entered. Below that are four
@@ -66,6 +66,26 @@ pop up a confirmation query saying how many replacements will be done. This also
 is original; most editors show you the count of replacments after the fact, not
 before. Replace all is a single undo-redo event. See also note below.
 
+Between the Prior and First buttons is a count of all the matches of the find
+text in the document, and a switch, Mark all, to show them with a yellow
+background in the editor. A regexJob finds them in a copy of the
+document when the user pauses after changing the find text, a switch, or the
+document; a change while it works makes it stop and start over. Only the
+matches in view are made into extra selections of the editor. While the
+matches are known, and the find text is plain, case-sensitive, not whole
+words, and can't overlap itself, Next, Prior, First and Last pick the hit
+from them by a binary search instead of searching the document. Those are
+the only matches the list and a search of the document are sure to agree
+on: Next may find a match overlapping the one selected, which the list
+skips, and a regex ^ or \b is tested in the count's one scan from the top
+differently than in realSearch's copy from the edit cursor.
+
+With the As You Type switch on, a pause in typing the find text starts a
+regexJob to find the first match after where the edit cursor was when the
+typing began, and the match is selected in the editor while the focus stays
+in the find text. A keystroke drops any such search at work, and when a plain
+find text only grows, the search goes on from the last hit.
+
 Beside the Find lineEdit, and beside each Rep lineEdit, we have a combo box that
 pops up a list of previous strings from most recent down. The find list is
 updated on use of any search button. The Rep lists are updated on use of that
@@ -180,6 +200,12 @@ in fact exactly such a regex is in extras/ClearTextMarkup.utf: X.*(?=\\n)
 when the regex is not greedy, the .* matches less without the lookahead than
 with it. So a further kludge: force greedy.
 
+On a big document (see pqGrams) a search first asks a trigram index of its
+lines which ones may hold a literal string every match must contain, and
+applies the regex only to those lines and a few around them. A pattern with
+no such string, or one that could span any number of lines, gets the search
+described above.
+
 Qt 5 is supposed to offer much improved regex support with both lookahead and
 lookbehind and the whole design will have to be revisited then. Possibly the
 only answer will be to copy the whole goddam search range into Python and
@@ -193,25 +219,63 @@ hits during replace-all, even though overlapping hits ARE possible when doing
 manual replace with &Next set. The reason is that overlapping hits (a) could
 be a black hole of recursion for certain regexes, and (b) would imply doing
 overlapping replacements with probably very strange results.
+
+A regex replace-all does not call realSearch for each hit, as that copies all
+the text from the hit to the end of the range, and a book with 20,000 hits
+would copy it 20,000 times. Instead findAllHits copies the range once and
+scans it forward, and the hits are replaced one by one in a single edit
+block. Run this module with the argument "bench" to compare the two.
+
+Runaway Regexes
+
+A regex like (a+)+b can take longer than the age of the universe to fail on
+a line of a's, and a QRegExp can't be interrupted. So no regex search runs
+in the GUI thread: each one, for Next and Prior, replace-all, the match
+count, and the buttons of a button file, is a regexJob, which where we can
+fork runs in one of a few worker processes forked at startup, and one that
+must be stopped is killed with its worker, which a spawner process, also
+forked at startup, replaces. While one that the user waits on
+works, the window is kept painted but the user's keys and clicks are held
+back, and after a moment an application-modal dialog offers Cancel, so the
+document can't change under the search; if it changes anyway the result is
+dropped, as its offsets are of the old text. One that runs past the
+time limit, set by View>Regex Time Limit and 5 seconds to begin with, is
+stopped and the user told. Where we can't fork (Windows), the job runs in a
+thread, which we can stop waiting for but not stop. Also as the user types a
+regex, riskyPattern looks for the repeat-of-a-repeat shape behind most such
+regexes and turns the find text orange if it sees one.
 '''
 
 
 from urllib import (quote, unquote) # for safely encoding find/rep strings
 import pqMsgs
+import pqGrams
 import ast
+import os
+import time
+import multiprocessing
+import multiprocessing.connection
+import signal
+from array import array
+from bisect import bisect_left, bisect_right
 
 from PyQt4.QtCore import (Qt,
-    QChar, QRegExp,
+    QChar, QObject, QRegExp,
     QString, QStringList,
+    QEventLoop, QThread, QTimer,
     SIGNAL, SLOT )
 from PyQt4.QtGui import(
+    QAbstractItemView, QApplication,
     QCheckBox, QComboBox, QColor,
+    QDialog,
     QFont,
     QGridLayout, QHBoxLayout, QVBoxLayout,
-    QLineEdit,
+    QInputDialog,
+    QLabel, QLineEdit,
     QPalette,
-    QPushButton,
+    QProgressDialog, QPushButton,
     QSizePolicy, QSpacerItem,
+    QTableWidget, QTableWidgetItem,
     QTextCursor, QTextDocument,
     QUndoStack,
     QValidator,
@@ -219,6 +283,17 @@ from PyQt4.QtGui import(
 
 UserButtonMax = 24 # how many user buttons to instantiate
 UserButtonRow = 4 # how many to put in a row of the grid
+MatchDelay = 400 # ms after the last change to count all matches again
+TypeDelay = 250 # ms after the last keystroke to find as you type
+ReportPlaces = 5 # how many places of each button's hits the report lists
+RegexBudgetMs = 5000 # default ms a regex may run before we stop it
+RegexQuietMs = 300 # ms a regex may run before we offer to cancel it
+RegexPollMs = 50 # ms between looks at a regex at work
+GramWindowChars = 100000 # chars of index windows to search in one regexJob
+RiskyColor = "#FFD8A0" # find text background for a risky regex
+# A regex runs in a worker process we can kill, where we can fork (on Windows
+# each process would start by re-running ppqt.py), see regexJob.
+RegexCanFork = hasattr(os, 'fork')
 
 class findPanel(QWidget):
     def __init__(self, parent=None):
@@ -236,6 +311,34 @@ class findPanel(QWidget):
         self.regexp.setPatternSyntax(QRegExp.RegExp2)
         # regex to search a regex pattern for a trailing lookahead
         self.lookAheadFinder = QRegExp(u'\(\?[\!\=][^)]+\)$')
+        # census word or char set by censusFinder, see indexSearch
+        self.censusKey = None
+        self.censusState = None
+        # the ms a regex may run before we stop it, see watch
+        (self.regexBudget, ok) = stgs.value("regexBudget",RegexBudgetMs).toInt()
+        # All the matches of the find text in the document, found by a
+        # regexJob in the background after any change: see matchesStale.
+        self.matcher = None # the regexJob at work, if any
+        self.matches = None # (starts, lengths) when known
+        self.matchRevision = None # document revision of the matches
+        # trigram index of the lines of a big document, see gramSearch
+        self.grams = pqGrams.gramIndex(IMC.editWidget.document())
+        self.matchTimer = QTimer()
+        self.matchTimer.setSingleShot(True)
+        self.matchTimer.setInterval(MatchDelay)
+        self.connect(self.matchTimer, SIGNAL("timeout()"), self.startMatching)
+        # Find as you type: the position the edit cursor had when the user
+        # began to type, the hit of the last search from it, the find text
+        # that last found nothing, and the regexJob at work: see typeSearch.
+        self.typeAnchor = None
+        self.typeHit = None # (position, find text)
+        self.typeMiss = None
+        self.typeJob = None
+        self.typeMoving = False # we are moving the edit cursor to a hit
+        self.typeTimer = QTimer()
+        self.typeTimer.setSingleShot(True)
+        self.typeTimer.setInterval(TypeDelay)
+        self.connect(self.typeTimer, SIGNAL("timeout()"), self.typeSearch)
         # Search boundary positions set on First/Last. Boundary has to be set
         # as a textcursor so it will update as document changes length.
         self.rangeTop = None
@@ -272,11 +375,16 @@ class findPanel(QWidget):
         self.inSelSwitch = QCheckBox(u"In &Sel'n")
         self.regexSwitch = QCheckBox(u"&Regex")
         self.greedySwitch = QCheckBox(u"&Greedy")
+        self.typeSwitch = QCheckBox(u"As You T&ype")
+        self.typeSwitch.setToolTip(
+            QString(u"Find the next match of the find text as you type it") )
+        self.typeSwitch.setChecked(stgs.value("typeSwitch",False).toBool())
         findCheckHbox.addWidget(self.caseSwitch,0,Qt.AlignLeft)
         findCheckHbox.addWidget(self.wholeWordSwitch,0,Qt.AlignLeft)
         findCheckHbox.addWidget(self.inSelSwitch,0,Qt.AlignLeft)
         findCheckHbox.addWidget(self.regexSwitch,0,Qt.AlignLeft)
         findCheckHbox.addWidget(self.greedySwitch,0,Qt.AlignLeft)
+        findCheckHbox.addWidget(self.typeSwitch,0,Qt.AlignLeft)
         findCheckHbox.addStretch(1) # keep switches compact to the left
         # connect stateChanged of inSelSwitch to a slot to clear range
         self.connect(self.inSelSwitch, SIGNAL("stateChanged(int)"),
@@ -300,6 +408,12 @@ class findPanel(QWidget):
         # Connect user change in the find text to note a user change
         self.connect(self.findText, SIGNAL("textEdited(QString)"),
                                 lambda : self.userEditedText(0) )
+        # Connect user change in the find text to find as you type, and
+        # any other move of the edit cursor to forget where typing began.
+        self.connect(self.findText, SIGNAL("textEdited(QString)"),
+                                self.typeEdited )
+        self.connect(IMC.editWidget, SIGNAL("cursorPositionChanged()"),
+                                self.typeMoved )
         # Make a horizontal row of the finding buttons
         nextPriorHbox = QHBoxLayout()
         mainLayout.addLayout(nextPriorHbox,0)
@@ -309,6 +423,12 @@ class findPanel(QWidget):
         self.lastButton = QPushButton(u"Last")
         nextPriorHbox.addWidget(self.nextButton,0)
         nextPriorHbox.addWidget(self.priorButton,0)
+        # the count of all matches, and a switch to mark them in the editor
+        self.matchCount = QLabel()
+        self.markSwitch = QCheckBox(u"Mar&k all")
+        nextPriorHbox.addStretch(1)
+        nextPriorHbox.addWidget(self.matchCount,0)
+        nextPriorHbox.addWidget(self.markSwitch,0)
         nextPriorHbox.addStretch(1) # keep n/p buttons left, f/l right
         nextPriorHbox.addWidget(self.firstButton,0)
         nextPriorHbox.addWidget(self.lastButton,0)
@@ -321,6 +441,18 @@ class findPanel(QWidget):
                                      lambda b=2: self.doSearch(b) )
         self.connect(self.lastButton, SIGNAL("clicked()"),
                                      lambda b=3: self.doSearch(b) )
+        # Any change to what the find text matches, or to the document,
+        # makes the count and marks stale.
+        self.connect(self.findText, SIGNAL("textChanged(QString)"),
+                                     self.matchesStale )
+        for switch in (self.caseSwitch, self.wholeWordSwitch,
+                       self.regexSwitch, self.greedySwitch) :
+            self.connect(switch, SIGNAL("stateChanged(int)"),
+                                     self.matchesStale )
+        self.connect(IMC.editWidget.document(),
+                     SIGNAL("contentsChange(int,int,int)"), self.documentChange )
+        self.connect(self.markSwitch, SIGNAL("stateChanged(int)"),
+                                     self.showMarks )
         # Connect the returnPressed of find text to the click slot of
         # the Next button - so return in the text looks for the next instance
         # of that text -- the natural expectation of the find box.
@@ -419,16 +551,25 @@ class findPanel(QWidget):
 
     # Called when the find text changes OR the state of the regexSwitch
     # changes: if regex is on, get the find text as a regex and if it
-    # has bad syntax, turn the background of the find text pink. As a side
+    # has bad syntax, turn the background of the find text pink. If it is
+    # valid but riskyPattern sees the shape of a regex that can take ages
+    # to fail, turn it orange and say why in the tooltip. As a side
     # effect, whenever Next/Prior is hit, self.regex has the current regex.
     # n.b. the textEdited signal passes a QString but we ignore it.
     def checkFindText(self):
         col = "white"
+        tip = QString()
         if self.regexSwitch.isChecked():
             self.regexp = QRegExp(self.findText.text())
             if not (self.regexp.isValid()) :
                 col = "pink"
+            else :
+                risk = riskyPattern(self.findText.text())
+                if risk is not None :
+                    col = RiskyColor
+                    tip = QString(risk)
         self.findText.setBackground(col) # see below
+        self.findText.setToolTip(tip)
 
     # Called from the textEdited signal of any of the findRepEdits, meaning
     # the user has changed something in the contents. All we do here is clear
@@ -473,6 +614,175 @@ class findPanel(QWidget):
     def docHasChanged(self):
         self.setFullRange() # sets rangeTop and rangeBot
         self.inSelSwitch.setChecked(False)
+        self.matchesStale()
+        self.grams.reset()
+
+    # Slot for the contentsChange signal of the document. Highlighting a
+    # line signals this too, but does not change the document revision.
+    def documentChange(self, pos, removed, added):
+        if IMC.editWidget.document().revision() != self.matchRevision :
+            self.matchesStale()
+
+    # Something changed what the find text matches: forget the matches,
+    # stop any regexJob at work, and find them again when the user pauses.
+    def matchesStale(self, *args):
+        if self.matcher is not None :
+            self.matcher.drop()
+            self.matcher = None
+        if self.matches is not None :
+            self.matches = None
+            IMC.editWidget.markMatches(None)
+        self.matchCount.setText(QString())
+        self.matchRevision = None
+        self.matchTimer.start()
+
+    # Return the find text as a regex, or None if it is empty or an invalid
+    # regex. A plain find text is made a regex that matches it literally,
+    # bounded by \b for whole words.
+    def matchRegex(self):
+        qs = QString(self.findText.text())
+        if qs.isEmpty() :
+            return None
+        if self.regexSwitch.isChecked() :
+            if not self.setRegex() :
+                return None
+            return QRegExp(self.regexp)
+        qs = QRegExp.escape(qs)
+        if self.wholeWordSwitch.isChecked() :
+            qs = QString(u'\\b') + qs + QString(u'\\b')
+        return QRegExp(qs,
+            Qt.CaseSensitive if self.caseSwitch.isChecked() \
+            else Qt.CaseInsensitive, QRegExp.RegExp2)
+
+    # Timer slot: start a regexJob to find all the matches in a copy of the
+    # document, with the find text as a regex, see matchRegex.
+    def startMatching(self):
+        qrex = self.matchRegex()
+        if qrex is None :
+            return
+        doc = IMC.editWidget.document()
+        self.matchRevision = doc.revision()
+        job = regexJob(matchScan, docText(doc, 0, doc.characterCount() - 1),
+                       qrex)
+        self.matcher = job
+        self.connect(job, SIGNAL("jobDone"), self.matchingDone)
+        job.start(self.regexBudget)
+
+    # A regexJob finished: if nothing has changed since it started, show
+    # the count and maybe the marks. One that ran too long can't be used
+    # to count or to search.
+    def matchingDone(self, job):
+        if job is not self.matcher :
+            return # obsolete, drop it
+        self.matcher = None
+        if job.overrun :
+            self.matchCount.setText(QString(u'too slow to count'))
+            return
+        if job.result is None :
+            return
+        self.matches = job.result
+        n = len(self.matches[0])
+        self.matchCount.setText(
+            QString(u'1 match' if n == 1 else u'{0} matches'.format(n)) )
+        self.showMarks()
+
+    # Slot for the textEdited signal of the find text. With As You Type on,
+    # drop any search at work for the text before this keystroke, note where
+    # the edit cursor is if this is the first keystroke, and search when the
+    # user pauses.
+    def typeEdited(self):
+        if not self.typeSwitch.isChecked() :
+            return
+        if self.typeJob is not None :
+            self.typeJob.drop()
+            self.typeJob = None
+        if self.typeAnchor is None :
+            self.typeAnchor = IMC.editWidget.textCursor().selectionStart()
+            self.typeHit = None
+            self.typeMiss = None
+        self.typeTimer.start()
+
+    # Slot for the cursorPositionChanged signal of the editor: unless we
+    # moved it to a hit, the next keystroke begins a new search from where
+    # the edit cursor is then.
+    def typeMoved(self):
+        if not self.typeMoving :
+            self.typeAnchor = None
+            self.typeTimer.stop()
+
+    # Timer slot: find the first match of the find text after typeAnchor
+    # with a regexJob, which typeEdited drops if another keystroke comes
+    # first. When a plain text (not whole-word, where "cat" does not match
+    # in "cats") extends the one of the last search, every match of it is
+    # a match of the last one, so none can come before the last hit, and
+    # if the last search found nothing, neither will this one.
+    def typeSearch(self):
+        if self.typeAnchor is None :
+            return
+        qrex = self.matchRegex()
+        if qrex is None :
+            self.typeHit = None
+            self.typeMiss = None
+            return
+        text = QString(self.findText.text())
+        start = self.typeAnchor
+        if not (self.regexSwitch.isChecked()
+                or self.wholeWordSwitch.isChecked()) :
+            if (self.typeMiss is not None) and text.startsWith(self.typeMiss) :
+                pqMsgs.flash("Not found")
+                return
+            if (self.typeHit is not None) and text.startsWith(self.typeHit[1]) :
+                start = self.typeHit[0]
+        doc = IMC.editWidget.document()
+        bot = doc.characterCount() - 1
+        if self.inSelSwitch.isChecked() :
+            start = max(start, self.rangeTop.position())
+            bot = self.rangeBot.position()
+        if bot < start :
+            return
+        job = regexJob(regexFind, qrex, docText(doc, start, bot), False)
+        job.text = text
+        job.top = start
+        job.revision = doc.revision()
+        self.typeJob = job
+        self.connect(job, SIGNAL("jobDone"), self.typeDone)
+        job.start(self.regexBudget)
+
+    # A regexJob of typeSearch finished: if it is still wanted and the
+    # document has not changed, select the hit in the editor, but leave the
+    # focus in the find text so the user can go on typing.
+    def typeDone(self, job):
+        if job is not self.typeJob :
+            return # obsolete, drop it
+        self.typeJob = None
+        if not self.typeSwitch.isChecked() :
+            return
+        if job.result is None :
+            pqMsgs.flash("Too slow to find as you type")
+            return
+        if IMC.editWidget.document().revision() != job.revision :
+            return
+        (fpos, length) = job.result
+        if (fpos < 0) or (length == 0) :
+            self.typeHit = None
+            self.typeMiss = job.text
+            pqMsgs.flash("Not found")
+            return
+        self.typeHit = (job.top + fpos, job.text)
+        self.typeMiss = None
+        self.typeMoving = True
+        IMC.editWidget.setTextCursor(self.hitCursor(job.top + fpos, length))
+        IMC.editWidget.centerCursor()
+        self.typeMoving = False
+        self.selectionFromFind = True
+
+    # Slot for the Mark all switch: mark the matches if it is on and we
+    # know them, else clear them.
+    def showMarks(self, *args):
+        if self.markSwitch.isChecked() and (self.matches is not None) :
+            IMC.editWidget.markMatches(*self.matches)
+        else :
+            IMC.editWidget.markMatches(None)
 
     # The heart of search, pulled out for use from replace-all (and
     # potentially, but not yet, from pqNotes and pqHelp). Takes a
@@ -481,30 +791,20 @@ class findPanel(QWidget):
     # found text. Depends on the values of self.regexp, self.regexSwitch,
     # self.caseSwitch, self.greedySwitch and self.wholeWordSwitch.
     def realSearch(self, doc, startTc, backward = False):
+        if (doc is self.grams.document) and self.grams.ready() :
+            findTc = self.gramSearch(doc, startTc, backward)
+            if findTc is not None :
+                return findTc
         if not self.regexSwitch.isChecked() :
             # normal string search: apply the QTextDocument.find() method
             # passing our Case, whole word and direction flags
-            flags = QTextDocument.FindBackward if backward \
-                  else QTextDocument.FindFlags(0)
-            if self.caseSwitch.isChecked() :
-                flags |= QTextDocument.FindCaseSensitively
-            if self.wholeWordSwitch.isChecked() :
-                flags |= QTextDocument.FindWholeWords
-            findTc = doc.find(self.findText.text(),startTc,flags)
+            findTc = doc.find(self.findText.text(),startTc,
+                              self.findFlags(backward))
         else:
             # Regex search! See notes in prologue.
             findTc = QTextCursor(startTc) # null cursor says no-match
             findTc.clearSelection() # probably not necessary
-            if self.regexp.isValid() :
-                # valid regex: if it contains \n replace with \u2029
-                pats = self.regexp.pattern()
-                pats.replace(QString("\\n"),IMC.QtLineDelim)
-                self.regexp.setPattern(pats)
-                # set case and greedy switches in QRegExp
-                self.regexp.setCaseSensitivity(
-                    Qt.CaseSensitive if self.caseSwitch.isChecked() \
-                    else Qt.CaseInsensitive)
-                self.regexp.setMinimal(not self.greedySwitch.isChecked())
+            if self.setRegex() :
                 # set up workTc selecting all possible text to search, based
                 # on the direction of the search.
                 workTc = QTextCursor(startTc) # workTc points to start of range
@@ -516,21 +816,298 @@ class findPanel(QWidget):
                 else:
                     workTc.setPosition(self.rangeBot.position(),QTextCursor.KeepAnchor)
                 # apply the regex to that text as a QString, getting an index
-                # to the left end of a hit, and also priming self.regex.cap(n)
-                # for replacements.
-                if backward :
-                    fpos = self.regexp.lastIndexIn(workTc.selectedText())
-                else:
-                    fpos = self.regexp.indexIn(workTc.selectedText())
+                # to the left end of a hit and its length, under the watch
+                # of a regexJob. A search that was stopped is no hit.
+                hit = self.watch(regexFind, self.regexp,
+                                 docText(doc, workTc.selectionStart(),
+                                         workTc.selectionEnd()), backward)
                 # if we have a hit, create a cursor that spans it.
-                if fpos > -1:
+                if (hit is not None) and (hit[0] > -1):
+                    (fpos, length) = hit
                     findTc = QTextCursor(startTc)
                     findTc.setPosition(workTc.selectionStart()+fpos)
                     findTc.movePosition(QTextCursor.Right,
-                                        QTextCursor.KeepAnchor,
-                                        self.regexp.matchedLength())
+                                        QTextCursor.KeepAnchor, length)
+        return findTc
+
+    # The find text and switches that decide what a search matches.
+    def searchState(self):
+        return (unicode(self.findText.text()), self.regexSwitch.isChecked(),
+                self.wholeWordSwitch.isChecked(), self.caseSwitch.isChecked())
+
+    # When the find text is a word or char put there by censusFinder, and
+    # nothing has changed since, ask the editor for the offset of the
+    # occurrence we want from its census. Take the position from the edit
+    # cursor as doSearch does: a forward search finds a match starting past
+    # the start of the selection, a backward one before it. Return a cursor
+    # as realSearch does, or None if the census can't say.
+    def indexSearch(self, button):
+        if (self.censusKey is None) or self.inSelSwitch.isChecked() \
+        or (self.censusState != self.searchState()) :
+            return None
+        (kind, key) = self.censusKey
+        offset = IMC.editWidget.findOccurrence(kind, key,
+                                               self.searchPosition(button), button)
+        if offset is None :
+            return None
+        return self.hitCursor(offset, self.findText.text().size())
+
+    # When we know all the matches and the document has not changed since,
+    # find the one we want by a binary search. The list holds the hits
+    # replace-all would make, one after another, so we use it only when
+    # those are all the matches there are and a search would find the
+    # same, see the prologue. Return a cursor as realSearch does, or None
+    # if we can't say.
+    def matchSearch(self, button):
+        if (self.matches is None) or self.inSelSwitch.isChecked() \
+        or (IMC.editWidget.document().revision() != self.matchRevision) :
+            return None
+        if self.regexSwitch.isChecked() or self.wholeWordSwitch.isChecked() \
+        or (not self.caseSwitch.isChecked()) \
+        or selfOverlaps(unicode(self.findText.text())) :
+            return None
+        (starts, lengths) = self.matches
+        position = self.searchPosition(button)
+        if button == 2 :
+            i = 0
+        elif button == 3 :
+            i = len(starts) - 1
+        elif button == 0 : # the first starting after position
+            i = bisect_right(starts, position)
+        else : # the last starting before position
+            i = bisect_left(starts, position) - 1
+        if 0 <= i < len(starts) :
+            return self.hitCursor(starts[i], lengths[i])
+        return self.hitCursor(-1, 0)
+
+    # The position from which indexSearch and matchSearch look for a hit,
+    # taken from the edit cursor as doSearch does: a forward search finds a
+    # hit starting after it, a backward one a hit starting before it.
+    def searchPosition(self, button):
+        editTc = IMC.editWidget.textCursor()
+        if editTc.hasSelection() :
+            return editTc.selectionStart()
+        return editTc.position() - (0 if button & 0x01 else 1)
+
+    # Return a cursor selecting a hit, or with no selection for no-match
+    # when offset is -1.
+    def hitCursor(self, offset, length):
+        findTc = QTextCursor(IMC.editWidget.textCursor())
+        findTc.clearSelection() # null cursor says no-match
+        if offset >= 0 :
+            findTc.setPosition(offset)
+            findTc.setPosition(offset + length, QTextCursor.KeepAnchor)
         return findTc
 
+    # The QTextDocument.find flags for a normal string search.
+    def findFlags(self, backward):
+        flags = QTextDocument.FindBackward if backward \
+              else QTextDocument.FindFlags(0)
+        if self.caseSwitch.isChecked() :
+            flags |= QTextDocument.FindCaseSensitively
+        if self.wholeWordSwitch.isChecked() :
+            flags |= QTextDocument.FindWholeWords
+        return flags
+
+    # Search as realSearch does, but only in the lines the trigram index
+    # says may hold a literal string that every match must contain: for a
+    # normal search the find text, for a regex the string patternFragment
+    # finds in it. Return None if there is no such string of 3 chars or
+    # more, so realSearch must search the whole range.
+    #
+    # A normal match is within one line, so we just start the find at the
+    # first line that may hold it. A regex match may span as many lines as
+    # its pattern has line-ends, say n, and so may start up to n lines
+    # before a line that holds the string and end n lines after one. We
+    # apply the regex to each such window in turn, not going outside the
+    # range or past the start, until it matches. Windows that overlap or
+    # adjoin are merged into one, as the first alone could end partway
+    # into the leftmost match and give a wrong match or none. Nothing in the pattern
+    # (see patternFragment) can match differently in a window than in all
+    # the text realSearch would copy. As in realSearch, the regex runs under
+    # watch, in a regexJob for each GramWindowChars or so of windows.
+    def gramSearch(self, doc, startTc, backward):
+        start = startTc.position()
+        top = self.rangeTop.position()
+        bot = self.rangeBot.position()
+        regex = self.regexSwitch.isChecked()
+        if regex :
+            if not self.setRegex() :
+                return None
+            fragment = pqGrams.patternFragment(self.regexp.pattern())
+            if fragment is None :
+                return None
+            (string, span) = fragment
+        else :
+            string = unicode(self.findText.text())
+            span = 0
+            if len(string) < 3 :
+                return None
+        first = doc.findBlock(start).blockNumber()
+        if backward :
+            last = doc.findBlock(top).blockNumber()
+        else :
+            last = doc.findBlock(bot).blockNumber()
+        findTc = QTextCursor(startTc) # null cursor says no-match
+        findTc.clearSelection()
+        workTc = QTextCursor(startTc)
+        spans = [] # (lo, hi) of the windows not yet searched
+        size = 0
+        candidates = self.grams.candidates(string, first, last, backward)
+        while True :
+            bn = next(candidates, None)
+            if bn is not None :
+                if not regex :
+                    qtb = doc.findBlockByNumber(bn)
+                    if backward :
+                        workTc.setPosition(min(start, qtb.position() + qtb.length() - 1))
+                    else :
+                        workTc.setPosition(max(start, qtb.position()))
+                    return doc.find(self.findText.text(), workTc,
+                                    self.findFlags(backward))
+                qtbTop = doc.findBlockByNumber(max(0, bn - span))
+                qtbBot = doc.findBlockByNumber(min(doc.blockCount() - 1, bn + span))
+                lo = qtbTop.position()
+                hi = qtbBot.position() + qtbBot.length() - 1
+                if backward :
+                    (lo, hi) = (max(lo, top), min(hi, start))
+                else :
+                    (lo, hi) = (max(lo, start), min(hi, bot))
+                if hi < lo :
+                    continue
+                if spans :
+                    (plo, phi) = spans[-1]
+                    if backward and hi >= plo - 1 :
+                        spans[-1] = (min(lo, plo), phi)
+                        size += max(0, plo - lo)
+                        continue
+                    if (not backward) and lo <= phi + 1 :
+                        spans[-1] = (plo, max(hi, phi))
+                        size += max(0, hi - phi)
+                        continue
+            if spans and ((bn is None) or (size >= GramWindowChars)) :
+                windows = [] # (offset, text) of each span
+                for (wlo, whi) in spans :
+                    workTc.setPosition(wlo)
+                    workTc.setPosition(whi, QTextCursor.KeepAnchor)
+                    windows.append( (wlo, unicode(workTc.selectedText())) )
+                hit = self.watch(windowFind, self.regexp, windows, backward)
+                if hit is None : # stopped, and the user told why
+                    return findTc
+                if hit[0] > -1 :
+                    findTc.setPosition(hit[0])
+                    findTc.setPosition(hit[0] + hit[1], QTextCursor.KeepAnchor)
+                    return findTc
+                spans = []
+                size = 0
+            if bn is None :
+                return findTc
+            spans.append( (lo, hi) )
+            size += hi - lo
+
+    # Make self.regexp ready to search: if it contains \n replace that with
+    # \u2029, and set its case and greedy switches. Return its validity.
+    def setRegex(self):
+        if not self.regexp.isValid() :
+            return False
+        pats = self.regexp.pattern()
+        pats.replace(QString("\\n"),IMC.QtLineDelim)
+        self.regexp.setPattern(pats)
+        self.regexp.setCaseSensitivity(
+            Qt.CaseSensitive if self.caseSwitch.isChecked() \
+            else Qt.CaseInsensitive)
+        self.regexp.setMinimal(not self.greedySwitch.isChecked())
+        return True
+
+    # Return a copy of the find regexp, with its latest settings of case
+    # and minimal, for replacing in the text of a hit: if it has a trailing
+    # lookahead, delete it and make the copy greedy (see prologue).
+    def replaceRegex(self):
+        return stripLookahead(self.regexp, self.lookAheadFinder)
+
+    # Find all the hits in the search range for replace-all, and return a
+    # list of (position, length, replacement) in document order, or None if
+    # the search was stopped. Each search starts at the end of the previous
+    # hit, as in the prologue. A regex search by realSearch copies the text
+    # from its start to the end of the range, so to make the list that way
+    # costs time and memory in the square of the number of hits. Instead we
+    # copy the range once and a regexJob scans it forward, see scanHits.
+    # qrep is the replace string, with \n made \u2029 for a regex.
+    def findAllHits(self, qrep):
+        hits = []
+        doc = IMC.editWidget.document()
+        if not self.regexSwitch.isChecked() :
+            # QTextDocument.find goes from the cursor and copies nothing
+            findTc = self.realSearch(doc,self.rangeTop,False)
+            while self.validHit(findTc):
+                start = findTc.selectionStart()
+                hits.append( (start, findTc.selectionEnd() - start, qrep) )
+                # do the next search from the end of the previous match.
+                findTc.setPosition(findTc.selectionEnd())
+                findTc = self.realSearch(doc,findTc,False)
+            return hits
+        if not self.setRegex() :
+            return hits
+        top = self.rangeTop.position()
+        found = self.watch(scanHits,
+                           docText(doc, top, self.rangeBot.position()),
+                           self.regexp, self.replaceRegex(), qrep)
+        if found is None :
+            return None
+        for (fpos, n, rep) in found :
+            hits.append( (top + fpos, n, QString(rep)) )
+        return hits
+
+    # Run a function of a regex in a regexJob and return its result, or
+    # None if it was stopped. Keep the window painted while it works, but
+    # hold back the user's input, and if it goes on a while, put up an
+    # application-modal dialog with a Cancel button. Stop it if the user
+    # cancels, or if it goes on past self.regexBudget ms, and then say so.
+    # The caller will apply the result to the document as it was when the
+    # job began, so if the document has changed anyway, drop the result.
+    def watch(self, function, *args):
+        revision = IMC.editWidget.document().revision()
+        job = regexJob(function, *args)
+        job.start()
+        dialog = None
+        while not job.wait(RegexPollMs) :
+            if job.elapsed() > self.regexBudget :
+                break
+            if (dialog is None) and (job.elapsed() > RegexQuietMs) :
+                dialog = QProgressDialog(u"Searching...", u"Cancel", 0, 0, self)
+                dialog.setWindowModality(Qt.ApplicationModal)
+                dialog.setMinimumDuration(0)
+                dialog.show()
+            if dialog is None :
+                QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+            else :
+                QApplication.processEvents()
+                if dialog.wasCanceled() :
+                    break
+        if dialog is not None :
+            dialog.close()
+        if job.done :
+            if IMC.editWidget.document().revision() != revision :
+                pqMsgs.warningMsg(u"The document changed during the search",
+                                  u"The search was dropped; please do it again.")
+                return None
+            return job.result
+        job.stop()
+        if (dialog is None) or not dialog.wasCanceled() :
+            pqMsgs.warningMsg(
+                u"Pattern exceeded {0} ms on this document".format(self.regexBudget),
+                u"The search was stopped. A regex that repeats a repeat, like (a+)+, can take ages to fail.")
+        return None
+
+    # Slot for View>Regex Time Limit in pqMain: ask the user for the ms a
+    # regex may run before we stop it.
+    def setRegexBudget(self):
+        (ms, ok) = QInputDialog.getInt(IMC.mainWindow, u"Regex Time Limit",
+            u"Stop a regex search after this many milliseconds",
+            self.regexBudget, 100, 600000, 100)
+        if ok :
+            self.regexBudget = ms
+
     # called with a find-match cursor to see if it is valid, i.e. if it
     # is in the selection bounds.
     def validHit(self,findTc):
@@ -584,7 +1161,11 @@ class findPanel(QWidget):
                     startTc.setPosition(editTc.selectionStart()+1)
         # Perform a search but first, save it in the pushdown list
         self.popups[0].noteString()
-        findTc = self.realSearch(doc, startTc, button&0x01)
+        findTc = self.indexSearch(button)
+        if findTc is None :
+            findTc = self.matchSearch(button)
+        if findTc is None :
+            findTc = self.realSearch(doc, startTc, button&0x01)
         # search is done, finish up: set the visible cursor in the edit window
         # to the found text, and throw the focus over there too.
         if self.validHit(findTc): # got a hit and in-bounds
@@ -635,16 +1216,9 @@ class findPanel(QWidget):
                 return
             self.popups[repno].noteString() # note use on the popup list
             if self.regexSwitch.isChecked() :
-                # make a copy of the current find regexp including its latest
-                # settings of case-sensitive and minimal.
-                qrex = QRegExp(self.regexp)
-                # Find out if it has a trailing lookahead and if so, delete it.
-                lookp = self.lookAheadFinder.indexIn(qrex.pattern())
-                if lookp > -1 : # there is one
-                    qpat = self.regexp.pattern() # get the pattern
-                    qpat.truncate(lookp)  # truncate the "(?=asdf)"
-                    qrex.setPattern(qpat) # put modified pattern back
-                    qrex.setMinimal(False) # make it greedy
+                # make a copy of the current find regexp without any
+                # trailing lookahead.
+                qrex = self.replaceRegex()
                 # Get the currently-selected text as a QString ref
                 qs = tc.selectedText() # get selection as QString
                 # Copy the user's replace string and change \n to psep
@@ -667,26 +1241,23 @@ class findPanel(QWidget):
                 self.doSearch(1) # Prior button
         else: # replace all!
             # For replace all we assume the bounds were set by a prior First
-            # button. We loop doing finds from the top boundary until no-match,
-            # saving a text cursor representing each hit.
+            # button. We find all the hits from the top boundary, with the
+            # text to replace each.
             self.popups[repno].noteString() # note use on the popup list
-            hits = []
             doc = IMC.editWidget.document()
-            findTc = self.realSearch(doc,self.rangeTop,False)
-            while self.validHit(findTc):
-                # we have a match, save a copy of the textCursor that
-                # describes it -- in LIFO order, note.
-                hits.insert(0,QTextCursor(findTc))
-                # do the next search from the end of the previous match.
-                findTc.setPosition(findTc.selectionEnd())
-                findTc = self.realSearch(doc,findTc,False)
+            qrep = QString(self.repEdits[repno].text()) # copy replace string
+            m2 = pqMsgs.trunc(qrep,25)
+            if self.regexSwitch.isChecked():
+                # for regex we support replacing \\n so update rep string
+                qrep.replace(QString("\\n"),IMC.QtLineDelim)
+            hits = self.findAllHits(qrep)
+            if hits is None : # stopped, and the user told why
+                return
             if 0 == len(hits):
                 pqMsgs.flash("Not found",True)
                 return
             # We have at least 1 hit, ask the user for permission to fire.
             m1 = pqMsgs.trunc(self.findText.text(),25)
-            qrep = QString(self.repEdits[repno].text()) # copy replace string
-            m2 = pqMsgs.trunc(qrep,25)
             if pqMsgs.okCancelMsg(
             "Replace {0} occurrences of {1}\nwith {2} ?".format(len(hits),m1,m2)
             ) :
@@ -695,32 +1266,14 @@ class findPanel(QWidget):
                 # and we transfer the position of each hit into it with moves.
                 findTc = QTextCursor(doc)
                 findTc.beginEditBlock() # start undoable operation
-                if self.regexSwitch.isChecked():
-                    # for regex we support replacing \\n so update rep string
-                    qrep.replace(QString("\\n"),IMC.QtLineDelim)
-                    # and get rid of a trailing lookahead in the regex
-                    qrex = QRegExp(self.regexp)
-                    # Find out if it has a trailing lookahead and if so, delete it.
-                    lookp = self.lookAheadFinder.indexIn(qrex.pattern())
-                    if lookp > -1 : # there is one
-                        qpat = self.regexp.pattern() # get the pattern
-                        qpat.truncate(lookp)  # truncate the "(?=asdf)"
-                        qrex.setPattern(qpat) # put modified pattern back
-                        qrex.setMinimal(False) # and make it greedy
-                # The hits were stored in LIFO order, so this loop applies them
-                # from the end of the document up, keeping later positions valid.
-                for tc in hits:
-                    # transfer the selection of this match to findTc
-                    findTc.setPosition(tc.selectionEnd(),QTextCursor.MoveAnchor)
-                    findTc.setPosition(tc.selectionStart(),QTextCursor.KeepAnchor)
-                    if not self.regexSwitch.isChecked():
-                        # simple replace: insert the changed text over it.
-                        findTc.insertText(qrep)
-                    else :
-                        # get the selected text as a string and do regex repl
-                        qs = findTc.selectedText()
-                        qs.replace(qrex, qrep)
-                        findTc.insertText(qs)
+                # Apply the hits from the end of the document up, keeping
+                # the positions of earlier ones valid. We replace each hit
+                # rather than the whole range, so the cursors of the page
+                # table and of notes keep their places.
+                for (start, length, qs) in reversed(hits):
+                    findTc.setPosition(start + length,QTextCursor.MoveAnchor)
+                    findTc.setPosition(start,QTextCursor.KeepAnchor)
+                    findTc.insertText(qs)
                 findTc.endEditBlock()
             # clear the All! whether done or cancelled
             self.allSwitch.setChecked(False)
@@ -763,11 +1316,16 @@ class findPanel(QWidget):
     # bring the find panel to the front. Char panel sometimes passes a
     # replace string, and Words sometimes wants a regex search.
     # Both want Respect Case on, and Word wants Whole Word set.
-    def censusFinder(self,qs,repl=None,rex=False, wword=False ):
+    def censusFinder(self,qs,repl=None,rex=False, wword=False, occurs=None ):
         self.findText.setText(qs)
         self.regexSwitch.setChecked(rex)
         self.wholeWordSwitch.setChecked(wword)
         self.caseSwitch.setChecked(True)
+        # occurs is (kind, key) of a word or char of the census, whose
+        # occurrences the editor can find without searching, as long as the
+        # user leaves the find text and switches as we set them.
+        self.censusKey = occurs
+        self.censusState = self.searchState()
         if repl is not None:
             self.repEdits[1].setText(repl)
         #if not self.isVisible() :
@@ -781,7 +1339,11 @@ class findPanel(QWidget):
     # Move the dictionary fields from the button into the find dialog fields,
     # Clear any controls not defined in the button.
     def userButtonClick(self,butnum):
-        d = self.userButtons[butnum].udict
+        self.loadButtonDict(self.userButtons[butnum].udict)
+
+    # Load the find and replace fields and switches from a button dict,
+    # for a user button or a row of the button report.
+    def loadButtonDict(self,d):
         self.caseSwitch.setChecked(False)
         if 'case' in d : self.caseSwitch.setChecked(d['case'])
         self.wholeWordSwitch.setChecked(False)
@@ -862,8 +1424,14 @@ class findPanel(QWidget):
     # in the find-button-dicts because we aren't sure the settings file
     # is always unicode.
     def shuttingDown(self):
+        if self.matcher is not None :
+            self.matcher.drop()
+        for thread in strayThreads :
+            thread.wait()
         stgs = IMC.settings
         stgs.beginGroup("Find") # all subsequent keys start with Find.
+        stgs.setValue("regexBudget",self.regexBudget)
+        stgs.setValue("typeSwitch",self.typeSwitch.isChecked())
         stgs.setValue("findList",self.popups[0].list)
         stgs.beginWriteArray("rep") # keys will be Find.rep.#.List
         for i in range(1,4): # that's 1, 2, 3
@@ -900,43 +1468,896 @@ class findPanel(QWidget):
                 stream << endStr
 
     # method for pqMain to call to cause loading of all userbuttons
-    # from a text file. See above for format. See userButton.loadDict
-    # for validation. However, for just a touch of user-friendliness, we
-    # do not require the dict to be on a single line, instead we read and
-    # collect up to the right brace.
-    # n.b. the comparison u"}" == qss.at(x) will fail because a string cannot
-    # match a QChar. Or so it seems. You can do u"}" == qss[x], or what we do here.
+    # from a text file. See above for format, readButtonDefs for reading
+    # it, and userButton.loadDict for validation.
     def loadUserButtons(self,stream):
-        leadingBit = QRegExp("^\s*(\d+)\s*:\s*\{")
-        stopper = QChar(u"}")
-        while not stream.atEnd():
-            qs = stream.readLine().trimmed()
-            if 0 == leadingBit.indexIn(qs) :
-                (bn,ok) = leadingBit.cap(1).toInt() # just the digits
-                if bn == 99: # code for, highest (empty) one
-                    for i in range(UserButtonMax-1,-1,-1) : # go from low to hi
-                        if self.userButtons[i].udict['label'] == '(empty)' :
-                            bn = i
-                            break
-                    # if loop ends with no hit, bn remains 99
-                if (bn >= 0) and (bn < UserButtonMax):
-                    qss = qs.right((qs.size()-leadingBit.cap(0).size())+1)
-                    while True:
-                        if stopper == qss.at(qss.size()-1):
-                            break
-                        if stream.atEnd():
-                            qss.append(stopper)
-                        else:
-                            qss.append(u" ")
-                            qss.append(stream.readLine().trimmed())
-                    btn = self.userButtons[bn]
-                    btn.loadDict(unicode(qss)) # always sets label
-                    btn.setText(btn.udict['label'])
-                    if 'tooltip' in btn.udict:
-                        btn.setToolTip(QString(btn.udict['tooltip']))
-                # else not valid index to start - ignore it
-            # else doesn't start with n: - maybe blank line? anyway skip it
-        # end of file
+        for (bn, dictrepr) in readButtonDefs(stream) :
+            if bn == 99: # code for, highest (empty) one
+                for i in range(UserButtonMax-1,-1,-1) : # go from low to hi
+                    if self.userButtons[i].udict['label'] == '(empty)' :
+                        bn = i
+                        break
+                # if loop ends with no hit, bn remains 99
+            if (bn >= 0) and (bn < UserButtonMax):
+                btn = self.userButtons[bn]
+                btn.loadDict(dictrepr) # always sets label
+                btn.setText(btn.udict['label'])
+                if 'tooltip' in btn.udict:
+                    btn.setToolTip(QString(btn.udict['tooltip']))
+            # else not valid index to start - ignore it
+
+    # Method for pqMain to run all the buttons of a button file at once and
+    # show a report of how often each one's find text matches and where,
+    # without loading the buttons or moving the edit cursor. Each worker
+    # gets one copy of the document (see docText) and the buttons search it
+    # with a regexJob each, as many at once as the CPU has cores, so a file
+    # of 30 regexes costs about what a few clicks do. A job that runs past self.regexBudget is
+    # stopped and reported as too slow. Hits are counted as replace-all
+    # would make them, over the whole document whatever the in-sel'n setting.
+    def reportButtons(self, stream, title):
+        buttons = []
+        for (bn, dictrepr) in readButtonDefs(stream) :
+            d = checkButtonDict(dictrepr)
+            if (d is not None) and ('find' in d) :
+                buttons.append(d)
+        if 0 == len(buttons) :
+            pqMsgs.warningMsg(u"No find buttons in this file")
+            return
+        doc = IMC.editWidget.document()
+        revision = doc.revision()
+        qs = docText(doc, 0, doc.characterCount() - 1) # what they all search
+        jobs = []
+        for d in buttons :
+            qrex = buttonRegex(d)
+            jobs.append( None if qrex is None else regexJob(matchScan, qs, qrex) )
+        # As in watch, hold back the user's input while they run, and after
+        # a moment put up an application-modal dialog with a Cancel button,
+        # which stops those at work and forgets the rest.
+        dialog = QProgressDialog(u"Running find buttons...", u"Cancel",
+                                 0, len(jobs), self)
+        dialog.setWindowModality(Qt.ApplicationModal)
+        dialog.setMinimumDuration(RegexQuietMs)
+        width = len(regexWorkers) or max(1, QThread.idealThreadCount())
+        waiting = [j for j in jobs if j is not None]
+        running = []
+        done = len(jobs) - len(waiting) # the invalid ones
+        dialog.setValue(done)
+        while running or waiting :
+            while waiting and (len(running) < width) :
+                job = waiting.pop(0)
+                job.start()
+                running.append(job)
+            running[0].wait(RegexPollMs)
+            for job in list(running) :
+                if not job.poll() :
+                    if job.elapsed() <= self.regexBudget :
+                        continue
+                    job.stop()
+                running.remove(job)
+                done += 1
+            dialog.setValue(done)
+            if dialog.isVisible() :
+                QApplication.processEvents()
+                if dialog.wasCanceled() :
+                    break
+            else :
+                QApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+        dialog.close()
+        if running or waiting : # canceled
+            for job in running :
+                job.stop()
+            pqMsgs.flash(u"Find buttons canceled")
+            return
+        if doc.revision() != revision : # edited anyway
+            pqMsgs.warningMsg(u"The document changed while the buttons ran",
+                              u"Their hits are of the old text; please run them again.")
+            return
+        rows = []
+        for (d, job) in zip(buttons, jobs) :
+            if job is None :
+                rows.append( (d, -1, []) ) # invalid regex
+                continue
+            if job.result is None :
+                rows.append( (d, -2, []) ) # stopped
+                continue
+            (starts, lengths) = job.result
+            places = []
+            for pos in starts[:ReportPlaces] :
+                place = u'line {0}'.format(doc.findBlock(pos).blockNumber() + 1)
+                index = IMC.pageTable.getIndex(pos)
+                if index >= 0 :
+                    place = u'p.{0} '.format(unicode(IMC.pageTable.getScan(index))) + place
+                places.append(place)
+            rows.append( (d, len(starts), places) )
+        self.report = buttonReport(rows, title)
+        self.connect(self.report, SIGNAL("loadButton"), self.reportRowClick)
+        self.report.show()
+
+    # Method for pqMain to apply the replacements of a button file in
+    # order, as if each button were loaded and Replace All clicked with its
+    # first replace string, but on a copy of the document, not the
+    # document. Buttons without a first replace string are passed over.
+    # Each step is a replace-all over the whole copy, with the
+    # same hits and replacements findAllHits would make. After the user
+    # sees the count of each step and agrees, the editor puts the result
+    # in the document as the few changes that turn it into the result, as
+    # one undoable edit, see PPTextEditor.applyText. Each step runs in a
+    # regexJob under watch, and if one is stopped, nothing is changed. Where
+    # each page starts is carried through the hits of every step, so the
+    # page table comes out exactly where the replacements put its text.
+    def pipeButtons(self, stream, title):
+        buttons = []
+        for (bn, dictrepr) in readButtonDefs(stream) :
+            d = checkButtonDict(dictrepr)
+            if (d is not None) and ('find' in d) and ('rep1' in d) :
+                buttons.append(d)
+        if 0 == len(buttons) :
+            pqMsgs.warningMsg(u"No find/replace buttons in this file")
+            return
+        doc = IMC.editWidget.document()
+        revision = doc.revision()
+        tc = QTextCursor(doc)
+        tc.select(QTextCursor.Document)
+        old = tc.selectedText()
+        qs = old
+        counts = []
+        pages = IMC.pageTable
+        moved = [pages.getCursor(i).position() for i in range(pages.size())]
+        pqMsgs.startBar(len(buttons), u"Applying replacements")
+        for (i, d) in enumerate(buttons) :
+            step = self.watch(replaceStep, qs, d, self.lookAheadFinder)
+            if step is None : # stopped, and the user was told
+                pqMsgs.endBar()
+                return
+            (text, count, hits) = step
+            if text is not None :
+                qs = QString(text)
+                moved = mapThroughHits(moved, hits)
+            counts.append(count)
+            pqMsgs.rollBar(i + 1)
+        pqMsgs.endBar()
+        total = sum(c for c in counts if c > 0)
+        steps = u'\n'.join(
+            u'{0}: {1}'.format(d['label'], u'bad regex' if c < 0 else c)
+            for (d, c) in zip(buttons, counts) )
+        if 0 == total :
+            pqMsgs.infoMsg(u"No replacements made by " + unicode(title), steps)
+            return
+        if doc.revision() != revision : # edited while the bar rolled
+            pqMsgs.warningMsg(u"The document changed during the replacements",
+                              u"Nothing was replaced; please run them again.")
+            return
+        if pqMsgs.okCancelMsg(
+            u"Make {0} replacements in {1} steps from {2}?".format(
+                total, len(buttons), unicode(title)), steps ) :
+            IMC.editWidget.applyText(old, qs, moved)
+
+    # Slot for a double-click on a row of the button report: load that
+    # button and find its first hit.
+    def reportRowClick(self, d):
+        self.loadButtonDict(d)
+        self.doSearch(2)
+
+# Return a copy of a regex for replacing in the text of a hit: if it has a
+# trailing lookahead, delete it and make the copy greedy (see prologue).
+
+def stripLookahead(regexp, lookAheadFinder):
+    qrex = QRegExp(regexp)
+    lookp = lookAheadFinder.indexIn(qrex.pattern())
+    if lookp > -1 : # there is one
+        qpat = regexp.pattern() # get the pattern
+        qpat.truncate(lookp)  # truncate the "(?=asdf)"
+        qrex.setPattern(qpat) # put modified pattern back
+        qrex.setMinimal(False) # make it greedy
+    return qrex
+
+# Return True if a string can overlap itself, as "aa" does in "aaa" or
+# "abab" in "ababab": some proper prefix of it is also a suffix.
+
+def selfOverlaps(string):
+    for k in range(1, len(string)) :
+        if string.startswith(string[k:]) :
+            return True
+    return False
+
+# Look at a regex pattern for the shape that can take ages to fail: a group
+# that is repeated without limit, by * + or {n,}, holding something that is
+# itself repeated, like (a+)+ or (\w+\s?)*, or alternatives of which one
+# is another over again, like (a|aa)+. On a long stretch that nearly
+# matches, the regex tries every way of sharing the text out among the
+# repeats. Return a warning to show the user, or None if we see no such
+# shape. This is only a look at the pattern: a regex we pass can still be
+# slow, and one we warn of may be quick on the text it meets.
+
+def riskyPattern(pattern):
+    p = unicode(pattern)
+    inner = [] # for each open group, whether it holds a repeat
+    opens = [] # and the index where its body begins
+    i = 0
+    while i < len(p) :
+        c = p[i]
+        i += 1
+        if c == '\\' :
+            i += 1
+        elif c == '[' :
+            j = pqGrams.classEnd(p, i)
+            if j is None :
+                return None
+            i = j + 1
+        elif c == '(' :
+            if p[i:i+1] == '?' : # (?: (?= (?!
+                i += 2
+            inner.append(False)
+            opens.append(i)
+            continue
+        elif c == ')' :
+            if not inner :
+                return None
+            body = p[opens.pop():i-1]
+            (many, unbounded, i) = repeatAt(p, i)
+            held = inner.pop() or repeatedBranch(body)
+            if held and unbounded :
+                return u"This regex repeats a group that holds a repeat, " \
+                       u"and may take a very long time to fail. " \
+                       u"Searches that run too long will be stopped."
+            if inner and (held or many) :
+                inner[-1] = True
+            continue
+        # a single char, escape, or class, which may be repeated
+        (many, unbounded, i) = repeatAt(p, i)
+        if inner and many :
+            inner[-1] = True
+    return None
+
+# Return True if of the alternatives of a group body, one is another one
+# repeated, as in (a|aa) or (ab|abab), so a run of them can be split up in
+# many ways.
+
+def repeatedBranch(body):
+    branches = []
+    depth = 0
+    b = 0
+    i = 0
+    while i < len(body) :
+        c = body[i]
+        i += 1
+        if c == '\\' :
+            i += 1
+        elif c == '[' :
+            j = pqGrams.classEnd(body, i)
+            if j is None :
+                return False
+            i = j + 1
+        elif c == '(' :
+            depth += 1
+        elif c == ')' :
+            depth -= 1
+        elif c == '|' and depth == 0 :
+            branches.append(body[b:i-1])
+            b = i
+    branches.append(body[b:])
+    for x in branches :
+        for y in branches :
+            if x and (len(y) > len(x)) and (len(y) % len(x) == 0) \
+            and (y == x * (len(y) // len(x))) :
+                return True
+    return False
+
+# Look for a quantifier at index i of a pattern and return (whether it
+# allows more than one, whether it has no limit, index after it). A fixed
+# count like {3} allows only one way to match, so it is no repeat here:
+# (\d{3})+ is quick, where (\d{1,3})+ is not.
+
+def repeatAt(p, i):
+    (least, j) = pqGrams.quantifier(p, i)
+    q = p[i:j].rstrip('?')
+    if q in ('*', '+') or q.endswith(',}') :
+        return (True, True, j)
+    if q.startswith('{') :
+        counts = q[1:-1].split(',')
+        if len(counts) == 1 : # {n}
+            return (False, False, j)
+        return (int(counts[-1]) > 1 if counts[-1].isdigit() else False, False, j)
+    return (False, False, j)
+
+# Read the button definitions of a file: yield (n, dictrepr) for each, where
+# n is the button number before the colon and dictrepr the text of the dict
+# as a Python string. We do not require the dict to be on a single line,
+# instead we read and collect up to the right brace.
+# n.b. the comparison u"}" == qss.at(x) will fail because a string cannot
+# match a QChar. Or so it seems. You can do u"}" == qss[x], or what we do here.
+
+def readButtonDefs(stream):
+    leadingBit = QRegExp("^\s*(\d+)\s*:\s*\{")
+    stopper = QChar(u"}")
+    while not stream.atEnd():
+        qs = stream.readLine().trimmed()
+        if 0 == leadingBit.indexIn(qs) :
+            (bn,ok) = leadingBit.cap(1).toInt() # just the digits
+            qss = qs.right((qs.size()-leadingBit.cap(0).size())+1)
+            while True:
+                if stopper == qss.at(qss.size()-1):
+                    break
+                if stream.atEnd():
+                    qss.append(stopper)
+                else:
+                    qss.append(u" ")
+                    qss.append(stream.readLine().trimmed())
+            yield (bn, unicode(qss))
+        # else doesn't start with n: - maybe blank line? anyway skip it
+
+# Apply one step of pipeButtons: replace all the hits of a button's find
+# text in a QString with its rep1 string, as findAllHits and doReplace
+# would in the document. This runs in a regexJob, so return the new text
+# as a Python string, with the count of hits and a list of the hits as
+# (start, length, length of its replacement) in qs; or None and 0 if there
+# are none, or None and -1 if the button's regex is not valid.
+
+def replaceStep(qs, d, lookAheadFinder):
+    qrex = buttonRegex(d)
+    if qrex is None :
+        return (None, -1, [])
+    qrep = QString(d['rep1'])
+    regex = d.get('regex', False)
+    if regex :
+        qrep.replace(QString("\\n"),IMC.QtLineDelim)
+        hitRex = stripLookahead(qrex, lookAheadFinder)
+    out = QString()
+    hits = []
+    done = 0 # qs is copied to out up to here
+    fpos = qrex.indexIn(qs, 0, QRegExp.CaretAtOffset)
+    while fpos > -1 :
+        n = qrex.matchedLength()
+        if n == 0 : # an empty match is no hit
+            break
+        out.append(qs.mid(done, fpos - done))
+        if regex :
+            qhit = qs.mid(fpos, n)
+            qhit.replace(hitRex, qrep)
+        else :
+            qhit = qrep
+        out.append(qhit)
+        hits.append( (fpos, n, qhit.size()) )
+        done = fpos + n
+        fpos = qrex.indexIn(qs, done, QRegExp.CaretAtOffset)
+    if len(hits) == 0 :
+        return (None, 0, hits)
+    out.append(qs.mid(done))
+    return (unicode(out), len(hits), hits)
+
+# Carry a list of positions in the text a replaceStep was given to where
+# they are in the text it returned, from its list of hits. Text outside the
+# hits moves by what the hits before it added or took away; a position
+# inside a hit goes to the start of what replaced it.
+
+def mapThroughHits(positions, hits):
+    starts = [start for (start, n, m) in hits]
+    shifts = [0] # shifts[k] = change in length made by the first k hits
+    for (start, n, m) in hits :
+        shifts.append(shifts[-1] + m - n)
+    moved = []
+    for pos in positions :
+        k = bisect_right(starts, pos) # hits starting at or before pos
+        if k and pos < starts[k-1] + hits[k-1][1] :
+            moved.append(starts[k-1] + shifts[k-1])
+        else :
+            moved.append(pos + shifts[k])
+    return moved
+
+# Make the QRegExp that finds what a button dict's find text finds, as the
+# find panel would with the button's switches loaded (see also
+# findPanel.startMatching). Return None for an invalid regex.
+
+def buttonRegex(d):
+    qs = QString(d['find'])
+    cs = Qt.CaseSensitive if d.get('case', False) else Qt.CaseInsensitive
+    if d.get('regex', False) :
+        qs.replace(QString("\\n"),IMC.QtLineDelim)
+        qrex = QRegExp(qs, cs, QRegExp.RegExp2)
+        qrex.setMinimal(not d.get('greedy', False))
+        return qrex if qrex.isValid() else None
+    qs = QRegExp.escape(qs)
+    if d.get('word', False) :
+        qs = QString(u'\\b') + qs + QString(u'\\b')
+    return QRegExp(qs, cs, QRegExp.RegExp2)
+
+# The report of running all the buttons of a file. Each row shows a
+# button's label, find text, count of hits and the page and line of the
+# first few. Double-click a row to load its button into the find panel.
+
+class buttonReport(QDialog):
+    def __init__(self, rows, title, parent=None):
+        super(buttonReport, self).__init__(parent)
+        self.setWindowTitle(u"Find buttons of " + unicode(title))
+        self.dicts = [d for (d, count, places) in rows]
+        table = QTableWidget(len(rows), 4)
+        table.setHorizontalHeaderLabels(
+            QStringList([u"Button", u"Find", u"Hits", u"First hits at"]) )
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        for (row, (d, count, places)) in enumerate(rows) :
+            table.setItem(row, 0, QTableWidgetItem(QString(d['label'])))
+            table.setItem(row, 1, QTableWidgetItem(QString(d['find'])))
+            item = QTableWidgetItem(QString(u'bad regex' if count == -1 \
+                else u'too slow' if count == -2 else unicode(count)) )
+            item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            table.setItem(row, 2, item)
+            table.setItem(row, 3, QTableWidgetItem(QString(u', '.join(places))))
+        table.resizeColumnsToContents()
+        self.connect(table, SIGNAL("cellDoubleClicked(int,int)"),
+                     self.rowClick)
+        layout = QVBoxLayout()
+        layout.addWidget(table)
+        self.setLayout(layout)
+        self.resize(720, 400)
+
+    def rowClick(self, row, col):
+        self.emit(SIGNAL("loadButton"), self.dicts[row])
+
+# A regex search run apart from the GUI so it can be stopped. A QRegExp
+# can't be interrupted, and a pattern like (a+)+ can run for hours on a
+# line it doesn't match, so we don't let one run in the GUI thread. Where
+# we can fork, a regexJob is sent to one of the regexWorkers, long-lived
+# processes that ppqt forks at startup (see startWorkers), and to stop the
+# job we kill its worker and have the spawner fork another. A QRegExp can't
+# be pickled, so the arguments go as Python values (see packArg) and are
+# made QStrings and QRegExps again in the worker; the result is pickled and
+# must be Python.
+# When every worker is busy, a job waits its turn. Elsewhere the function
+# runs in a jobThread, which can't be stopped, only abandoned to finish in
+# its own time.
+#
+# The owner either calls wait() and poll() until the job is done, as
+# findPanel.watch does, or passes a budget of ms to start() and the job
+# polls itself on a timer and emits jobDone when it is done or has run
+# past the budget, and then overrun is True. Either way result is None
+# if the job was stopped or failed. A job that has run too long or was
+# cancelled is stop()ed, which kills its worker; one that is no longer
+# wanted, because the find text or the document changed, is drop()ped,
+# and its worker finishes it and throws the result away.
+
+class regexJob(QObject):
+    def __init__(self, function, *args):
+        super(regexJob, self).__init__()
+        self.function = function
+        self.args = args
+        self.result = None
+        self.done = False
+        self.overrun = False
+        self.dropped = False
+        self.queued = False # waiting for a worker
+        self.worker = None # the regexWorker doing it, if any
+        self.thread = None # the jobThread when there are none
+        self.started = None
+        self.budget = None
+        self.timer = QTimer()
+        self.timer.setInterval(RegexPollMs)
+        self.connect(self.timer, SIGNAL("timeout()"), self.tick)
+
+    def start(self, budget=None):
+        if regexWorkers :
+            self.queued = True
+            self.dispatch()
+        else :
+            self.started = time.time()
+            self.thread = jobThread(self.function,
+                [a.text() if isinstance(a, docText) else a for a in self.args])
+            self.thread.start()
+            self.args = None
+        if budget is not None :
+            self.budget = budget
+            self.timer.start()
+
+    # Send a queued job to an idle worker if there is one, and return
+    # whether it has gone.
+    def dispatch(self):
+        worker = idleWorker()
+        if worker is None :
+            return False
+        self.started = time.time()
+        worker.send(self, self.function, self.args)
+        self.worker = worker
+        self.queued = False
+        self.args = None
+        return True
+
+    # The ms since the job started, not counting any wait for a worker.
+    def elapsed(self):
+        if self.started is None :
+            return 0
+        return (time.time() - self.started) * 1000
+
+    # Wait up to ms for the job to finish, and return poll().
+    def wait(self, ms):
+        if self.worker is not None :
+            self.worker.conn.poll(ms / 1000)
+        elif self.thread is not None :
+            self.thread.wait(ms)
+        elif self.queued :
+            time.sleep(ms / 1000)
+        return self.poll()
+
+    # Return True if the job is done, taking its result if it just is.
+    def poll(self):
+        if self.done :
+            return True
+        if self.queued and not self.dispatch() :
+            return False
+        if self.worker is not None :
+            (finished, result) = self.worker.take()
+            if not finished :
+                return False
+            self.result = result
+            self.worker = None
+        elif self.thread is not None :
+            if not self.thread.isFinished() :
+                return False
+            self.result = self.thread.result
+            self.thread = None
+        self.done = True
+        self.timer.stop()
+        return True
+
+    # Stop the job if it is at work, killing its worker, and forget it.
+    def stop(self):
+        self.timer.stop()
+        if self.done :
+            return
+        if self.worker is not None :
+            self.worker.restart()
+            self.worker = None
+        elif self.thread is not None :
+            strayThreads.append(self.thread)
+            self.thread = None
+        self.queued = False
+        self.args = None
+        self.done = True
+
+    # Forget the job, leaving its worker to finish it (see idleWorker).
+    def drop(self):
+        self.timer.stop()
+        if self.done :
+            return
+        if self.thread is not None :
+            strayThreads.append(self.thread)
+            self.thread = None
+        self.worker = None
+        self.queued = False
+        self.args = None
+        self.dropped = True
+        self.done = True
+
+    # Timer slot when started with a budget.
+    def tick(self):
+        if not self.poll() :
+            if self.elapsed() <= self.budget :
+                return
+            self.stop()
+            self.overrun = True
+        self.emit(SIGNAL("jobDone"), self)
+
+# The worker processes of the regexJobs, and the number startWorkers forks:
+# enough for the jobs of reportButtons to use every core while a count or
+# a search as you type goes on.
+regexWorkers = []
+RegexWorkerCount = max(2, multiprocessing.cpu_count() + 1)
+
+# Fork the regexWorkers. ppqt calls this at startup, while ours is the only
+# thread, so that no worker has a copy of a lock some other thread holds.
+# Later, when a job overruns and its worker is killed, we can't fork
+# again, as the pool, census and dictionary threads may be running then.
+# So we also fork the regexSpawner, a process that does nothing but fork
+# a new worker when asked. It has one thread, so it is always safe for it
+# to fork. The new worker connects to us through regexListener, a socket
+# only we and our children know the address and key of.
+
+regexSpawner = None # our end of the spawner's pipe, once it is forked
+regexListener = None
+
+def startWorkers():
+    global regexSpawner, regexListener
+    if RegexCanFork :
+        while len(regexWorkers) < RegexWorkerCount :
+            regexWorkers.append(regexWorker())
+        authkey = os.urandom(20)
+        regexListener = multiprocessing.connection.Listener(authkey=authkey)
+        (conn, child) = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=spawnLoop,
+                        args=(child, regexListener.address, authkey))
+        process.daemon = True
+        process.start()
+        child.close()
+        regexSpawner = conn
+
+# This runs in the spawner process: for each request down the pipe, fork a
+# worker that connects back to the listener, and send up its pid. The
+# workers are not the children of a multiprocessing.Process, which may not
+# have any, but plain forks, which the system reaps as they end.
+
+def spawnLoop(conn, address, authkey):
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True :
+        try :
+            conn.recv()
+        except EOFError : # we have quit
+            return
+        pid = os.fork()
+        if pid == 0 :
+            conn.close()
+            try :
+                workLoop(multiprocessing.connection.Client(address,
+                                                           authkey=authkey))
+            finally :
+                os._exit(0)
+        conn.send(pid)
+
+# Have the spawner fork a worker, and return its pid and our end of its
+# connection.
+
+def spawnWorker():
+    regexSpawner.send(None)
+    pid = regexSpawner.recv()
+    return (pid, regexListener.accept())
+
+# Return a worker with no job, or None if all are busy. A worker of a
+# dropped job is idle again when the result comes, which we throw away, or
+# is killed and replaced when the job has run past its budget.
+
+def idleWorker():
+    for worker in regexWorkers :
+        job = worker.job
+        if (job is not None) and job.dropped :
+            if worker.take()[0] :
+                continue
+            if (time.time() - job.started) * 1000 > (job.budget or RegexBudgetMs) :
+                worker.restart()
+    for worker in regexWorkers :
+        if worker.job is None :
+            return worker
+    return None
+
+# One worker process and our end of its pipe, and the job it is doing. At
+# startup we fork it as a multiprocessing.Process; a replacement comes from
+# the spawner, and all we have of it is its pid.
+
+class regexWorker():
+    def __init__(self):
+        self.job = None
+        self.fork()
+
+    def fork(self):
+        self.snapshot = None # the key of the document text it has
+        if regexSpawner is None :
+            (self.conn, child) = multiprocessing.Pipe()
+            self.process = multiprocessing.Process(target=workLoop, args=(child,))
+            self.process.daemon = True
+            self.process.start()
+            child.close() # the process has its own
+            self.pid = self.process.pid
+        else :
+            self.process = None
+            (self.pid, self.conn) = spawnWorker()
+
+    def alive(self):
+        if self.process is not None :
+            return self.process.is_alive()
+        try :
+            os.kill(self.pid, 0)
+        except OSError : # gone, and reaped by the spawner
+            return False
+        return True
+
+    # Kill the process, and with it any job, and get another.
+    def restart(self):
+        if self.process is not None :
+            self.process.terminate()
+            self.process.join()
+        else :
+            try :
+                os.kill(self.pid, signal.SIGTERM)
+            except OSError :
+                pass
+        self.conn.close()
+        self.job = None
+        self.fork()
+
+    # Send a job, with the text of the document if a docText needs it and
+    # the worker has not got it; see docText.
+    def send(self, job, function, args):
+        self.job = job
+        packed = []
+        for arg in args :
+            if isinstance(arg, docText) :
+                key = arg.key()
+                text = None
+                if self.snapshot != key :
+                    text = unicode(arg.text(whole=True))
+                    self.snapshot = key
+                packed.append( (u'docText', key, text, arg.lo, arg.hi) )
+            else :
+                packed.append(packArg(arg))
+        self.conn.send( (function, packed) )
+
+    # Return (True, result) if the job is finished, or (False, None). A
+    # process that died has failed its job and is replaced.
+    def take(self):
+        if not self.conn.poll() :
+            if self.alive() :
+                return (False, None)
+            self.restart()
+            return (True, None)
+        try :
+            result = self.conn.recv()
+        except EOFError : # it closed the pipe as it died
+            self.restart()
+            return (True, None)
+        self.job = None
+        return (True, result)
+
+# This runs in a worker process: do the jobs that come down the pipe until
+# the pipe is closed.
+
+def workLoop(conn):
+    while True :
+        try :
+            (function, args) = conn.recv()
+        except EOFError :
+            return
+        try :
+            result = function(*[unpackArg(a) for a in args])
+        except Exception : # a failed job has no result
+            result = None
+        conn.send(result)
+
+# The arguments of a job go to a worker as Python values: a QRegExp as its
+# pattern and settings, a QString as a Python string, anything else as is.
+# A docText goes as its range and, only if the worker has not got the text
+# of the document as it is now, the text; see regexWorker.send.
+
+def packArg(arg):
+    if isinstance(arg, QRegExp) :
+        return (u'QRegExp', unicode(arg.pattern()),
+                arg.caseSensitivity() == Qt.CaseSensitive,
+                int(arg.patternSyntax()), arg.isMinimal())
+    if isinstance(arg, QString) :
+        return (u'QString', unicode(arg))
+    return (None, arg)
+
+def unpackArg(packed):
+    if packed[0] == u'QRegExp' :
+        (kind, pattern, cs, syntax, minimal) = packed
+        qrex = QRegExp(QString(pattern),
+                       Qt.CaseSensitive if cs else Qt.CaseInsensitive,
+                       QRegExp.PatternSyntax(syntax))
+        qrex.setMinimal(minimal)
+        return qrex
+    if packed[0] == u'QString' :
+        return QString(packed[1])
+    if packed[0] == u'docText' :
+        (kind, key, text, lo, hi) = packed
+        if text is not None :
+            workerSnapshot[:] = [key, QString(text)]
+        return workerSnapshot[1].mid(lo, hi - lo)
+    return packed[1]
+
+# A range of a document as a job's argument, in place of a QString copied
+# from it with a cursor, which the job gets as if it were that copy. Every
+# click of Next would otherwise copy the text from the cursor to the end,
+# make it a Python string and pickle it, all in the GUI thread. Instead a
+# worker keeps the text of the whole document as it was for its latest
+# job, in workerSnapshot, and is sent it again only when the document's
+# revision has changed; otherwise a job sends only where its range is.
+
+workerSnapshot = [None, None] # in a worker, the (key, QString) it holds
+
+class docText(object):
+    def __init__(self, doc, lo, hi):
+        self.doc = doc
+        self.lo = lo
+        self.hi = hi
+
+    # What names the text of the document as it is now.
+    def key(self):
+        return (id(self.doc), self.doc.revision())
+
+    # The text of the range, or of the whole document.
+    def text(self, whole=False):
+        tc = QTextCursor(self.doc)
+        if whole :
+            tc.select(QTextCursor.Document)
+        else :
+            tc.setPosition(self.lo)
+            tc.setPosition(self.hi, QTextCursor.KeepAnchor)
+        return tc.selectedText()
+
+# A regexJob's function, run in a thread where we can't fork. The threads
+# of stopped jobs are kept in strayThreads until they finish, and dropped
+# from it as they do.
+
+strayThreads = []
+
+class jobThread(QThread):
+    def __init__(self, function, args, parent=None):
+        super(jobThread, self).__init__(parent)
+        self.function = function
+        self.args = args
+        self.result = None
+        self.connect(self, SIGNAL("finished()"), self.finish)
+
+    def run(self):
+        self.result = self.function(*self.args)
+        self.args = None
+
+    def finish(self):
+        if self in strayThreads :
+            strayThreads.remove(self)
+
+# The functions of the regexJobs of the findPanel. Find the first match of
+# a regex in a QString, or the last if backward, for realSearch. Return
+# its (position, length), with -1 for no match.
+
+def regexFind(qrex, qs, backward):
+    qrex = QRegExp(qrex) # our own copy, as it keeps state
+    if backward :
+        fpos = qrex.lastIndexIn(qs)
+    else :
+        fpos = qrex.indexIn(qs)
+    return (fpos, qrex.matchedLength())
+
+# Find the first match of a regex in a list of (offset, text) windows of
+# the document, or the last if backward, for gramSearch. Return the offset
+# in the document of the match and its length, with -1 for no match.
+
+def windowFind(qrex, windows, backward):
+    qrex = QRegExp(qrex)
+    for (lo, text) in windows :
+        qs = QString(text)
+        if backward :
+            fpos = qrex.lastIndexIn(qs)
+        else :
+            fpos = qrex.indexIn(qs)
+        if fpos > -1 :
+            return (lo + fpos, qrex.matchedLength())
+    return (-1, 0)
+
+# Find all the matches of a regex in a copy of the document, for the count
+# and marks of the findPanel and for the button report, and return arrays
+# of their starts and lengths. Each search starts at the end of the previous
+# match, as in findAllHits.
+
+def matchScan(qs, qrex):
+    qrex = QRegExp(qrex)
+    starts = array(b'l')
+    lengths = array(b'l')
+    fpos = qrex.indexIn(qs, 0, QRegExp.CaretAtOffset)
+    while fpos > -1 :
+        n = qrex.matchedLength()
+        if n == 0 : # an empty match is no hit
+            break
+        starts.append(fpos)
+        lengths.append(n)
+        fpos = qrex.indexIn(qs, fpos + n, QRegExp.CaretAtOffset)
+    return (starts, lengths)
+
+# Find the hits of a regex in the copy of the search range findAllHits
+# makes, and return a list of (position, length, replacement text) for
+# them. CaretAtOffset lets ^ match where each search starts, as it does in
+# the copy realSearch makes. The replacement text of each hit is its own
+# text replaced with the lookahead-free hitRex, as in a single replace.
+
+def scanHits(qs, qrex, hitRex, qrep):
+    qrex = QRegExp(qrex)
+    hits = []
+    fpos = qrex.indexIn(qs, 0, QRegExp.CaretAtOffset)
+    while fpos > -1 :
+        n = qrex.matchedLength()
+        if n == 0 : # an empty match is no hit, see validHit
+            break
+        qhit = qs.mid(fpos, n)
+        qhit.replace(hitRex, qrep)
+        hits.append( (fpos, n, unicode(qhit)) )
+        fpos = qrex.indexIn(qs, fpos + n, QRegExp.CaretAtOffset)
+    return hits
 
 # We subclass QComboBox to make the recent-string-list pop-ups.
 # One change from default, we set the max width to 32; these are
@@ -1120,28 +2541,36 @@ class userButton(QPushButton):
     # which would only cause an error message to the console when the button
     # is clicked.
     def loadDict(self,dictrepr):
-        try:
-            # validate dictrepr as being strictly a literal dictionary: ast
-            # will throw ValueError if it isn't a good literal and only a literal,
-            # thus avoiding possible code injection. The compiler chokes on
-            # literal tabs so replace tabs with spaces.
-            okdict = ast.literal_eval(dictrepr.replace(u'\t',u' '))
-            # now make sure it was a dict not a list or whatever
-            if not isinstance(okdict,dict) :
-                raise ValueError
-            # and make sure it has a label key
-            if not 'label' in okdict :
-                raise ValueError
-            # and make sure the value of dict['label'] is a string
-            if not ( isinstance(okdict['label'],str) \
-                    or isinstance(okdict['label'],unicode) ):
-                raise ValueError
-            # all good, go ahead and use it
-            self.udict = okdict
-        except StandardError:
+        self.udict = checkButtonDict(dictrepr)
+        if self.udict is None:
             # some error raised, go to minimum default
             self.udict = { 'label':'(empty)', 'tooltip':'Undefined button' }
 
+# Return the dict a button definition string represents, or None if it is
+# not a literal dict with a string label (see userButton.loadDict).
+
+def checkButtonDict(dictrepr):
+    try:
+        # validate dictrepr as being strictly a literal dictionary: ast
+        # will throw ValueError if it isn't a good literal and only a literal,
+        # thus avoiding possible code injection. The compiler chokes on
+        # literal tabs so replace tabs with spaces.
+        okdict = ast.literal_eval(dictrepr.replace(u'\t',u' '))
+        # now make sure it was a dict not a list or whatever
+        if not isinstance(okdict,dict) :
+            raise ValueError
+        # and make sure it has a label key
+        if not 'label' in okdict :
+            raise ValueError
+        # and make sure the value of dict['label'] is a string
+        if not ( isinstance(okdict['label'],str) \
+                or isinstance(okdict['label'],unicode) ):
+            raise ValueError
+        # all good, go ahead and use it
+        return okdict
+    except StandardError:
+        return None
+
 if __name__ == "__main__":
     import sys
     from PyQt4.QtCore import (Qt,QSettings)
@@ -1175,5 +2604,31 @@ banana
     IMC.editWidget.setPlainText(doc)
     widj = findPanel()
     IMC.mainWindow = widj
+    if 'bench' in sys.argv :
+        # Time finding the hits of a regex replace-all by a realSearch per
+        # hit, the old way, and by findAllHits, both in this process.
+        line = 'The quick brown fox jumps over the lazy dog.\n'
+        for nlines in (250, 1000, 4000) :
+            IMC.editWidget.setPlainText(line * nlines)
+            widj.findText.setText(QString('o(?=\\w)'))
+            widj.regexSwitch.setChecked(True)
+            widj.regexp.setPattern(widj.findText.text())
+            widj.setFullRange()
+            doc = IMC.editWidget.document()
+            t0 = time.clock()
+            hits = []
+            findTc = widj.realSearch(doc,widj.rangeTop,False)
+            while widj.validHit(findTc):
+                hits.insert(0,QTextCursor(findTc))
+                findTc.setPosition(findTc.selectionEnd())
+                findTc = widj.realSearch(doc,findTc,False)
+            t1 = time.clock()
+            allHits = widj.findAllHits(QString('0'))
+            t2 = time.clock()
+            assert [h[0] for h in allHits] == \
+                   [tc.selectionStart() for tc in reversed(hits)]
+            print('{0} hits: per-hit search {1:.3f}s, one scan {2:.3f}s'.format(
+                len(allHits), t1-t0, t2-t1))
+        sys.exit(0)
     widj.show()
     app.exec_()
@@ -40,6 +40,8 @@ parseText scans the text and detects all markups, preparing a list
 of work units, one per paragraph or formatted line. This list of work
 units is used by theRealReflow to direct reflow, also by pqTable to
 direct table reflow, and by theRealHTML to direct HMTL conversion.
+The units of the whole document are kept in a unitMap, which follows
+edits and parses again only the part of the document they touched.
 
 theRealReflow controls the process of reflow of a selection or the document.
 It calls parseText then converts each unit returned by the parser according
@@ -50,15 +52,22 @@ It calls parseText then wraps each returned unit in appropriate markup.
 
 Down at the bottom, global gnuWrap performs optimal reformatting of a single
 paragraph, using the Knuth algorithm as copied from the Gnu Core Utilities
-"fmt" utility code.
+"fmt" utility code. On a big reflow, poolWrap runs it on many paragraphs at
+once in a pool of processes.
 
 In the pqTable module, tableReflow and tableHTML do ASCII and HTML conversion
 of tables, based on the work units found by parseText.
 
 '''
 import pqMsgs
+import pqFnote
 import pqTable
-from PyQt4.QtCore import (Qt, QChar,
+import re
+import sys
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from collections import deque, OrderedDict
+from PyQt4.QtCore import (Qt, QChar, QObject,
                           QRegExp,
                           QString, QVariant, SIGNAL )
 from PyQt4.QtGui import(
@@ -294,6 +303,8 @@ class flowPanel(QWidget):
         self.updateItBoSc()
         self.connect(self.htmlSelSwitch, SIGNAL("clicked()"),self.htmlSelection)
         self.connect(self.htmlDocSwitch, SIGNAL("clicked()"),self.htmlDocument)
+        # the work units of the document, kept up to date for parseText
+        self.unitMap = unitMap(self)
         self.stgs.endGroup() # and that's that
 
     # convenience subroutine to make a spinbox recovering its value from
@@ -438,11 +449,14 @@ the type of markup we are in at that point. All these decisions are made on
 the first pass and recorded in a list of dicts, one for each unit.
 
 The second pass operates on the units, working from the bottom of the
-document or selection, up. This is so changes in the text will not alter
-the block numbers of text still to be done. For each unit we pull tokens from
-the unit text and form a new text as a QString with the specified indents.
-Then we insert the reflowed text string to replace the original line(s).
-All updates are done with one QTextCursor set up for a single undo "macro".
+document or selection, up. For each unit we pull tokens from the unit text
+and form a new text as a QString with the specified indents, noting it as an
+edit of the original line(s). The document is not touched until all units
+are done; then the new text of the whole range is made from the edits, and
+the span of it that differs from the old is put in the document with one
+insertText, a single undo operation. Page breaks, bookmarks and footnote
+cursors are carried through the edits as offsets in the text, see
+breakMap, and set at the end.
 
 The reflow work unit produced by parseText below is a dict with these members:
     'T' : type of work unit, specifically
@@ -482,15 +496,35 @@ The reflow work unit produced by parseText below is a dict with these members:
         unitList = self.parseText(topBlock,endBlock)
         if 0 == len(unitList) :
             return # all-blank? or perhaps an error like unbalanced markup
-        # Now do the actual reflowing. unitList has all the paras and single
-        # lines to be hacked. Work from end to top.
+        # Now work out the reflowed text. unitList has all the paras and single
+        # lines to be hacked. Work from end to top, making a list of edits
+        # (start, end, new text) in positions of the document as it is, which
+        # we do not touch until all are made.
         doc = IMC.editWidget.document()
-        # In order to have a single undo/redo operation we have to use a
-        # single QTextCursor, which is this one:
         tc = QTextCursor(IMC.editWidget.textCursor())
-        tc.beginEditBlock() # start single undo/redo macro
         topBlockNumber = topBlock.blockNumber()
         endBlockNumber = endBlock.blockNumber()
+        rangeTop = topBlock.position()
+        rangeEnd = endBlock.position() + endBlock.length() \
+                    - (0 if endBlock != doc.lastBlock() else 1)
+        # On a big reflow, wrap the paragraphs in parallel ahead of time.
+        wrapped = {}
+        if (IMC.pool is not None) and (len(unitList) >= ParallelFlowMinUnits) :
+            wrapped = self.prewrap(unitList, doc, tc)
+        # the page breaks in the range, which follow the edits, see breakMap,
+        # and the ends of the bookmarks and footnote cursors in it, which
+        # follow them the same way, see markOffset.
+        breaks = breakMap(rangeTop, rangeEnd,
+                          [ (i, IMC.pageTable.getCursor(i).position())
+                            for i in range(IMC.pageTable.size()) ])
+        cursors = [c for c in IMC.editWidget.bookMarkList if c is not None]
+        for item in pqFnote.TheFootnoteList :
+            cursors.extend(c for c in (item['R'], item['N']) if c is not None)
+        ends = []
+        for c in cursors :
+            ends.extend( (c.anchor(), c.position()) )
+        marks = breakMap(rangeTop, rangeEnd, list(enumerate(ends)))
+        edits = []
         pqMsgs.startBar((endBlockNumber - topBlockNumber), "Reflowing the text")
         # To support nesting e.g. /* .. /C .. C/ .. */ we need to save and
         # restore the current least-indent-seen value.
@@ -512,8 +546,18 @@ The reflow work unit produced by parseText below is a dict with these members:
                 # start of markup, which we see last in our backward scan
                 if markupCode == u'T' :
                     # top of a table section; pass the table work units to
-                    # pqTable.tableReflow, which will do the needful.
-                    pqTable.tableReflow(tc,doc,unitList[u:tableBottomIndex+1])
+                    # pqTable.tableReflow, which will do the needful. A page
+                    # break or mark in the table goes to the end of the new
+                    # text, as its cursor would when the text is replaced.
+                    (start, end, flowText) = pqTable.tableReflow(tc,doc,
+                                            unitList[u:tableBottomIndex+1])
+                    listOfBreaks = breaks.take(start, end)
+                    listOfMarks = marks.take(start, end)
+                    for pb in listOfBreaks + listOfMarks :
+                        pb[1] = flowText.size()
+                    breaks.put(start, end, flowText.size(), listOfBreaks)
+                    marks.put(start, end, flowText.size(), listOfMarks)
+                    edits.append( (start, end, flowText) )
                 # Whatever type, emerge from this markup block
                 (leastIndent, markupCode) = markStack.pop()
                 continue
@@ -536,80 +580,240 @@ The reflow work unit produced by parseText below is a dict with these members:
                     # reduce that to bring the longest line to the proper
                     # left margin, typically 2 but could be nested deeper.
                     indentAmount = unit['F'] - leastIndent + unit['L']
-                # Click and drag to select the whole line, "dragging" right to left
-                # so as to work with markPageBreaks below. Note blockA.lenth()
-                # includes the linedelim at the end of the line.
+                # Select the whole line: note blockA.length() includes the
+                # linedelim at the end of the line.
                 blockA = doc.findBlockByNumber(blockNumberA)
-                tc.setPosition(blockA.position()+blockA.length()) # click..
-                tc.setPosition(blockA.position(),QTextCursor.KeepAnchor) # ..and draaaag
-                # get the selected text as a QString and mark it up for
-                # page breaks. 98% of the time, listOfBreaks will be []
-                flowText = tc.selectedText()
-                listOfBreaks = markPageBreaks(tc,flowText)
+                start = blockA.position()
+                end = start + blockA.length()
+                tc.setPosition(end)
+                tc.setPosition(start,QTextCursor.KeepAnchor)
+                unitText = tc.selectedText()
+                # Mark any page breaks in the line. 98% of the time,
+                # listOfBreaks will be []
+                listOfBreaks = breaks.take(start, end)
+                listOfMarks = marks.take(start, end)
+                flowText = markBreaks(unitText, listOfBreaks)
                 # strip leading and trailing spaces, and prepend the number
                 # of spaces the line ought to have, and add a newline
                 flowText = flowText.trimmed()
                 flowText = flowText.prepend(QString(u' '*indentAmount))
                 flowText = flowText.append(IMC.QtLineDelim)
-                # Remove any pagebreak marker and note correct pagebreak positions
-                unmarkPageBreaks(tc,flowText,listOfBreaks)
-                # put the text back in the document replacing the existing line,
-                # this horks any pagebreak cursor that fell in that line.
-                tc.insertText(flowText)
-                # Fix up a page break cursor.
-                fixPageBreaks(listOfBreaks)
-                continue # and that's that for this unit
-            # This unit describes a paragraph of one or more lines to reflow.
-            # This includes paras of open text, /Q, and /U, and lines of /P.
-            # set up a text cursor that selects the text to be flowed: First,
-            # set the virtual insertion point after the end of the last line,
-            blockZ = doc.findBlockByNumber(blockNumberZ)
-            block_len = blockZ.length() - (0 if blockZ != doc.lastBlock() else 1)
-            tc.setPosition(blockZ.position() + block_len)
-            # then drag to select up to the beginning of the first line.
-            # Note the result of this is that tc.position < tc.anchor.
-            blockA = blockZ if blockNumberA == blockNumberZ \
-                else doc.findBlockByNumber(blockNumberA)
-            tc.setPosition(blockA.position(),QTextCursor.KeepAnchor)
-            if markupCode == u'P' :
-                # pull Poetry lines back out if they were previously indented
-                # for example if they had previously been reflowed
-                unit['F'] = max(0, unit['F'] - leastIndent)
-                unit['L'] = max(0, unit['L'] - leastIndent)
-            # At this point the text to be flowed is defined by tc.position()
-            # and tc.anchor. Get a QString view of that text.
-            flowText = tc.selectedText()
-            # Record the indices of any page break cursors that point within
-            # that text, and insert ZWNJ characters at the breaks.
-            # This is moved out of line for readability and for access from pqTable.
-            listOfBreaks = markPageBreaks(tc,flowText)
-            # Optimal paragraph wrap is quite lengthy, I'm pulling the code
-            # out of line for readability.
-            flowText = optimalWrap(flowText,unit,
-                                   self.optParaWidth.value(),
-                                   self.maxParaWidth.value(),
-                                   self.itbosc)
+                # Remove any pagebreak marker and note where the breaks go
+                unmarkBreaks(flowText, listOfBreaks)
+            else :
+                # This unit describes a paragraph of one or more lines to
+                # reflow. This includes paras of open text, /Q, and /U, and
+                # lines of /P. The text to be flowed runs from the beginning
+                # of the first line to after the end of the last line.
+                blockZ = doc.findBlockByNumber(blockNumberZ)
+                block_len = blockZ.length() - (0 if blockZ != doc.lastBlock() else 1)
+                end = blockZ.position() + block_len
+                blockA = blockZ if blockNumberA == blockNumberZ \
+                    else doc.findBlockByNumber(blockNumberA)
+                start = blockA.position()
+                tc.setPosition(end)
+                tc.setPosition(start,QTextCursor.KeepAnchor)
+                unitText = tc.selectedText()
+                if markupCode == u'P' :
+                    # pull Poetry lines back out if they were previously indented
+                    # for example if they had previously been reflowed
+                    unit['F'] = max(0, unit['F'] - leastIndent)
+                    unit['L'] = max(0, unit['L'] - leastIndent)
+                listOfBreaks = breaks.take(start, end)
+                listOfMarks = marks.take(start, end)
+                if u in wrapped and \
+                wrapped[u][1] == [pb[1] for pb in listOfBreaks] :
+                    # prewrap did this one, with the same page breaks
+                    flowText = wrapped[u][0]
+                    for (pb, p) in zip(listOfBreaks, wrapped[u][2]) :
+                        pb[1] = p
+                elif listOfBreaks :
+                    # Mark the page breaks in the text, wrap it, and note
+                    # where they went. Optimal paragraph wrap is quite
+                    # lengthy, I'm pulling the code out of line for
+                    # readability.
+                    flowText = optimalWrap(markBreaks(unitText, listOfBreaks),
+                                           unit, self.optParaWidth.value(),
+                                           self.maxParaWidth.value(),
+                                           self.itbosc)
+                    unmarkBreaks(flowText, listOfBreaks)
+                elif unit['M'] == u'P' and (not unit['K'].isEmpty()) :
+                    # A numbered poem line is wrapped every time, as that
+                    # may warn that its number overflows the line.
+                    flowText = optimalWrap(unitText, unit,
+                                           self.optParaWidth.value(),
+                                           self.maxParaWidth.value(),
+                                           self.itbosc)
+                else :
+                    # Wrapped the same before? If not, wrap it now.
+                    key = wrapKey(unitText, unit, self.optParaWidth.value(),
+                                  self.maxParaWidth.value(), self.itbosc)
+                    cached = cachedWrap(key)
+                    if cached is not None :
+                        flowText = QString(cached)
+                    else :
+                        flowText = optimalWrap(unitText,unit,
+                                               self.optParaWidth.value(),
+                                               self.maxParaWidth.value(),
+                                               self.itbosc)
+                        cacheWrap(key, flowText, unit, self.optParaWidth.value(),
+                                  self.maxParaWidth.value(), self.itbosc)
             # flowText now has all the tokens of this paragraph or line,
             # including a poem line number if present, appropriately divided
-            # by space and linebreak characters. It may have ZWNJ page break marks.
-            # Now remove those ZWNJs and update the listOfBreaks with new positions.
-            unmarkPageBreaks(tc,flowText,listOfBreaks)
-            # Insert the modified text into the document. This horks the pageTable
-            # cursors but we will repair them.
-            tc.insertText(flowText) # replace selection with reflowed text
-            fixPageBreaks(listOfBreaks)
+            # by space and linebreak characters. Note it as the edit of the
+            # unit, with where its page breaks and marks go.
+            for pb in listOfMarks :
+                pb[1] = markOffset(unitText, flowText, pb[1])
+            breaks.put(start, end, flowText.size(), listOfBreaks)
+            marks.put(start, end, flowText.size(), listOfMarks)
+            edits.append( (start, end, flowText) )
         # end of "for u in reversed range of unitList" loop
-        # Clear the progress bar from the status area
-        pqMsgs.endBar()
-        # Close the single undo/redo macro
+        # Make the new text of the range from the old and the edits, and
+        # count the units changed.
+        tc.setPosition(rangeTop)
+        tc.setPosition(rangeEnd,QTextCursor.KeepAnchor)
+        oldText = tc.selectedText()
+        pieces = []
+        changed = 0
+        at = rangeEnd
+        for (start, end, flowText) in edits :
+            pieces.append(unicode(oldText.mid(end - rangeTop, at - end)))
+            pieces.append(unicode(flowText))
+            if flowText != oldText.mid(start - rangeTop, end - start) :
+                changed += 1
+            at = start
+        pieces.append(unicode(oldText.left(at - rangeTop)))
+        newText = QString(u''.join(reversed(pieces)))
+        # Find the span of the new text that differs from the old: first the
+        # lines the same at each end, then the chars the same at each end of
+        # what is left, so no more is changed than must be.
+        oldLines = oldText.split(IMC.QtLineDelim)
+        newLines = newText.split(IMC.QtLineDelim)
+        limit = min(oldText.size(), newText.size())
+        count = min(len(oldLines), len(newLines))
+        head = 0
+        n = 0
+        while n < count and oldLines[n] == newLines[n] :
+            head += oldLines[n].size() + 1
+            n += 1
+        head = min(head, limit)
+        while head < limit and oldText.at(head) == newText.at(head) :
+            head += 1
+        tail = 0
+        m = 0
+        while m < count - n and \
+        oldLines[len(oldLines) - 1 - m] == newLines[len(newLines) - 1 - m] :
+            tail += oldLines[len(oldLines) - 1 - m].size() + 1
+            m += 1
+        tail = min(tail, limit - head)
+        while tail < limit - head and \
+        oldText.at(oldText.size() - 1 - tail) == newText.at(newText.size() - 1 - tail) :
+            tail += 1
+        # Put that span in the document, one edit, one undo/redo operation.
+        # Then put the page breaks, bookmarks and footnote cursors where the
+        # maps say they go; those not in the range were moved, if at all, by
+        # the edit as they should be.
+        tc.beginEditBlock()
+        if changed :
+            tc.setPosition(rangeTop + head)
+            tc.setPosition(rangeEnd - tail,QTextCursor.KeepAnchor)
+            tc.insertText(newText.mid(head, newText.size() - head - tail))
+        for (index, position) in breaks.positions() :
+            IMC.pageTable.setPosition(index, position)
+        carried = dict(marks.positions())
+        for (n, c) in enumerate(cursors) :
+            if (2 * n in carried) or (2 * n + 1 in carried) :
+                c.setPosition(carried.get(2 * n, c.anchor()))
+                c.setPosition(carried.get(2 * n + 1, c.position()),
+                              QTextCursor.KeepAnchor)
         tc.endEditBlock()
+        # Clear the progress bar from the status area, and say what we did.
+        pqMsgs.endBar()
+        pqMsgs.flash(u"Reflow changed {0} of {1} paragraphs and lines".format(
+            changed, len(edits)), msecs=5000)
         # Reposition the document cursor at the top of the reflowed section,
         # because otherwise on reflow document it ends up in the weeds at the end.
-        IMC.editWidget.textCursor().setPosition(topBlock.position())
+        IMC.editWidget.textCursor().setPosition(rangeTop)
         # and that's reflow, folks.
 
+    # Wrap the paragraphs of a unitList with poolWrap. Return a dict giving,
+    # for the index of each unit wrapped, its new text, the offsets of the
+    # page breaks marked in its old text and their offsets in the new.
+    # theRealReflow wraps any paragraph not in it, or whose breaks are not
+    # those by the time it gets there, in the usual way.
+    def prewrap(self, unitList, doc, tc):
+        stops = sorted(IMC.pageTable.getCursor(i).position()
+                       for i in range(IMC.pageTable.size()))
+        units = []
+        jobs = []
+        for u in range(len(unitList)) :
+            unit = unitList[u]
+            if unit['T'] != u'P' or unit['M'] not in FlowParallelMarkups :
+                continue
+            blockA = doc.findBlockByNumber(unit['A'])
+            blockZ = doc.findBlockByNumber(unit['Z'])
+            start = blockA.position()
+            end = blockZ.position() + blockZ.length() \
+                - (0 if blockZ != doc.lastBlock() else 1)
+            tc.setPosition(end)
+            tc.setPosition(start,QTextCursor.KeepAnchor)
+            offsets = []
+            k = bisect_left(stops, start)
+            while k < len(stops) and stops[k] <= end :
+                offsets.append(stops[k] - start)
+                k += 1
+            text = tc.selectedText()
+            if (not offsets) and wrapKey(text, unit, self.optParaWidth.value(),
+                    self.maxParaWidth.value(), self.itbosc) in wrapCache :
+                continue # theRealReflow will find it there
+            units.append(u)
+            jobs.append( (unicode(text),
+                          unit['F'], unit['L'], unit['R'], offsets) )
+        wrapped = {}
+        pqMsgs.startBar(len(jobs), "Wrapping paragraphs")
+        results = []
+        for chunk in poolWrap(jobs, self.optParaWidth.value(),
+                              self.maxParaWidth.value(), self.itbosc, IMC.pool) :
+            results.extend(chunk)
+            pqMsgs.rollBar(len(results))
+        pqMsgs.endBar()
+        for ((u, (text, moved)), job) in zip(zip(units, results), jobs) :
+            wrapped[u] = (QString(text), job[4], moved)
+            if job[4] :
+                continue # wrapped with marks in, see wrapCache
+            cacheWrap(wrapKey(job[0], unitList[u], self.optParaWidth.value(),
+                              self.maxParaWidth.value(), self.itbosc),
+                      wrapped[u][0], unitList[u], self.optParaWidth.value(),
+                      self.maxParaWidth.value(), self.itbosc)
+        return wrapped
+
     # This is the text parser used by theRealReflow and theRealHTML.
-    # Parse a span of text lines into work units, as documented above.
+    # Return the work units of a span of text lines, as documented above,
+    # from the unitMap when it has them, else by scanText. If the markups
+    # are not balanced, say so and return [].
+    def parseText(self,topBlock,endBlock):
+        (unitList, problem) = self.unitMap.units(topBlock,endBlock)
+        if problem is not None :
+            pqMsgs.warningMsg(*problem)
+            return []
+        return unitList
+
+    # Return the settings the parse depends on, so unitMap can tell when
+    # the units it has are no longer those we would make.
+    def parseSettings(self):
+        return (tuple(self.skipIsChecked[m]() for m in u'PQC*T'),
+                tuple(spin.value() for spin in self.bqIndent),
+                tuple(spin.value() for spin in self.poIndent),
+                self.nfLeftIndent.value(), self.maxParaWidth.value())
+
+    # Parse a span of text lines into work units. Return a tuple of
+    #   the list of units;
+    #   a list of (first, last) block numbers of each skipped markup not
+    #     nested in another;
+    #   None, or the two lines of a message about unbalanced markup;
+    #   None, or if resync is given and returned True for the first line of
+    #     a paragraph or markup not nested in another, (its block number,
+    #     count of blank lines before it), having stopped before it.
     # We keep track of the parsing state in a record called PSW (a nostalgic
     # reference to the IBM 360), a dict with these members:
     # S : scanning: True, looking for a para, or False, collecting a para
@@ -620,15 +824,18 @@ The reflow work unit produced by parseText below is a dict with these members:
     # W, shortest existing indent seen in a no-reflow section
     # B, count of blank lines skipped ahead of this line/para
     # K, poem line number when seen
+    # D, depth of nesting of markups
     # Most of these status items get copied into the work units we produce.
     #
     # We permit nesting markups pretty much arbitrarily (nothing can nest
     # inside /X or /T however). In truth only the nest of /P or /R inside
     # /Q block quote is really likely. To keep track of nesting we push the
     # PSW onto a stack when entering a markup, and pop it on exit.
-    def parseText(self,topBlock,endBlock):
+    def scanText(self,topBlock,endBlock,resync=None):
         unitList = []
-        PSW = {'S': True, 'Z':None, 'M':' ', 'P':True, 'F':0, 'L':0, 'R':0, 'W':72, 'B':0}
+        skips = []
+        stop = None
+        PSW = {'S': True, 'Z':None, 'M':' ', 'P':True, 'F':0, 'L':0, 'R':0, 'W':72, 'B':0, 'D':0}
         PSW['W'] = self.maxParaWidth.value()
         stack = []
         # We recognize the start of markup with this RE
@@ -661,11 +868,19 @@ The reflow work unit produced by parseText below is a dict with these members:
                     PSW['B'] += 1
                 else:
                     # We are looking for work and we found a non-empty line!
+                    # If not in any markup, it starts afresh, see unitMap,
+                    # unless the caller wants to stop here.
+                    if PSW['D'] == 0 :
+                        if resync is not None and resync(thisBlockNumber) :
+                            stop = (thisBlockNumber, PSW['B'])
+                            break
+                        PSW['W'] = self.maxParaWidth.value()
                     # But: is it text, or a markup?
                     if 0 == markupRE.indexIn(qs):
                         # We have found a markup! Save our current state.
                         # Note that PSW['S'] is True and stays that way
                         stack.append(PSW.copy())
+                        PSW['D'] += 1
                         # Note the markup type and prepare its end-flag compare value.
                         PSW['M'] = unicode(markupRE.cap(1)) # u'Q', 'P', 'T' etc
                         PSW['Z'] = QString(PSW['M']+u'/') # endmark, 'Q/', 'P/' etc
@@ -718,12 +933,20 @@ The reflow work unit produced by parseText below is a dict with these members:
                             # until we see the end of the section, then pop the stack.
                             # Should we not see the closing mark the stack will be
                             # unbalanced and an error will be issued.
+                            # Note where a skip not nested in another markup
+                            # ends, for unitMap: the end seen, or else the
+                            # end of the span, where the loop doesn't look.
+                            outer = (PSW['D'] == 1)
                             while thisBlock.next() != endBlock:
                                 thisBlock = thisBlock.next()
                                 if thisBlock.text().startsWith(PSW['Z']) :
                                     PSW = stack.pop()
                                     PSW['B'] = 0
                                     break
+                            if outer :
+                                skips.append( (thisBlockNumber,
+                                    thisBlock.blockNumber() if PSW['D'] == 0
+                                    else endBlockNumber) )
                     # markupRE did not see a match, so not starting a markup.
                     # Perhaps we are ending one?
                     elif PSW['Z'] is not None and qs.startsWith(PSW['Z']):
@@ -814,14 +1037,14 @@ The reflow work unit produced by parseText below is a dict with these members:
             # not the last block; move along to the next block
             thisBlock = thisBlock.next()
         # end of while true loop.
+        problem = None
         if len(stack) != 0 :
             # a markup was not closed
             msg1 = "Markup end "+unicode(PSW['Z'])+" not seen!"
             msg2 = "Nothing will be done. Correct and retry."
-            pqMsgs.warningMsg(msg1, msg2)
-            unitList = []
+            problem = (msg1, msg2)
         pqMsgs.endBar()
-        return unitList
+        return (unitList, skips, problem, stop)
 
     # subroutine to update the PSW with F L R indent values for markups, either
     # from a list of three numbers passed in (which would typically come from
@@ -851,7 +1074,7 @@ The reflow work unit produced by parseText below is a dict with these members:
         # a unit record based on the PSW, a type code, and start and end blocks.
         return { 'T':type, 'M':PSW['M'], 'A':ab, 'Z':zb,
                  'F':PSW['F'], 'L':PSW['L'], 'R':PSW['R'],
-                 'W':PSW['W'], 'B':PSW['B'], 'K':QString() }
+                 'W':PSW['W'], 'B':PSW['B'], 'K':QString(), 'D':PSW['D'] }
 
     '''
     Do HTML conversion. Use the textParse method to make a list of units.
@@ -1146,68 +1369,294 @@ markupZ = {
     '*':u'</pre>'
 }
 
+# The unit map keeps the work units of the whole document, as scanText
+# makes them, so that reflow and HTML conversion of a big book need not
+# parse all of it every time. The units are kept as tuples of the fields
+# named in UnitFields, with K a python string, and made into dicts when
+# handed out.
+#
+# The document falls into items, each of which the parse begins in the state
+# of being in no markup: a paragraph of open text, a markup with all it
+# holds, or a skipped markup; between them are only blank lines. An edit
+# marks the lines it touched dirty, as censusCache in pqEdit follows edits,
+# and the next request parses again from the end of the last item before
+# the first dirty line. That parse stops at the start of an item after the
+# last dirty line which was also the start of an item before, and the units
+# from there on are the old ones, moved by the change in line count. A
+# change in the settings of the parse, see parseSettings, means a new parse
+# of the whole document.
+#
+# A request for the whole document is answered from the map, and so is the
+# diagnosis of unbalanced markup. A request for a selection is answered from
+# it when scanText would make the same units: the selection begins at the
+# start of the document or of an item, and ends at the end of an item or in
+# the blank lines after one. Otherwise, or when the document's markup is
+# unbalanced, the selection is parsed as before.
+
+UnitFields = ('T','M','A','Z','F','L','R','W','B','K','D')
+
+class unitMap(QObject):
+    def __init__(self, panel):
+        super(unitMap, self).__init__()
+        self.panel = panel
+        self.document = IMC.editWidget.document()
+        self.connect(self.document, SIGNAL("contentsChange(int,int,int)"),
+                     self.contentsChange)
+        self.reset()
+
+    # Forget the units, to be parsed again when next wanted.
+    def reset(self):
+        self.records = None # unit tuples, or None when not made
+        self.skips = [] # (first, last) block of each skipped markup
+        self.problem = None # or the message about unbalanced markup
+        self.settings = None # parseSettings when they were made
+        self.dirty = None # (first, last) dirty block, numbered as records
+        self.delta = 0 # change in block count since then
+        self.blockCount = self.document.blockCount()
+        self.revision = self.document.revision()
+
+    # Slot for the document's contentsChange signal: widen the dirty lines
+    # to take in those the change touched, numbered as in the records. The
+    # highlighter's changes of format don't change the revision.
+    def contentsChange(self, pos, removed, added):
+        doc = self.document
+        if doc.revision() == self.revision :
+            return
+        self.revision = doc.revision()
+        change = doc.blockCount() - self.blockCount
+        self.blockCount = doc.blockCount()
+        if self.records is None :
+            return
+        first = doc.findBlock(pos)
+        if not first.isValid() :
+            first = doc.lastBlock()
+        last = doc.findBlock(pos + added)
+        if not last.isValid() :
+            last = doc.lastBlock()
+        f = first.blockNumber()
+        l = last.blockNumber() - change # last block replaced
+        if self.dirty is None :
+            self.dirty = (f, l)
+        else :
+            # lines above the dirty ones are numbered the same, those
+            # below are moved by delta
+            (top, bot) = self.dirty
+            if l > bot + self.delta :
+                bot = l - self.delta
+            self.dirty = (min(top, f), bot)
+        self.delta += change
+
+    # Return a record tuple from a unit dict, and the reverse.
+    def record(self, unit):
+        return tuple(unicode(unit[f]) if f == 'K' else unit[f]
+                     for f in UnitFields)
+    def unit(self, record):
+        unit = dict(zip(UnitFields, record))
+        unit['K'] = QString(unit['K'])
+        return unit
+
+    # Bring the records up to date with the document and the settings.
+    def ensure(self):
+        doc = self.document
+        settings = self.panel.parseSettings()
+        if self.records is None or settings != self.settings :
+            (units, self.skips, self.problem, stop) = \
+                self.panel.scanText(doc.begin(), doc.lastBlock())
+            self.records = [self.record(u) for u in units]
+            self.settings = settings
+            self.dirty = None
+            self.delta = 0
+            return
+        if self.dirty is None :
+            return
+        (top, bot) = self.dirty
+        delta = self.delta
+        # Start after the item before the last to begin at or above top.
+        items = self.items()
+        starts = [a for (a, z, kind) in items]
+        k = bisect_right(starts, top) - 1
+        restart = 0 if k < 1 else items[k-1][1] + 1
+        # Stop at an old item start past the dirty lines.
+        later = set(a for a in starts if a > bot)
+        def resync(b):
+            return (b > bot + delta) and ((b - delta) in later)
+        (units, skips, problem, stop) = \
+            self.panel.scanText(doc.findBlockByNumber(restart),
+                                doc.lastBlock(), resync)
+        records = [r for r in self.records if r[2] < restart]
+        records.extend(self.record(u) for u in units)
+        oldSkips = self.skips
+        self.skips = [s for s in oldSkips if s[0] < restart] + skips
+        if stop is None :
+            self.problem = problem
+        else :
+            (b, blanks) = stop
+            old = b - delta
+            for r in self.records :
+                if r[2] >= old :
+                    if r[2] == old : # blank lines before it may differ
+                        r = r[:8] + (blanks,) + r[9:]
+                    records.append(r[:2] + (r[2] + delta, r[3] + delta) + r[4:])
+            self.skips.extend( (a + delta, z + delta)
+                               for (a, z) in oldSkips if a >= old )
+        self.records = records
+        self.dirty = None
+        self.delta = 0
+
+    # Return the items of the document as (first block, last block, kind),
+    # kind being 'P', 'M' or 'S' for a paragraph, markup or skipped markup,
+    # in order. An unclosed markup runs to the end of the document.
+    def items(self):
+        items = [ (a, z, u'S') for (a, z) in self.skips ]
+        top = None
+        for r in self.records :
+            if r[10] == 0 :
+                items.append( (r[2], r[3], u'P') )
+            elif r[10] == 1 and r[0] == u'M' :
+                top = r[2]
+            elif r[10] == 1 and r[0] == u'/' and top is not None :
+                items.append( (top, r[3], u'M') )
+                top = None
+        if top is not None :
+            items.append( (top, self.document.blockCount() - 1, u'M') )
+        items.sort()
+        return items
+
+    # Return (units, problem) for the lines from topBlock to endBlock, as
+    # scanText would make them.
+    def units(self, topBlock, endBlock):
+        self.ensure()
+        t = topBlock.blockNumber()
+        e = endBlock.blockNumber()
+        if t == 0 and e == self.document.blockCount() - 1 :
+            if self.problem is not None :
+                return ([], self.problem)
+            return ([self.unit(r) for r in self.records], None)
+        if self.problem is None :
+            unitList = self.slice(t, e)
+            if unitList is not None :
+                return (unitList, None)
+        (unitList, skips, problem, stop) = self.panel.scanText(topBlock,endBlock)
+        return (unitList, problem)
+
+    # Return the units of the lines t to e if they are what scanText would
+    # make of them alone, else None. Then the first has no blank lines before
+    # it. If e is the end of a skipped markup, scanText treats it as the end
+    # of an unskipped one, so we let it.
+    def slice(self, t, e):
+        items = self.items()
+        starts = [a for (a, z, kind) in items]
+        k = bisect_left(starts, t)
+        if t != 0 and (k == len(starts) or starts[k] != t) :
+            return None
+        j = bisect_right(starts, e) - 1
+        if j >= 0 :
+            (a, z, kind) = items[j]
+            if e < z or (e == z and kind == u'S') :
+                return None
+        unitList = [self.unit(r) for r in self.records if t <= r[2] <= e]
+        if unitList and unitList[0]['A'] == t :
+            unitList[0]['B'] = 0
+        return unitList
+
 # These subroutines of theRealReflow are out of line for readability.
 
-# markPageBreaks receives a cursor and a qstring copy of its selection.
-# For this we assume that the selection was made by "dragging" left to right,
-# i.e. tc.position < tc.anchor.
-# Find any page-break cursor in IMC.pageTable whose position is >= tc.position
-# and < tc.anchor. Create and return a list of those breaks in the form
-# [ [i,p]...] where i is the pageTable index and p its current position.
-# Also, inject \u200C ZWNJ at the position of each pagebreak.
-
-def markPageBreaks(tc,ft):
-    pbl = []
-    A = tc.position()
-    Z = tc.anchor()
-    # Use bisect-right to find the highest page table entry <= Z
-    # (ToDo: we could optimize this based on the knowledge that reflow works
-    # backward through the document and just do a sequential search back
-    # from the last-noted page break, saving the full search for the initial call.)
-    # (OTOH in a 500pp book the below loops at most 8 times. So K.I.S.S.)
-    hi = IMC.pageTable.size()
-    lo = 0
-    while lo < hi:
-        mid = (lo + hi)//2
-        if Z < IMC.pageTable.getCursor(mid).position(): hi = mid
-        else: lo = mid+1
-    # the pagebreak cursor at lo-1 is the greatest <= Z. If it is also
-    # >A then we need to note it and maybe the one(s) preceding it.
-    while True :
-        lo -= 1
-        if lo < 0 :
-            break # second or later iteration (on first, if pageTable is empty)
-        P = IMC.pageTable.getCursor(lo).position()
-        if P < A :
-            break # will often happen on first iteration
-        pbl.append([lo,P])
-        ft.insert(P-A, IMC.ZWNJ)
-    return pbl
-
-# unmarkPageBreaks receives the original cursor, whose position is the base
-# offset of the text, the reflowed text string, and the list prepared
-# by markPageBreaks. It finds and delete the ZWNJs, and updates the position
-# values in the pagebreak list.
-
-def unmarkPageBreaks(tc,ft,pbl):
-    P = tc.position() # base offset of the text
-    for i in reversed(range(len(pbl))) :
-        j = ft.indexOf(IMC.ZWNJ)
-        pbl[i][1] = P + j
-        ft.remove(j,1)
-
-# fixPageBreaks takes a list of pageTable indices and new position values
-# and updates those cursors. Presumably text hs been changed that would
-# invalidate those cursors, but if not, no harm done.
-
-def fixPageBreaks(pbl):
-    for [i,p] in pbl:
-        IMC.pageTable.setPosition(i,p)
+# A breakMap follows the page breaks of a range through the edits reflow
+# makes to it, as the cursors of IMC.pageTable would follow them if each
+# edit were made in the document in turn, from the bottom up; or the same
+# for the ends of other cursors. It is made from a list of (i, position),
+# where i is the pageTable index or whatever the caller keys a cursor by,
+# and holds those in the range, from the bottom up. For an edit of start to
+# end (inclusive, as a break at the end of a paragraph is at the start of
+# the line after it) take() returns a list of [i,p] for the breaks in it,
+# where p is the offset from start. The caller moves each p to where that
+# break falls in the new text, and put() notes the new text's length and
+# puts those breaks back. The breaks below an edit are moved down by the
+# change in length of every edit above them; rather than add it to each, we
+# note the sum so far when a break is passed, and positions() adds the rest
+# at the end.
+
+class breakMap(object):
+    def __init__(self, top, end, breaks):
+        self.shift = 0 # sum of (new - old length) of the edits so far
+        self.passed = [] # (i, position, shift when passed)
+        pending = [ (p, i) for (i, p) in breaks if top <= p <= end ]
+        pending.sort(reverse=True)
+        self.pending = deque([ [i, p] for (p, i) in pending ])
+
+    def take(self, start, end):
+        while self.pending and self.pending[0][1] > end :
+            (i, p) = self.pending.popleft()
+            self.passed.append( (i, p, self.shift) )
+        pbl = []
+        while self.pending and self.pending[0][1] >= start :
+            (i, p) = self.pending.popleft()
+            pbl.append( [i, p - start] )
+        pbl.reverse() # in order of position
+        return pbl
+
+    def put(self, start, end, size, pbl):
+        self.shift += size - (end - start)
+        for (i, p) in pbl :
+            self.pending.appendleft( [i, start + p] )
+
+    # Return (i, position) for each break after all the edits.
+    def positions(self):
+        pbl = [ (i, p + self.shift - shift) for (i, p, shift) in self.passed ]
+        pbl.extend( (i, p) for (i, p) in self.pending )
+        return pbl
+
+# Page breaks are carried through the reflow of a unit by marking them in
+# its text: markBreaks returns a copy of the text with a ZWNJ put in at the
+# offset of each break in pbl, a list of [i, offset] in order of offset as
+# breakMap.take returns it. The marked text is trimmed or wrapped, where a
+# ZWNJ is a nonspace of no width, and unmarkBreaks takes the ZWNJs out of
+# the new text again, setting the offset of each break to where it fell.
+
+def markBreaks(text, pbl):
+    text = QString(text)
+    for pb in reversed(pbl) :
+        text.insert(pb[1], IMC.ZWNJ)
+    return text
+
+def unmarkBreaks(text, pbl):
+    for pb in pbl :
+        pb[1] = text.indexOf(IMC.ZWNJ)
+        text.remove(pb[1], 1)
+    return text
+
+# Other cursors, a bookmark or a footnote anchor or note, are not marked in
+# the text, as the marks could change the wrap. markOffset moves one from
+# offset k in the old text of a unit to the same place in the new text,
+# which has the same nonspace chars in the same order: one on a nonspace
+# char goes to that char, one on a space to just after the nonspace before
+# it (or the start, if none), and one at the end to the end.
+
+def markOffset(old, new, k):
+    if k >= old.size() :
+        return new.size()
+    c = 0 # nonspace chars before k
+    for j in range(k) :
+        if not old.at(j).isSpace() :
+            c += 1
+    after = 0
+    if old.at(k).isSpace() :
+        if c == 0 :
+            return 0
+        (c, after) = (c - 1, 1)
+    for j in range(new.size()) :
+        if not new.at(j).isSpace() :
+            if c == 0 :
+                return j + after
+            c -= 1
+    return new.size()
 
 # tokGen is a generator function that returns the successive tokens from the
-# text selected by a text cursor. Each token is returned as a tuple, (tok,tl)
-# where tok is a QString and tl is its logical length, which may be less than
-# tok.size() when tok contains <i/b/sc> markups.
+# text selected by a text cursor. Each token is returned as a tuple,
+# (tok,tl) where tok is a QString and tl is its logical length, which may be
+# less than tok.size() when tok contains <i/b/sc> markups. optimalWrap now
+# uses tokenize, below, which does the same much faster; tokGen is kept as the reference it is
+# tested against, see the unit test at the bottom.
 
 # Unlike the tokenization in pqEdit, which is focussed on isolating
 # "words" that can be spell-checked, a "token" for reflow purposes is a
@@ -1220,10 +1669,8 @@ def fixPageBreaks(pbl):
 
 # The flowText input is almost always a multiline selection; it has
 # \u2029 instead of \n, but the regexes treat that as \s, so we don't care.
-# The Zero Width Non-Joiner, \u200C, may appear in a token to mark the
-# position of a page-break. \u200C is a nonspace; however its logical width
-# should be recorded as zero. Note it is possible to have 2 page breaks
-# with nothing between, falling inside one paragraph.
+# The Zero Width Non-Joiner, \u200C, may appear in a token. \u200C is a
+# nonspace; however its logical width should be recorded as zero.
 
 # A token or part thereof consists of:
 # * some contiguous non-space things that don't include '<'
@@ -1269,6 +1716,65 @@ def tokGen(flowText, itbosc):
             j = reParts.indexIn(flowText, k)
         yield (token, tok_len)
 
+# tokenize returns the tokens of a python string as tokGen does, but all at
+# once as two lists: the tokens as python strings and their logical
+# lengths. It uses python's re, and takes apart only the tokens
+# with a "<" in them; the logical length of any other is its length less any
+# Zero-width-non-joiners. The two REs are reParts, and a run of its parts,
+# but with the class of spaces spelled out, as QRegExp's \s is not python's.
+
+# Lengths and offsets in a QString or the document count UTF-16 units, in
+# which a char past U+FFFF, like the Fraktur letters, is two. On a wide
+# (UCS4) build of python, len() counts it as one, so tokenize and
+# optimalWrap measure with qsLen, which counts it as two. lenFor returns the
+# function to measure the pieces of a text with: plain len, unless the
+# build is wide and the text has such a char. Also QRegExp sees such a char
+# as two surrogates, neither of which is \w, so a tag name is made of the
+# word chars below U+10000 only.
+
+if sys.maxunicode > 0xFFFF :
+    pyAstral = re.compile(u'[\U00010000-\U0010ffff]')
+    FlowWord = u'[^\\W\U00010000-\U0010ffff]'
+else :
+    pyAstral = None
+    FlowWord = u'\\w'
+
+def qsLen(text):
+    return len(text) + len(pyAstral.findall(text))
+
+def lenFor(text):
+    if (pyAstral is None) or (pyAstral.search(text) is None) :
+        return len
+    return qsLen
+
+FlowSpaces = u'\t\n\x0b\x0c\r \x85\xa0\u1680\u180e\u2000-\u200a\u2028\u2029\u202f\u205f\u3000'
+pyParts = re.compile(u'([^<{0}]+)|(<({1}+)([^>]*)>)|(</({1}+)>)|(<)'.format(
+                     FlowSpaces, FlowWord), re.UNICODE)
+pyTokens = re.compile(u'(?:[^<{0}]+|<{1}+[^>]*>|</{1}+>|<)+'.format(
+                      FlowSpaces, FlowWord), re.UNICODE)
+FlowZWNJ = u'\u200c'
+
+def tokenize(text, itbosc):
+    T = []
+    W = []
+    size = lenFor(text)
+    for m in pyTokens.finditer(text) :
+        tok = m.group(0)
+        T.append(tok)
+        if u'<' not in tok :
+            W.append(size(tok) - tok.count(FlowZWNJ))
+            continue
+        tok_len = 0
+        for p in pyParts.finditer(tok) :
+            tag = p.group(3) or p.group(6)
+            if tag :
+                adjust = itbosc.get(tag, 2) # 0, 1, or 2==as-is
+                tok_len += adjust if adjust < 2 else size(p.group(0))
+            else :
+                tok_len += size(p.group(0)) - p.group(0).count(FlowZWNJ)
+        W.append(tok_len)
+    return (T, W)
+
 # Optimal paragraph wrap. After considerable research, including reading
 # the original Knuth&Plass paper (Software: Practice and Experience, 1981)
 # and looking at several implementations in various languages online I finally
@@ -1282,7 +1788,6 @@ def tokGen(flowText, itbosc):
 # This RE matches the last/only line of a poem with a line number.
 poemLastLineRE = QRegExp(u'\u2029?(.+)( \d+)\u2029$')
 def optimalWrap(flowText,unit,optimum,maximum,itbosc):
-    global tokGen
     # Set up the "too much" cost factor
     SquareRootOfInfinity = 32767
     Infinity = SquareRootOfInfinity * SquareRootOfInfinity
@@ -1291,8 +1796,8 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
     # be seen as a table, with each struct a row and its members, columns.
     # Here we make the same table using parallel lists. If reading the C code,
     # the "struct word" members map as follows:
-    # const char *text -- T[j] as a QString from tokgen
-    # int length       -- W[j] logical token length from tokgen
+    # const char *text -- T[j] as a python string from tokenize
+    # int length       -- W[j] logical token length from tokenize
     # int line_length  -- L[j] length of line starting from here
     # COST best_cost   -- C[j] cost of line of length L[j]
     # WORD *next_break -- P[j] index of first T[j] of following line
@@ -1302,13 +1807,9 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
     # does not use this convention (too bad!) so we can't detect end of a
     # sentence and accordingly the related cost calculations can't be done.
 
-    T = []
-    W = []
-    grossLen = 0
-    for (tok,ll) in tokGen(flowText,itbosc) :
-        T.append(tok)
-        W.append(ll)
-        grossLen += ll
+    text = unicode(flowText)
+    (T, W) = tokenize(text, itbosc)
+    grossLen = sum(W)
     N = len(T) # valid tokens are 0..N-1
     # Set up spacing: The line length is the allowed line size minus the
     # left- and right-indents if any.
@@ -1321,12 +1822,13 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
     firstIndentDiff = unit['F'] - unit['L']
     if (N == 1) or (LMaximum >= (grossLen + (N - 1) + unit['F'])) :
         # There is but one token (any length), or the sum of tokens fits in
-        # the first line, so just put it all together now.
-        flowText = QString(u' '*unit['F'])
+        # the first line, so just put it all together now. We collect the
+        # pieces of the new text in a list and join them at the end.
+        pieces = [u' '*unit['F']]
         for tok in T :
-            flowText.append(tok)
-            flowText.append(QChar(u' '))
-        flowText.append(IMC.QtLineDelim)
+            pieces.append(tok)
+            pieces.append(u' ')
+        pieces.append(u'\u2029')
     else :
         # There is a need to split tokens across lines, using gnuWrap.
         W[0] += firstIndentDiff # W[0] could conceivably be 0 or negative - problem?
@@ -1366,10 +1868,10 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
             scanPtr -= 1
         # end main for-loop
         # prepare the output as a string of lines with proper indents.
-        firstIndent = QString(u' '*unit['F'])
-        leftIndent = QString(u' '*unit['L']) # left-indent space for lines 2-m
-        oneSpace = QString(u' ') # one space between tokens
-        flowText = QString()
+        firstIndent = u' '*unit['F']
+        leftIndent = u' '*unit['L'] # left-indent space for lines 2-m
+        oneSpace = u' ' # one space between tokens
+        pieces = []
         indent = firstIndent
         # Each line extends from T[a] to T[z-1]
         a = 0
@@ -1377,14 +1879,15 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
             spacer = indent
             z = P[a]
             while a < z :
-                flowText.append(spacer)
-                flowText.append(T[a])
+                pieces.append(spacer)
+                pieces.append(T[a])
                 a += 1
                 spacer = oneSpace
-            flowText.append(IMC.QtLineDelim)
+            pieces.append(u'\u2029')
             indent = leftIndent
             if z == N : break
             a = z
+    flowText = QString(u''.join(pieces))
     # At this point we have a single line or multiple lines in flowText.
     # If this is a line of poetry and if it had a line number at the end,
     # we need to insert spaces to slide that last token out. Typically poetry
@@ -1409,14 +1912,134 @@ def optimalWrap(flowText,unit,optimum,maximum,itbosc):
             )
             available = 1
         flowText.insert(flowText.size()-z-1, QString(u' '*available))
-
     return flowText
 
+# The wrap cache. A book is reflowed many times and nearly all of its
+# paragraphs come out the same each time, so we remember the wrapped text of
+# the last WrapCacheSize paragraphs, least recently used first, keyed by
+# everything optimalWrap depends on: the text, F, L, R, K and the markup of
+# the unit, the two widths and itbosc. Two texts whose tokens are the same
+# wrap the same, so the text in the key is its tokens with one space between;
+# but we can't take apart a text with "<" in it that simply, as a token can
+# contain an HTML tag with spaces in it, so then the key has the whole text.
+# The wrapped text is filed under its own key as well, as that is what the
+# next reflow will see. A paragraph with page breaks in it is neither looked
+# up nor filed, as it is wrapped with their marks in it, nor is a numbered
+# poem line, whose wrap may put up a warning that a cache hit would lose.
+WrapCacheSize = 20000
+wrapCache = OrderedDict()
+
+def wrapKey(text, unit, optimum, maximum, itbosc):
+    t = unicode(text)
+    if u'<' not in t :
+        t = u' '.join(w for w in t.replace(u'\u2029', u' ').split(u' ') if w)
+    return (t, unit['F'], unit['L'], unit['R'], unicode(unit['K']),
+            unit['M'], optimum, maximum, tuple(sorted(itbosc.items())))
+
+# Return the cached wrap of a key as a python string, or None.
+
+def cachedWrap(key):
+    text = wrapCache.pop(key, None)
+    if text is not None :
+        wrapCache[key] = text # most recently used
+    return text
+
+# File the wrap of a text under its key, and under the key of the result.
+
+def cacheWrap(key, flowText, unit, optimum, maximum, itbosc):
+    text = unicode(flowText)
+    wrapCache[key] = text
+    wrapCache[wrapKey(text, unit, optimum, maximum, itbosc)] = text
+    while len(wrapCache) > WrapCacheSize :
+        wrapCache.popitem(last=False)
+
+# Parallel reflow. optimalWrap depends only on the text of a paragraph, the
+# F, L and R of its unit, the two widths and itbosc. So where ppqt could fork
+# its pool of processes, IMC.pool (see the parallel census in pqEdit), a
+# reflow of ParallelFlowMinUnits units or more ships its paragraphs to the
+# pool as python strings, with the offsets of the page breaks in each, and
+# gets back the wrapped strings and the breaks' new offsets. That figure is a
+# guess; the pool has not been timed against a serial wrap on more than one
+# processor.
+# Only units of open text, /Q, /U and /F are shipped: lines of poetry are
+# short, and wrapping one may put up a warning, which a worker must not.
+ParallelFlowMinUnits = 1000
+FlowParallelMarkups = (u' ', u'Q', u'U', u'F')
+
+# Wrap a list of paragraphs, each (text, F, L, R, break offsets), with a
+# pool of processes, yielding the results of each chunk in order as a list
+# of (wrapped text, new break offsets) as wrapChunk returns.
+
+def poolWrap(paras, optimum, maximum, itbosc, pool):
+    size = max(len(paras) // (4 * multiprocessing.cpu_count()), 16)
+    jobs = [ (paras[a:a+size], optimum, maximum, itbosc)
+             for a in range(0, len(paras), size) ]
+    for result in pool.imap(wrapChunk, jobs) :
+        yield result
+
+# This runs in a worker process of the parallel reflow, or serially in the
+# benchmark below.
+
+def wrapChunk(job):
+    (paras, optimum, maximum, itbosc) = job
+    results = []
+    for (text, f, l, r, offsets) in paras :
+        unit = {'F':f, 'L':l, 'R':r, 'M':u' ', 'K':QString()}
+        pbl = [ [0, p] for p in offsets ]
+        flowText = optimalWrap(markBreaks(QString(text), pbl), unit,
+                               optimum, maximum, itbosc)
+        unmarkBreaks(flowText, pbl)
+        results.append( (unicode(flowText), [pb[1] for pb in pbl]) )
+    return results
+
 if __name__ == "__main__":
     import sys
     from PyQt4.QtCore import (Qt,QFile,QIODevice,QTextStream,QSettings)
     from PyQt4.QtGui import (QApplication,QPlainTextEdit,QFileDialog,QMainWindow)
     import pqIMC
+    if sys.argv[1:2] == [u'-b'] :
+        # Time the serial paragraph wrap and the process pool, and check
+        # they agree, on a book named on the command line or else on a
+        # synthetic book of ~1MB, with a page break in the middle of every
+        # tenth paragraph.
+        #   python pqFlow.py -b [book.txt]
+        import io
+        import random
+        import time
+        IMC = pqIMC.tricorder()
+        IMC.QtLineDelim = QChar(0x2029)
+        if len(sys.argv) > 2 :
+            text = io.open(sys.argv[2], encoding='UTF-8').read()
+            paras = [p.strip(u'\n') for p in text.split(u'\n\n')]
+        else :
+            random.seed(1)
+            vocab = u"the of and to in a is that it was he for on are with " \
+                    u"as his <i>mother-in-law's</i> bric-a-brac <sc>Einstein</sc> " \
+                    u"couldn't \u00e9t\u00e9 \u00c6sop M\u00fcller don\u2019t".split()
+            paras = []
+            while sum(len(p) for p in paras) < 1000000 :
+                lines = [u' '.join(random.choice(vocab) for w in range(12))
+                         for l in range(random.randint(1, 12))]
+                paras.append(u'\n'.join(lines))
+        jobs = []
+        for (n, p) in enumerate(q for q in paras if q.strip()) :
+            p = p.replace(u'\n', u'\u2029') + u'\u2029'
+            jobs.append( (p, 0, 0, 0, [len(p) // 2] if n % 10 == 0 else []) )
+        itbosc = {'i':1, 'b':0, 'sc':2}
+        print(u'{0} paragraphs, {1} chars, {2} processors'.format(
+            len(jobs), sum(len(j[0]) for j in jobs), multiprocessing.cpu_count()))
+        pool = multiprocessing.Pool() # as ppqt makes IMC.pool, before timing
+        t0 = time.time()
+        serial = wrapChunk((jobs, 55, 75, itbosc))
+        t1 = time.time()
+        parallel = []
+        for chunk in poolWrap(jobs, 55, 75, itbosc, pool) :
+            parallel.extend(chunk)
+        t2 = time.time()
+        pool.terminate()
+        print(u'serial {0:.2f}s, parallel {1:.2f}s'.format(t1 - t0, t2 - t1))
+        print(u'results identical' if serial == parallel else u'RESULTS DIFFER')
+        sys.exit(0)
     app = QApplication(sys.argv) # create an app
     IMC = pqIMC.tricorder() # set up a fake IMC for unit test
     IMC.fontFamily = QString("Courier")
@@ -1429,6 +2052,7 @@ if __name__ == "__main__":
     import pqTable
     pqTable.IMC = IMC
     IMC.editWidget = QPlainTextEdit()
+    IMC.editWidget.bookMarkList = [None] * 9
     IMC.editWidget.setFont(pqMsgs.getMonoFont())
     IMC.settings = QSettings()
     widj = flowPanel()
@@ -1567,6 +2191,87 @@ T/
 /F
 
 F/''')
+    if sys.argv[1:2] == [u'-t'] :
+        # Check tokenize against tokGen on the paragraphs of the test
+        # document and on a corpus of random strings made of pieces that
+        # make trouble: tags with and without spaces, stray < and >, ZWNJs
+        # and other spaces, chars past U+FFFF (two UTF-16 units in a QString
+        # but one python char on a wide build), under all settings of itbosc.
+        #   python pqFlow.py -t
+        import itertools
+        import random
+        paras = [p.replace(u'\n', u'\u2029') for p in unicode(utqs).split(u'\n\n')]
+        random.seed(1)
+        pieces = [u'word', u' ', u'  ', u'\u2029', u'\t', u'<', u'>', u'<i>', u'</i>',
+                  u'<b>', u'</b>', u'<sc>', u'</sc>', u"<span class='x'>",
+                  u'<i\u2029lang="fr">', u'</span>', u'<<', u'</', u'<1>',
+                  u'\u200c', u'\u00a0', u'\u3000', u'\u00e9t\u00e9', u'--',
+                  u'\U0001d504\U0001d51f']
+        for n in range(5000) :
+            paras.append(u''.join(random.choice(pieces)
+                                  for i in range(random.randint(0, 30))))
+        bad = 0
+        for widths in itertools.product((0, 1, 2), repeat=3) :
+            itbosc = dict(zip(('i', 'b', 'sc'), widths))
+            for p in paras :
+                ref = [ (unicode(t), l)
+                        for (t, l) in tokGen(QString(p), itbosc) ]
+                if ref != list(zip(*tokenize(p, itbosc))) :
+                    bad += 1
+                    print(u'DIFFER', repr(p), widths)
+        print(u'{0} strings, {1} differ'.format(27 * len(paras), bad))
+        sys.exit(0)
+    if sys.argv[1:2] == [u'-c'] :
+        # Reflow the test document with this pqFlow and with an older one,
+        # with a page starting at every fifth line (in the middle of some),
+        # and show where the text or the pages differ. Also see that a
+        # bookmark on a word keeps it, and that one undo restores the document. Put the older pqFlow.py and pqTable.py
+        # in a folder, e.g. as they were before reflow was made one edit:
+        #   mkdir old; git archive e6b1cdb~ pqFlow.py pqTable.py | tar -x -C old
+        #   python pqFlow.py -c old
+        import difflib
+        import imp
+        import os
+        sys.path.insert(0, sys.argv[2])
+        newTable = sys.modules.pop('pqTable') # so the old pqFlow gets the old
+        oldFlow = imp.load_source('pqFlowOld',
+                                  os.path.join(sys.argv[2], 'pqFlow.py'))
+        oldFlow.pqTable.IMC = IMC
+        oldFlow.IMC = IMC
+        sys.modules['pqTable'] = newTable
+        def reflowWith(panel):
+            IMC.editWidget.setPlainText(utqs)
+            IMC.pageTable.clear()
+            doc = IMC.editWidget.document()
+            for n in range(0, doc.blockCount(), 5) :
+                block = doc.findBlockByNumber(n)
+                tc = QTextCursor(doc)
+                tc.setPosition(block.position() +
+                               (block.length() // 2 if n % 3 == 0 else 0))
+                IMC.pageTable.loadPsep(tc, QString(unicode(n)), QString(u'\\x'))
+            IMC.editWidget.bookMarkList[1] = doc.find(QString(u'undulating'))
+            panel.reflowDocument()
+            pages = [IMC.pageTable.getCursor(i).position()
+                     for i in range(IMC.pageTable.size())]
+            return (unicode(IMC.editWidget.toPlainText()), pages)
+        (oldText, oldPages) = reflowWith(oldFlow.flowPanel())
+        (newText, newPages) = reflowWith(widj)
+        print(u'bookmark kept' if IMC.editWidget.bookMarkList[1].selectedText()
+              == QString(u'undulating') else u'BOOKMARK MOVED')
+        print(u'text identical' if oldText == newText else u'TEXT DIFFERS')
+        for line in difflib.unified_diff(oldText.split(u'\n'),
+                                         newText.split(u'\n'), lineterm=u'') :
+            print(line)
+        print(u'{0} pages identical'.format(len(newPages))
+              if oldPages == newPages else u'PAGES DIFFER')
+        for (i, (o, n)) in enumerate(zip(oldPages, newPages)) :
+            if o != n :
+                print(u'page {0}: old {1} new {2}, line {3!r}'.format(i, o, n,
+                      unicode(IMC.editWidget.document().findBlock(n).text())))
+        IMC.editWidget.document().undo()
+        print(u'one undo restores the document' if
+              IMC.editWidget.toPlainText() == utqs else u'UNDO DIFFERS')
+        sys.exit(0)
     IMC.editWidget.setPlainText(utqs)
     IMC.mainWindow = widj
     IMC.editWidget.show()
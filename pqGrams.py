@@ -0,0 +1,377 @@
+# must precede anything except #comments, including the docstring
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future_builtins import *
+
+__version__ = "1.3.0"
+__author__  = "David Cortesi"
+__copyright__ = "Copyright 2011, 2012, 2013 David Cortesi"
+__maintainer__ = "David Cortesi"
+__email__ = "tallforasmurf@yahoo.com"
+__license__ = '''
+ License (GPL-3.0) :
+    This file is part of PPQT.
+    PPQT is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You can find a copy of the GNU General Public License in the file
+    extras/COPYING.TXT included in the distribution of this program, or see:
+    <http://www.gnu.org/licenses/>.
+'''
+
+'''
+An index of the trigrams (3-char substrings) of each line of a big document,
+so the Find panel can skip the lines that cannot hold a match. A search that
+misses on a 5MB book otherwise copies and scans all of it every time.
+
+The index of a line is not a list of its trigrams but a bit mask: each
+trigram of the case-folded line sets one bit chosen by its hash. Folding
+(QString.toCaseFolded) is what a case-insensitive QTextDocument.find uses,
+so that long s matches s and final sigma matches sigma, and a line that
+matches a string in either case, or under a case-insensitive QRegExp, has
+all the bits of the string's folded trigrams. The mask has
+about 8 bits per trigram, so a line of ordinary length takes 256 or 512 bits,
+and 100,000 lines take a few MB. A line can hold a string only if its mask
+has all the bits of the string's trigrams; a line whose mask has them all
+may still not hold it, so the caller tests each line the index proposes.
+
+  * lineGrams(text) returns the (width, mask) of a line.
+  * patternFragment(pattern) returns a literal string that every match of a
+    QRegExp pattern must contain, with the most line-ends a match can span,
+    or None when there is no such string or a match can span any number of
+    lines.
+  * gramIndex follows the edits of a document as the censusCache of pqEdit
+    does, and yields the lines that may hold a string. It indexes a document
+    of GramIndexMinChars or more only, and builds in idle time slices when
+    the Find panel first asks for it. Until it is complete, and after an edit
+    too big to follow, it is not ready and Find searches as before.
+'''
+
+from PyQt4.QtCore import (QObject, QString, QTimer, SIGNAL)
+import time
+
+GramIndexMinChars = 500000 # a smaller document is quick enough to scan
+GramRebuildChars = 100000 # an edit adding more than this, start over
+GramSliceSeconds = 0.01 # time to spend indexing at one go
+GramBitsPerGram = 8 # bits of mask per trigram of a line
+GramMinWidth = 8 # least mask of 256 bits
+GramMaxWidth = 14 # and most, 16384, for a very long line
+
+# Return (width, mask) for a line: mask is a long of 2**width bits with a
+# bit set for each trigram of the line case-folded, width is from 8 to 14.
+
+def lineGrams(text):
+    t = unicode(QString(text).toCaseFolded())
+    n = len(t) - 2
+    width = min(GramMaxWidth,
+                max(GramMinWidth, (max(n, 1) * GramBitsPerGram).bit_length()))
+    bits = (1 << width) - 1
+    mask = 0
+    for g in set([t[i:i+3] for i in xrange(n)]) :
+        mask |= 1 << (hash(g) & bits)
+    return (width, mask)
+
+# Return the mask a line of a given width has all bits of when it may hold
+# a string, or 0 for a string of fewer than 3 chars.
+
+def stringMask(string, width):
+    t = unicode(QString(string).toCaseFolded())
+    bits = (1 << width) - 1
+    mask = 0
+    for i in xrange(len(t) - 2) :
+        mask |= 1 << (hash(t[i:i+3]) & bits)
+    return mask
+
+# Look through a QRegExp pattern for the literal strings every match must
+# contain: runs of plain or escaped chars outside any group and not made
+# optional by a quantifier. Return (string, lines) for the longest, if it
+# is 3 chars or more, where lines is the count of line-ends in the pattern.
+# A line-end is \n, or the \u2029 pqFind.setRegex puts in its place.
+#
+# Return None when the pattern has no such string, or when a match could
+# span more lines than we can count or the index can't find its start: it
+# has alternation outside a group; ^ or $, which pqFind makes match at the
+# ends of the text searched, not of lines; a dot, negated class, or \s \S \W
+# \D, any of which matches a line-end; \x \u or \0, which might spell one;
+# or a line-end inside a group or with a quantifier.
+
+def patternFragment(pattern):
+    p = unicode(pattern)
+    n = len(p)
+    runs = []
+    run = []
+    depth = 0
+    lines = 0
+    i = 0
+    while i < n :
+        c = p[i]
+        i += 1
+        literal = None
+        if c == '\\' :
+            if i >= n :
+                return None
+            e = p[i]
+            i += 1
+            if e == 'n' :
+                c = '\u2029' # treat as a line-end, below
+            elif e in 'sSWDxu0' :
+                return None
+            elif e.isalnum() : # \b \w \d \t \1 etc., not indexed
+                (least, i) = quantifier(p, i)
+                runs.append(run)
+                run = []
+                continue
+            else : # escaped punctuation is itself
+                literal = e
+        if literal is not None :
+            pass
+        elif c == '\u2029' :
+            (least, j) = quantifier(p, i)
+            if depth or (j != i) :
+                return None
+            lines += 1
+            runs.append(run)
+            run = []
+            continue
+        elif c == '[' :
+            j = classEnd(p, i)
+            if j is None :
+                return None
+            body = p[i:j]
+            if body.startswith('^') or ('\u2029' in body) or \
+            any(e in body for e in ('\\s', '\\S', '\\W', '\\D', '\\n',
+                                      '\\x', '\\u', '\\0')) :
+                return None
+            (least, i) = quantifier(p, j + 1)
+            runs.append(run)
+            run = []
+            continue
+        elif c == '(' :
+            depth += 1
+            if p[i:i+1] == '?' : # (?: (?= (?!
+                i += 2
+            runs.append(run)
+            run = []
+            continue
+        elif c == ')' :
+            depth -= 1
+            (least, i) = quantifier(p, i)
+            runs.append(run)
+            run = []
+            continue
+        elif c == '|' :
+            if depth == 0 :
+                return None
+            continue
+        elif c in '.^$' :
+            return None
+        else :
+            literal = c
+        # a literal char, which may have a quantifier
+        (least, j) = quantifier(p, i)
+        if depth == 0 and least > 0 :
+            run.append(literal)
+        if j != i : # a quantified char ends the run
+            runs.append(run)
+            run = []
+            i = j
+    runs.append(run)
+    best = max(runs, key=len)
+    if len(best) < 3 :
+        return None
+    return (''.join(best), lines)
+
+# Return (least count, index after) of any quantifier at index i of a
+# pattern, or (1, i) if there is none.
+
+def quantifier(p, i):
+    if i >= len(p) :
+        return (1, i)
+    c = p[i]
+    if c in '*?' :
+        least = 0
+    elif c == '+' :
+        least = 1
+    elif c == '{' :
+        j = p.find('}', i)
+        if j < 0 :
+            return (1, i)
+        digits = p[i+1:j].split(',')[0]
+        least = int(digits) if digits.isdigit() else 0
+        i = j
+    else :
+        return (1, i)
+    i += 1
+    if i < len(p) and p[i] == '?' : # a minimal modifier
+        i += 1
+    return (least, i)
+
+# Return the index of the ] that closes a class whose body begins at i.
+
+def classEnd(p, i):
+    j = i
+    if p[j:j+1] == '^' :
+        j += 1
+    if p[j:j+1] == ']' : # a ] first in the class is a literal
+        j += 1
+    while j < len(p) :
+        if p[j] == '\\' :
+            j += 2
+            continue
+        if p[j] == ']' :
+            return j
+        j += 1
+    return None
+
+# The index of one document. The masks and widths of its lines are kept in
+# a list and a bytearray indexed by block number, a width of 0 meaning not
+# yet indexed.
+
+class gramIndex(QObject):
+    def __init__(self, document):
+        super(gramIndex, self).__init__()
+        self.document = document
+        self.timer = QTimer()
+        self.timer.setInterval(0)
+        self.connect(self.timer, SIGNAL("timeout()"), self.slice)
+        self.connect(document, SIGNAL("contentsChange(int,int,int)"),
+                     self.contentsChange)
+        self.reset()
+
+    # Forget the index, to be built again when next wanted.
+    def reset(self):
+        self.timer.stop()
+        self.masks = []
+        self.widths = bytearray()
+        self.built = 0 # lines before this are indexed while building
+        self.building = False
+        self.complete = False
+
+    # Return True if the index is complete and can be used. If it has not
+    # been begun and the document is big enough, begin it.
+    def ready(self):
+        if self.complete :
+            return True
+        if (not self.building) \
+        and (self.document.characterCount() >= GramIndexMinChars) :
+            count = self.document.blockCount()
+            self.masks = [0] * count
+            self.widths = bytearray(count)
+            self.built = 0
+            self.building = True
+            self.timer.start()
+        return False
+
+    # Timer slot: index lines for a short time, and stop when all are done.
+    def slice(self):
+        t0 = time.time()
+        qtb = self.document.findBlockByNumber(self.built)
+        while qtb.isValid() :
+            bn = qtb.blockNumber()
+            if 0 == self.widths[bn] :
+                (self.widths[bn], self.masks[bn]) = lineGrams(qtb.text())
+            qtb = qtb.next()
+            if (time.time() - t0) > GramSliceSeconds :
+                break
+        if qtb.isValid() :
+            self.built = qtb.blockNumber()
+        else :
+            self.timer.stop()
+            self.building = False
+            self.complete = True
+
+    # Slot for the document's contentsChange signal: index again the lines
+    # the change touched, as censusCache.contentsChange works out. Give up
+    # on a change we can't make sense of, or one so big (like loading a
+    # document) that indexing it here would stall the user.
+    def contentsChange(self, pos, removed, added):
+        if not (self.building or self.complete) :
+            return
+        if added > GramRebuildChars :
+            self.reset()
+            return
+        doc = self.document
+        delta = doc.blockCount() - len(self.masks)
+        first = doc.findBlock(pos)
+        if not first.isValid() :
+            first = doc.lastBlock()
+        last = doc.findBlock(pos + added)
+        if not last.isValid() :
+            last = doc.lastBlock()
+        f = first.blockNumber()
+        oldl = last.blockNumber() - delta # last old block replaced
+        if (oldl < f - 1) or (oldl >= len(self.masks)) :
+            self.reset()
+            return
+        masks = []
+        widths = bytearray()
+        qtb = first
+        while qtb.isValid() and (qtb.blockNumber() <= last.blockNumber()) :
+            (width, mask) = lineGrams(qtb.text())
+            widths.append(width)
+            masks.append(mask)
+            qtb = qtb.next()
+        self.masks[f:oldl+1] = masks
+        self.widths[f:oldl+1] = widths
+        if f < self.built : # lines may have moved back past it
+            self.built = f
+
+    # Yield the numbers of the lines from first to last, going backward if
+    # asked, that may hold a string of 3 or more chars.
+    def candidates(self, string, first, last, backward=False):
+        wanted = {}
+        for width in range(GramMinWidth, GramMaxWidth + 1) :
+            wanted[width] = stringMask(string, width)
+        masks = self.masks
+        widths = self.widths
+        if backward :
+            numbers = xrange(min(first, len(masks) - 1), last - 1, -1)
+        else :
+            numbers = xrange(first, min(last + 1, len(masks)))
+        for bn in numbers :
+            q = wanted[widths[bn]]
+            if (masks[bn] & q) == q :
+                yield bn
+
+if __name__ == "__main__":
+    # Check patternFragment on some patterns and lineGrams on some lines.
+    tests = [
+        ('Mrs\\. Smith', ('Mrs. Smith', 0)),
+        ('colou?r', ('colo', 0)),
+        ('colou?rful', ('colo', 0)),
+        ('\\bbanana\\b', ('banana', 0)),
+        ('end\\nbegin', ('begin', 1)),
+        ('end\u2029start', ('start', 1)),
+        ('(foo|bar)baz', ('baz', 0)),
+        ('foo|bar', None),
+        ('^Chapter', None),
+        ('a.b', None),
+        ('abc[^x]def', None),
+        ('[A-Z]+ing', ('ing', 0)),
+        ('(end\\n)+x', None),
+        ('aaab{0,2}ccc', ('aaa', 0)),
+        ('xy+zzz', ('zzz', 0)),
+        ('X.*(?=\\n)', None),
+        ('<i>(\\w+)</i>', ('</i>', 0)),
+        ('_([^_]+)_', None),
+        ]
+    for (pattern, expect) in tests :
+        got = patternFragment(pattern)
+        print('ok ' if got == expect else 'BAD', repr(pattern), got)
+    line = 'The Quick brown fox'
+    (width, mask) = lineGrams(line)
+    for s in ('quick', 'QUICK BROWN', 'brown fox', 'fox jumps') :
+        q = stringMask(s, width)
+        print(s, (mask & q) == q)
+    # A case-insensitive find of "christmas" matches long-s "Chri\u017ftmas".
+    (width, mask) = lineGrams('A merry Chri\u017ftmas')
+    q = stringMask('CHRISTMAS', width)
+    print('ok ' if (mask & q) == q else 'BAD', 'case folding')
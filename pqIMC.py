@@ -56,7 +56,9 @@ class tricorder():
         self.editCounter = 0
         # needSpellCheck when a word census has been done, or when a
         # different main dictionary is selected. Cleared when a spellcheck is
-        # done, e.g. from the Refresh button in the Word panel.
+        # done, e.g. from the Refresh button in the Word panel. A spellcheck
+        # checks only the words not verified against their dictionary, see
+        # the word census in pqLists.
         self.needSpellCheck = False
         # Stale census has two bits:
         self.staleCensusLoaded = 0x02 # census was stale as of File>Load
@@ -119,6 +121,7 @@ class tricorder():
         self.editWidget = None # main QPlainTextEdit set up in pqMain
         self.spellCheck = None # spellcheck object from pqSpell
         self.mainWindow = None # ref to main window
+        self.pool = None # multiprocessing.Pool forked in ppqt, or None
 
         # Pointers initialized in pqMain to various major objects
         self.bookPath = None # absolute path to book file
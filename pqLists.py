@@ -43,6 +43,7 @@ A separate object is instantiated for each list, offering these methods:
 '''
 
 import bisect
+from array import array
 
 from PyQt4.QtCore import (Qt, QFile, QTextStream, QString, QChar)
 
@@ -102,128 +103,238 @@ class wordList():
             stream << (self.wordlist[i]+"\n")
 '''
 Second, lists for the character and word censuses of the entire file.
-In each case there is a three-column table held as three lists. The first
-is an ordered list of QStrings (not Python u'strings'), searched and inserted-to
-using a version of the bisect_left function modified to compare QStrings.
-The second is an integer count; the third, an integer flag value, either the
-unicode property of a character, or a set of flags for a word.
+In each case there is a three-column table: the word (or char) as a QString,
+an integer count, and an integer flag value, either the unicode property of
+a character, or a set of flags for a word.
 
 The word lists are built by the editor while loading a document, and again
 by the refresh function of the word- and char- views. It is queried by the
 word- and char views and by the the syntax highligher (for misspelt flags).
 
-The words and chars are stored as QStrings so as to get Unicode comparisons
-(we don't trust Python's Unicode support as well as we do Qt's),
-so for example a word composed of all-uppercase Greek or Cyrillic would be
-correctly seen as an all-cap word. The methods are:
+The census of a big book means hundreds of thousands of calls to count(),
+so the table is stored in order of first appearance: a Python dict maps
+the word (as a Python u'string') to its "slot" number, the QStrings are in
+a list by slot, and the counts and flags are in compact arrays by slot.
+Counting a word, or looking up its count or flag, is a single hash probe.
+
+The table views and the metadata writer want the words in sorted order,
+addressed by row number. The first time anybody asks for a row number
+after the vocabulary has changed, we sort the slot numbers by word and keep
+that as self.order, row-number -> slot. Thereafter the row-number methods
+just index through it until the next new word arrives. Sorting is on the
+Python unicode value, which is the same ordinal ordering that the original
+QString.compare(...,Qt.CaseSensitive) gave us. When a word is dropped by
+uncount() its slot is left empty until the empty slots outnumber the live
+ones, when the slots are packed down again.
+
+The words and chars are stored as QStrings so the callers get Unicode
+comparisons and case-tests from Qt, so for example a word composed of
+all-uppercase Greek or Cyrillic would be correctly seen as an all-cap word.
+The methods are:
 
   * clear() - empty the list
   * int size() - return the number of words in the list
-  * int lookup(qs) - find word and return its index, or None if not there
-  * int count(qs,flag)  - insert, or increment the count of, a word or char
-                        and store its flags. Returns the new count;
-                        if it is 1, the word/char was new.
+  * int lookup(qs) - find word and return its row index, or None if not there
+  * int count(qs,flag,n=1) - insert, or increment the count of, a word or
+                        char and store its flags. Returns the new count;
+                        if it equals n, the word/char was new.
+  * int uncount(qs,n=1) - decrement the count of a word or char, dropping
+                        it from the list when it reaches zero. Returns the
+                        new count. Used by the incremental census in pqEdit.
   * int getCount(qs) - find a word and return its occurrence count or 0
-  * qs  getWord(i)  - return the word at index i, used by pqWords
+  * qs  getWord(i)  - return the word at row index i, used by pqWords
   * int getFlag(qs)  - find a word and return its category flags or 0
   * (qs, int, int) get(n) - return the word, count, and flags of the word at
-                     index n as a tuple, used by pqChar and pqWord to populate
-		     their tables.
-  * setflags(i,flag) - set the flag value of a word given its index - used
-		     to set or clear the misspelled flag value
-  * append(qs,count,flag) - add a word with a known count, in sorted order
-                     called during load of metadata, and to populate the
-		     char census after census taken.
+                     row index n as a tuple, used by pqChar and pqWord to
+                     populate their tables.
+  * setflags(i,flag) - set the flag value of a word given its row index -
+                     used to set or clear the misspelled flag value
+  * append(qs,count,flag,key=None) - add a word with a known count, called
+                     during load of metadata, and to populate the char
+                     census after census taken.
+
+For the word census we also keep, for each word, the key of the dictionary
+its misspelt flag was last verified against (see pqSpell dictKey), or None
+if it has not been, so that a spellcheck need only check the words whose
+key is not the current one:
+
+  * getChecked(qs) - return the key a word was verified against, or None
+  * setChecked(qs,key) - set the key of a word (None to make it unverified)
+  * unverify(words) - make unverified every word whose spelling, less any
+                     /dict suffix, is in the set words, and return them
+  * items() - yield (u'word', flag, key) for every word, in no order
 '''
 class vocabList():
     def __init__(self):
         self.clear()
 
     def clear(self):
-        self.words = []
-        self.counts = []
-        self.flags = []
-        self.insertPoint = None
+        self.index = {} # u'word' -> slot number
+        self.keys = [] # u'word' in each slot
+        self.words = [] # QString of the word in each slot
+        self.counts = array(b'l') # count of each slot
+        self.flags = array(b'l') # flag value of each slot
+        self.checked = [] # dict key of each slot, or None
+        self.order = None # sorted slot numbers, None when out of date
+        self.rank = None # slot number -> row index, made with self.order
+        self.empties = 0 # count of slots emptied by uncount()
         self._size = 0 # can't be same as name of accessor function?
 
     def size(self):
         return self._size
 
-    # find a word in our vocabulary and return its index, or None if not there
-    # use the bisect_left algorithm.
+    # Materialize the sorted order of the slots if it is not current.
+    # Note that sorting the slots already in order, as after load of the
+    # metadata, is a single linear pass of Python's sort.
+    def sortOrder(self):
+        if self.order is None :
+            self.order = sorted(self.index.itervalues(),
+                                key=self.keys.__getitem__)
+            self.rank = array(b'l',[0]) * len(self.keys)
+            for i, j in enumerate(self.order) :
+                self.rank[j] = i
+        return self.order
+
+    # find a word in our vocabulary and return its row index, or None if
+    # not there. This forces the sorted order, so it is for the views, not
+    # for the census.
     def lookup(self,qs):
-        lo = 0
-        hi = self._size
-        while lo < hi:
-            mid = (lo+hi)//2
-            if self.words[mid].compare(qs,Qt.CaseSensitive) < 0 : # words[mid] < qs
-                lo = mid+1
-            else:
-                hi = mid
-        self.insertPoint = lo
-        if (lo < self._size) : # not empty list
-            if (self.words[lo].compare(qs,Qt.CaseSensitive) == 0) : # matched at words[lo]
-                return lo
-        return None # not there
-
-    # tabulate one use of a word and set its flag on first seeing it
-    def count(self,qs,flag):
-        i = self.lookup(qs)
-        if i is not None :
-            self.counts[i] += 1
-        else:
-            # new list key - must make a copy to prevent side-effects if the
-            # caller is re-using his qstring.
-            i = self.insertPoint
-            self.words.insert(i,QString(qs))
-            self.counts.insert(i,1)
-            self.flags.insert(i,int(flag))
-            self._size += 1
-        return self.counts[i]
+        j = self.index.get(unicode(qs))
+        if j is None :
+            return None
+        self.sortOrder()
+        return self.rank[j]
+
+    # tabulate n uses of a word and set its flag on first seeing it
+    def count(self,qs,flag,n=1):
+        w = unicode(qs)
+        j = self.index.get(w)
+        if j is not None :
+            self.counts[j] += n
+            return self.counts[j]
+        # new word - must make a copy of the QString to prevent side-effects
+        # if the caller is re-using his qstring.
+        self.newSlot(w, QString(qs), n, flag)
+        return n
+
+    # un-tabulate n uses of a word, and forget it when none are left.
+    def uncount(self,qs,n=1):
+        w = unicode(qs)
+        j = self.index.get(w)
+        if j is None :
+            return 0 # never heard of it
+        c = self.counts[j] - n
+        if c > 0 :
+            self.counts[j] = c
+            return c
+        del self.index[w]
+        self.keys[j] = None
+        self.words[j] = None
+        self.counts[j] = 0
+        self.flags[j] = 0
+        self.checked[j] = None
+        self._size -= 1
+        self.empties += 1
+        self.order = None
+        if self.empties > self._size :
+            self.pack()
+        return 0
+
+    # Squeeze out the empty slots left by uncount().
+    def pack(self):
+        live = sorted(self.index.itervalues())
+        self.keys = [self.keys[j] for j in live]
+        self.words = [self.words[j] for j in live]
+        self.counts = array(b'l', [self.counts[j] for j in live])
+        self.flags = array(b'l', [self.flags[j] for j in live])
+        self.checked = [self.checked[j] for j in live]
+        self.index = dict( (w, j) for (j, w) in enumerate(self.keys) )
+        self.empties = 0
+        self.order = None
 
     # return the count value of a word
     def getCount(self, qs):
-        i = self.lookup(qs)
-        if i is not None :
-            return self.counts[i]
-        else:
-            return 0
+        j = self.index.get(unicode(qs))
+        if j is not None :
+            return self.counts[j]
+        return 0
 
     # Used by pqWords when scanning the table
     def getWord(self,index):
-        return self.words[index]
+        return self.words[self.sortOrder()[index]]
 
     # return the flag value of a word
     def getFlag(self, qs):
-        i = self.lookup(qs)
-        if i >= 0 :
-            return self.flags[i]
-        else:
-            return 0
+        j = self.index.get(unicode(qs))
+        if j is not None :
+            return self.flags[j]
+        return 0
 
     # This is called when a table widget is populating itself, reading out
     # the list by row number.
     def get(self,index):
-        if (index >= 0) and (index < self.size):
-            return (self.words[index], self.counts[index], self.flags[index])
+        if (index >= 0) and (index < self._size):
+            j = self.sortOrder()[index]
+            return (self.words[j], self.counts[j], self.flags[j])
         else:
             raise ValueError # naughty naughty
 
     # Set or change the flags value of an existing word
     def setflags(self, index, newflag):
-        if (index >= 0) and (index < self.size):
-            self.flags[index] = newflag
+        if (index >= 0) and (index < self._size):
+            self.flags[self.sortOrder()[index]] = newflag
         else:
             raise ValueError # tsk tsk
 
+    # Return or set the key of the dictionary a word was verified against.
+    def getChecked(self, qs):
+        j = self.index.get(unicode(qs))
+        if j is not None :
+            return self.checked[j]
+        return None
+
+    def setChecked(self, qs, key):
+        j = self.index.get(unicode(qs))
+        if j is not None :
+            self.checked[j] = key
+
+    # A word was added to the good or bad words: its spelling, and that of
+    # the same word in any alt dictionary, must be checked again.
+    def unverify(self, words):
+        found = []
+        for (j, w) in enumerate(self.keys) :
+            if (w is not None) and (w.split(u'/')[0] in words) :
+                self.checked[j] = None
+                found.append(w)
+        return found
+
+    # Run through the words in slot order, for a spellcheck.
+    def items(self):
+        for (j, w) in enumerate(self.keys) :
+            if w is not None :
+                yield (w, self.flags[j], self.checked[j])
+
     # This is called from load, where we learn the word and its count
-    # and its flags from the metadata file. We assume this is going to
-    # come in sorted order, else we will be in big trouble.
-    def append(self, qs, cc, ff):
+    # and its flags from the metadata file. These normally come in sorted
+    # order but we no longer depend on it.
+    def append(self, qs, cc, ff, key=None):
+        w = unicode(qs)
+        j = self.index.get(w)
+        if j is not None : # duplicate in a hand-edited .meta?
+            self.counts[j] += cc
+            return
+        self.newSlot(w, qs, cc, ff, key)
+
+    # Add a new word to the end of the slots and invalidate the order.
+    def newSlot(self, w, qs, cc, ff, key=None):
+        self.index[w] = len(self.keys)
+        self.keys.append(w)
         self.words.append(qs)
         self.counts.append(cc)
-        self.flags.append(ff)
+        self.flags.append(int(ff))
+        self.checked.append(key)
         self._size += 1
+        self.order = None
 
 if __name__ == "__main__":
     import sys
@@ -192,6 +192,10 @@ class MainWindow(QMainWindow):
         self.tabSet.addTab(self.charPanel, u"Char")
         self.connect(self, SIGNAL("docWillChange"), self.charPanel.docWillChange)
         self.connect(self, SIGNAL("docHasChanged"), self.charPanel.docHasChanged)
+        self.connect(self.editor.census, SIGNAL("censusWillChange"),
+                     self.charPanel.censusWillChange)
+        self.connect(self.editor.census, SIGNAL("censusHasChanged"),
+                     self.charPanel.censusHasChanged)
         #
         # 5. Create Word Census Panel and give it signals.
         #
@@ -199,6 +203,10 @@ class MainWindow(QMainWindow):
         self.tabSet.addTab(self.wordPanel, u"Word")
         self.connect(self, SIGNAL("docWillChange"), self.wordPanel.docWillChange)
         self.connect(self, SIGNAL("docHasChanged"), self.wordPanel.docHasChanged)
+        self.connect(self.editor.census, SIGNAL("censusWillChange"),
+                     self.wordPanel.censusWillChange)
+        self.connect(self.editor.census, SIGNAL("censusHasChanged"),
+                     self.wordPanel.censusHasChanged)
         #
         # 6. Create Pages Panel and give it signals.
         #
@@ -314,6 +322,11 @@ class MainWindow(QMainWindow):
                 self.buttonLoad, None, "Read user-defined buttons in Find Panel")
         fileButtonSaveAction = self.createAction("Save Find buttons...", None,
                 self.buttonSave, None, "Save user-defined buttons in Find Panel")
+        fileButtonRunAction = self.createAction("Run Find Buttons...", None,
+                self.buttonRun, None, "Report the hits of all buttons in a file")
+        fileButtonPipeAction = self.createAction("Replace With Find Buttons...",
+                None, self.buttonPipe, None,
+                "Do the replacements of all buttons in a file, in order")
         fileExportGuiguts = self.createAction("Export to Guiguts", None,
                 self.exportGuiguts, None, "Create a Guiguts .bin file")
         fileQuitAction = self.createAction("&Quit", None, self.close,
@@ -340,7 +353,8 @@ class MainWindow(QMainWindow):
         self.fileMenuActions2 = (fileSaveAction, fileSaveAsAction,
                                  filePropsAction, None,
                                  fileScannosAction, fileButtonLoadAction,
-                                 fileButtonSaveAction,
+                                 fileButtonSaveAction, fileButtonRunAction,
+                                 fileButtonPipeAction,
                                  fileExportGuiguts,
                                  None, fileQuitAction)
         #
@@ -441,6 +455,9 @@ class MainWindow(QMainWindow):
                 self.viewFont, None, "Open font selection dialog")
         self.viewDictAction = self.createAction("&Dictionary...", None,
                 self.viewDict, None, "Open dictionary selection dialog")
+        self.viewRegexAction = self.createAction("&Regex Time Limit...", None,
+                IMC.findPanel.setRegexBudget, None,
+                "Set how long a regex search may run before it is stopped")
         #
         # -----------------------------------------------------------------
         # Create and populate the View menu
@@ -449,7 +466,8 @@ class MainWindow(QMainWindow):
         self.addActions(viewMenu, (self.viewScannosAction,
                                    self.viewSpellingAction,
                                    self.viewFontAction,
-                                   self.viewDictAction))
+                                   self.viewDictAction,
+                                   self.viewRegexAction))
 
     # ---------------------------------------------------------------------
     # This convenience function, lifted from Summerfield's examples,
@@ -570,10 +588,13 @@ class MainWindow(QMainWindow):
     # Slot to receive the modificationChanged signal from the main editor.
     # This signal only comes when the document goes from unmodified to
     # modified, or the reverse (on ^z). It does not come on every text change,
-    # only on the first text change.
+    # only on the first text change. A census still counting in the
+    # background, or cancelled part way, is not fresh because the document
+    # was saved; only the worker clears the bit, when it finishes.
     #
     def ohModificationChanged(self,newValue):
-        if not newValue : # doc is, has become, unchanged
+        if (not newValue) and self.editor.censusComplete() :
+            # doc is, has become, unchanged, and the census is complete
             IMC.staleCensus &= (0xff ^ IMC.staleCensusAcquired)
         self.setWinModStatus()
     #
@@ -582,8 +603,12 @@ class MainWindow(QMainWindow):
     # is used only by pqFnote to tell if it needs to refresh its lists before
     # moving or renumbering footnotes.
     #
+    # When the editor's incremental census is following edits, the census
+    # does not go stale.
+    #
     def ohTextChanged(self):
-        IMC.staleCensus |= IMC.staleCensusAcquired
+        if not self.editor.census.isLive() :
+            IMC.staleCensus |= IMC.staleCensusAcquired
         IMC.editCounter += 1
     #
     # -----------------------------------------------------------------
@@ -605,12 +630,12 @@ class MainWindow(QMainWindow):
         willDoIt = (toggle) and (not self.scannoPath.isEmpty())
         self.viewScannosAction.setChecked(willDoIt)
         IMC.scannoHiliteSwitch = willDoIt
-        self.editor.setHighlight(IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch)
+        self.editor.setHighlight()
 
     def viewSetSpelling(self, toggle):
         self.viewSpellingAction.setChecked(toggle)
         IMC.spellingHiliteSwitch = toggle
-        self.editor.setHighlight(IMC.scannoHiliteSwitch or IMC.spellingHiliteSwitch)
+        self.editor.setHighlight()
 
     # -----------------------------------------------------------------
     # Handle View>Font... by throwing up a QFontDialog initialized with an
@@ -641,7 +666,10 @@ class MainWindow(QMainWindow):
         qsl = IMC.spellCheck.dictList()
         if qsl.count() : # then we know about some dicts
             qsl.sort() # put the list in order
-            qsmt = IMC.spellCheck.mainTag if IMC.spellCheck.isUp() else QString(u'(none)')
+            # the main tag is set while its dict loads, and cleared if none is
+            qsmt = IMC.spellCheck.mainTag
+            if qsmt.isEmpty() :
+                qsmt = QString(u'(none)')
             # get the index of the current main dict tag, if any
             current = qsl.indexOf(qsmt)
             if current < 0 : # appears there isn't a current main dict
@@ -1069,9 +1097,11 @@ class MainWindow(QMainWindow):
         # Test for mismatched doc/meta situation
         if not self.doHashesMatch() :
             return False # mismatch, and user thought better of save
+        # Make sure the incremental census has counted the latest edits.
+        self.editor.census.flush()
         if IMC.bookSaveEncoding != self.utfEncoding :
             # Saving to an 8-bit encoding: does the document have any chars >255?
-            if 0 == IMC.staleCensus :
+            if (0 == IMC.staleCensus) and self.editor.censusComplete() :
                 # Fresh census data, just sample the highest QChar
                 ultqs = IMC.charCensus.getWord(IMC.charCensus.size()-1)
                 ultqc = ultqs.at(0) # QChar from QString
@@ -1196,7 +1226,8 @@ class MainWindow(QMainWindow):
         if sh is not None:
             IMC.scannoList.load(sh)
             fh.close()
-            # new list is loaded,
+            # new list is loaded, so the highlighter's scannos are stale
+            self.editor.setHighlight(stale=True)
             if scanno_sw : # if highlighting was on,
                 self.viewSetScannos(True) # turn it on again
         else:
@@ -1225,6 +1256,38 @@ class MainWindow(QMainWindow):
                 # after successful use, update start path for saving
                 self.extrasDirPath = bfInfo.path()
 
+    # -----------------------------------------------------------------
+    # File> Run Find Buttons clicked. Ask the user for a file of buttons as
+    # for Load Find Buttons, and have the Find panel report how each of
+    # them hits the document, without loading them.
+
+    def buttonRun(self):
+        self.buttonFileDo("PPQT - choose a file of user buttons to run",
+                          IMC.findPanel.reportButtons)
+
+    # -----------------------------------------------------------------
+    # File> Replace With Find Buttons clicked. Ask the user for a file of
+    # buttons and have the Find panel apply each button's first replace to
+    # all its hits, in the order of the file, as one change.
+
+    def buttonPipe(self):
+        self.buttonFileDo("PPQT - choose a file of user buttons to apply",
+                          IMC.findPanel.pipeButtons)
+
+    # Ask for a file of buttons and pass its stream and name to a method.
+    def buttonFileDo(self, caption, method):
+        startPath = self.extrasDirPath
+        bfName = QFileDialog.getOpenFileName(self, caption, startPath)
+        if not bfName.isEmpty(): # a file was chosen
+            bfInfo = QFileInfo(bfName)
+            bfCodec = self.inferTheCodec(bfInfo,QFileInfo(),True,fallBack=self.utfEncoding)
+            (buttonStream, fh) = self.openSomeFile(bfName,
+                                        QIODevice.ReadOnly, bfCodec)
+            if buttonStream is not None:
+                method(buttonStream, bfInfo.fileName())
+                fh.close()
+                self.extrasDirPath = bfInfo.path()
+
     # -----------------------------------------------------------------
     # File> Save Find Buttons clicked. Ask the user for a file to open.
     # If one is given, determine its coded, and open it for output and
@@ -1249,7 +1312,8 @@ class MainWindow(QMainWindow):
     # Then save our current geometry, list of recent files, etc.
     # Finally emit the shuttingDown signal so other widgets can do the same.
     def closeEvent(self, event):
-        if 0 < IMC.progressBar.value() :
+        # A census or spellcheck in the background is no reason to wait.
+        if (0 < IMC.progressBar.value()) and not self.editor.censusRunning() :
             pqMsgs.warningMsg(
                 'Please wait until the status line is clear',
                 'Some long-running process needs to finish before Quit')
@@ -1259,7 +1323,8 @@ class MainWindow(QMainWindow):
             # user clicked cancel on the save your file? dialog
             event.ignore() # as you were...
             return
-        # OK, the file wasn't dirty, or is now saved.
+        # OK, the file wasn't dirty, or is now saved. Stop any census.
+        self.editor.cancelCensus(True)
         # If we created any KeyPalettes, tell them to close, otherwise
         # they hang around indefinitely!
         for pal_obj in self.palettes :
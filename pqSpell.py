@@ -42,7 +42,9 @@ __license__ = '''
  from whence it is referenced by pqEdit and pqMain for these methods:
 
     .isUp() True/False if spelling is working, which is to say, if
-        hunspell could be set up using the last-requested main dict.
+        hunspell could be set up using the last-requested main dict, or
+        failing that, an earlier one. It does not wait for a dict being
+        loaded. See "loading" below.
 
     .dictList() returns a QStringList with the tag-names (e.g. "en_GB")
         of the available dictionaries. This is used from to set up
@@ -50,11 +52,16 @@ __license__ = '''
 
     .setMainDict(tag) switch to another tag, e.g. u"fr_CA", as the main
         or default dictionary. Returns True if tag is available and
-        hunspell set up with that dict, else False and makes no change.
+        hunspell is set up, or being set up, with that dict, else False
+        and makes no change.
 
     .mainTag is the unicode tag last set in setMainDict (or initialized
         from saved settings), or null for none.
 
+    .mainDict is the spellDict in use as the main dict, or None. Until a
+        new main dict is loaded it is the previous one, so mainDict.tag
+        may differ from mainTag for a while.
+
     .check(aword, dicTag=None)
         aword is a Python Unicode string (not a QString)
 	dicTag of None means use main/default dictionary
@@ -64,13 +71,67 @@ __license__ = '''
 	- returns False if aword is not found in the specified dictionary
         - returns True iff aword is accepted in the specified dictionary
 
+    .checkMany(words, dicTag=None) checks a list of words as check() does
+        and returns a list of True/False, asking Hunspell about all the
+        words not in the verdict cache (below) in one batch.
+
+    .checkAll(groups) takes a dict of {tag: [words]}, where a tag of u''
+        means the main dictionary, and returns {tag: [verdicts]}. A verdict
+        is None when the dict can't be had here: an alt dict that is not
+        loaded and can't be checked in parallel, or a tag we don't have.
+        When many words are not in the caches they are divided among the
+        shared pool of processes ppqt forks at startup, IMC.pool, each of
+        which loads its own Hunspell objects.
+        This is for the census worker thread, so it never loads a dict in
+        this process (which could put up a message).
+
+    .dictKey(tag=u'') returns the key of a dict, its tag and a hash of its
+        files, or u'' if there is none. pqEdit keeps the key each word of
+        the census was checked against, and rechecks only the words whose
+        key has changed. A tag of u'' means the main dict in use.
+
+    .altStats() returns a dict of counts of alt dictionary requests that
+        found the dict loaded ("hits") or not ("misses"), of dicts loaded
+        ("loads") and dropped ("evictions"), and of those now loaded.
+
+    .startLoading() starts loading the main dict from the settings, if it
+        has not been started, or overtaken by a setMainDict, already.
+
     .terminate() is called from pqMain on shutdown to save the current
-        tag of the main dictionary in settings.
+        tag of the main dictionary in settings, and the verdict caches.
+
+ Loading a big dictionary like de_DE takes Hunspell a second or more, so a
+ main dict is loaded by a dictLoader thread: the one from the settings, once
+ ppqt has shown the main window and calls startLoading(), and then any chosen
+ with View > Dictionary or File > Properties. (Not while the window is being
+ built: the Hunspell binding holds the GIL for the whole of the load, so the
+ two would only take turns.) The loader is the future of the dict. When
+ it finishes, its dict becomes the main dict, the old main dict goes into the
+ pool of alt dicts, IMC.needSpellCheck is set, and from the loader's
+ finished() signal the editor checks again the words not checked with it,
+ see pqEdit.dictLoaded. Meanwhile the methods that use the main dict use
+ the previous one if there is one; if not, isUp() is False and words are
+ checked as they are when there is no dict. Alt dicts are still loaded when first asked for, because
+ they are not needed until a census and the census would wait for them.
 
  The spellDict class represents access to a single Myspell/Hunspell
  dictionary via a hunspell object. It is used internally to implement the
  main and alt dicts. It provides only its initializer and the spell(aword) method.
 
+ Alternate dictionaries, named by lang= attributes in the book, are kept
+ loaded in a pool that holds up to AltDictMaxCount dicts of a total size up
+ to AltDictMaxBytes, dropping the least recently used, so a book that mixes
+ fr_FR and de_DE spans loads each just once.
+
+ The verdictCache class remembers the verdict of one dictionary on every
+ word it has been asked about, across books and sessions, so a recheck after
+ a change of dictionary or good-words, or the census of another book of the
+ same era, rarely needs Hunspell. A cache is kept in a file named for the
+ dictionary tag and a hash of its .dic and .aff files, so an edited or
+ updated dictionary gets a fresh cache, in a "spellcache" folder of the
+ per-user application data location. It holds at most VerdictCacheMax words,
+ dropping the least recently used.
+
  The main implementation constraint is that we expect all dictionary files
  to be located on the __file__/dict path, that is, a folder of dictionaries
  bundled inside our app. We pass the path to the tag.dic and tag.aff files
@@ -91,21 +152,44 @@ __license__ = '''
  https://code.google.com/p/pyhunspell/ which has some issues and is not
  being supported, but seems to work and is wicked fast.
 '''
-from PyQt4.QtCore import (QRegExp, QString,QStringList)
+from PyQt4.QtCore import (QRegExp, QString, QStringList, QThread, SIGNAL)
+from PyQt4.QtGui import (QDesktopServices)
 import pqMsgs
 import os
 import sys
+import io
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
 import hunspell
 
 class makeSpellCheck():
     def __init__(self):
-        # Nothing loaded yet
-        self.altTag = QString()
-        self.altDict = None
+        # Nothing loaded yet. Loaded alt dicts are kept by tag, least
+        # recently used first, with counts of how that is going.
+        self.altDicts = OrderedDict()
+        self.altCounts = {u'hits':0, u'misses':0, u'loads':0, u'evictions':0}
         self.mainTag = QString()
         self.mainDict = None
+        # The loader of the main dict now being loaded, if any, and all the
+        # loaders not yet finished with, which must be kept alive.
+        self.mainLoader = None
+        self.loaders = []
         # Tags of any not-found dicts so we only give one diagnostic per dict
         self.errTags = set()
+        # Verdict caches of the dicts we have loaded, by cache file name, and
+        # the folder for the files, or None if we can't make one.
+        self.caches = {}
+        self.cacheNames = {} # tag: dict key, the cache file name less .txt
+        self.cacheLock = threading.Lock() # loaders make caches too
+        self.cachePath = os.path.join(unicode(QDesktopServices.storageLocation(
+            QDesktopServices.DataLocation)), u'spellcache')
+        try :
+            if not os.path.isdir(self.cachePath) :
+                os.makedirs(self.cachePath)
+        except OSError :
+            self.cachePath = None # caches will last for this session only
         # Populate our list of available dictionaries by finding
         # all the file-pairs of the form <tag>.dic and <tag>.aff in the
         # folder whose path is saved by ppqt in IMC.dictPath.
@@ -130,92 +214,318 @@ class makeSpellCheck():
         # settings during the terminate() method below.
         deftag = IMC.settings.value(u"main/spellDictTag",
                                     QString(u"en_US")).toString()
-        # Try to load the main dictionary. Sets self.mainDict/.mainTag.
-        self.setMainDict(deftag)
-        # No alt-dict has been loaded yet, so self.altDict/.altTag are None.
+        # It is loaded by startLoading(), when ppqt has shown the main window
+        # or when the dict is first needed, whichever comes first.
+        self.mainTag = QString(deftag)
+        self.pendingTag = QString(deftag)
+
+    # Start loading the main dictionary from the settings, unless that has
+    # been done. Sets self.mainDict when it is loaded.
+    def startLoading(self):
+        tag = self.pendingTag
+        if tag is not None :
+            self.pendingTag = None
+            self.mainTag = QString()
+            self.setMainDict(tag)
 
-    # If a main dictionary has been loaded, return True.
+    # If a main dictionary has been loaded, return True. If one is being
+    # loaded and there is no older one to use, return False; we don't wait.
     def isUp(self):
+        self.ready()
         return (self.mainDict is not None)
 
+    # If a main dict loader has finished, install its dict. If it hasn't and
+    # we are told to, wait for it. This is only called in the GUI thread;
+    # the census worker gets the main dict from the editor.
+    def ready(self, wait=False):
+        self.startLoading()
+        loader = self.mainLoader
+        if loader is not None :
+            if wait :
+                loader.wait()
+            if loader.complete :
+                self.loaded(loader)
+
+    # A dictLoader has finished, so install its dict as the main dict, or
+    # if another main dict was asked for since, as an alt dict. This is
+    # called by ready(), or by finished(), whichever comes first.
+    def loaded(self, loader):
+        if loader.taken :
+            return
+        loader.taken = True
+        self.loaders.remove(loader)
+        tag = unicode(loader.tag)
+        if loader.error is not None :
+            self.dictError(tag, loader.error)
+        elif loader is not self.mainLoader :
+            self.keepAlt(tag, loader.dict)
+        if loader is not self.mainLoader :
+            return
+        self.mainLoader = None
+        if loader.error is not None :
+            # Go back to the dict we have, if any.
+            self.mainTag = QString(self.mainDict.tag if self.mainDict else u'')
+            return
+        if self.mainDict is not None :
+            self.keepAlt(self.mainDict.tag, self.mainDict)
+        self.mainDict = loader.dict
+        loader.installed = True
+        IMC.needSpellCheck = True
+        pqMsgs.noteEvent(u'Loaded dictionary ' + tag)
+
+    # Slot for the finished() signal of a dictLoader. If its dict is now the
+    # main dict, have the editor check the words that were checked without
+    # it, while it was loading.
+    def finished(self, loader):
+        self.loaded(loader)
+        if loader.installed and (IMC.editWidget is not None) :
+            IMC.editWidget.dictLoaded()
+
     # Return our list of available dictionary tags, as needed to populate
     # the View > Dictionary submenu.
     def dictList(self):
         return self.listOfDicts
 
     # When the program is ending, pqMain calls this slot.
-    # Save the user-set main dictionary tag for next time.
+    # Save the user-set main dictionary tag for next time, and the
+    # verdict caches.
     def terminate(self):
         IMC.settings.setValue(u"main/spellDictTag",self.mainTag)
+        for loader in self.loaders :
+            loader.wait() # can't destroy a running QThread
+        for cache in self.caches.itervalues() :
+            cache.save()
 
     # Set a new main/default dictionary if a dict of that tag exists.
     # If we have already gone to the labor of loading that dict, don't
-    # repeat the work.
+    # repeat the work, otherwise start a dictLoader on it.
     def setMainDict(self,tag):
         if tag == self.mainTag :
-            return True # We already loaded that one
-        elif tag == self.altTag :
-            # We already loaded that tag as an alt, make it Main
-            self.mainTag = self.altTag
-            self.mainDict = self.altDict
-            # and now we don't have an alt any more.
-            self.altTag = None
-            self.altDict = None
-            return True
-        # Try to create a hunspell object for that dict/aff pair.
-        dictobj = self.loadDict(tag)
-        if dictobj is not None :
-            # That worked, save it.
-            self.mainDict = dictobj
-            self.mainTag = tag
-            return True
-        else:
-            # It didn't work. .mainDict/.mainTag are either None,
+            return True # We already loaded, or are loading, that one
+        files = self.dictFiles(tag)
+        if files is None :
+            # Not a dict we know. .mainDict/.mainTag are either None,
             # or else they have some earlier successful choice.
             # Leave them as-is.
+            self.dictError(unicode(tag),
+                LookupError('dictionary tag {0} not found'.format(tag)))
             return False
+        self.pendingTag = None # a new choice overtakes the settings
+        self.mainTag = QString(tag)
+        self.mainLoader = None # any loader running has been overtaken
+        if self.mainDict is not None and self.mainDict.tag == unicode(tag) :
+            return True # back to the one we have
+        if unicode(tag) in self.altDicts :
+            # We already loaded that tag as an alt, make it Main, and
+            # keep the old main as an alt.
+            dictobj = self.altDicts.pop(unicode(tag))
+            if self.mainDict is not None :
+                self.keepAlt(self.mainDict.tag, self.mainDict)
+            self.mainDict = dictobj
+            IMC.needSpellCheck = True
+            return True
+        # Load a hunspell object for that dict/aff pair in the background.
+        loader = dictLoader(self, tag, files)
+        loader.connect(loader, SIGNAL("finished()"),
+                       lambda : self.finished(loader))
+        self.mainLoader = loader
+        self.loaders.append(loader)
+        loader.start(QThread.LowPriority)
+        return True
+
+    # Return the paths to the .dic and .aff files for a tag, or None if the
+    # tag is not in our list of valid dicts.
+    def dictFiles(self,tag):
+        if self.listOfDicts.indexOf(QString(tag)) < 0 :
+            return None
+        fn = unicode(tag) # get qstring to python string
+        return (os.path.join(IMC.dictPath,fn+u'.dic'),
+                os.path.join(IMC.dictPath,fn+u'.aff'))
 
     # Set up a spellcheck dictionary by way of our spellDict class.
     def loadDict(self,tag):
-        p = self.listOfDicts.indexOf(tag)
+        files = self.dictFiles(tag)
         try:
-            if p > -1 : # the tag is in our list of valid dicts
-                fn = unicode(tag) # get qstring to python string
-                aff_path = os.path.join(IMC.dictPath,fn+u'.aff')
-                dic_path = os.path.join(IMC.dictPath,fn+u'.dic')
-                obj = spellDict( dic_path, aff_path )
-                return obj # success
+            if files is not None :
+                return self.openDict(tag, files) # success
             else:
                 raise LookupError('dictionary tag {0} not found'.format(tag))
-        except (LookupError, IOError, OSError) as err:
-            if unicode(tag) not in self.errTags :
-                pqMsgs.warningMsg(u'Could not open dictionary',str(err))
-                self.errTags.add(unicode(tag))
+        except Exception as err:
+            self.dictError(unicode(tag), err)
             return None
-        except : # some other error?
+
+    # Make the spellDict of a tag given its files, and its verdict cache.
+    # This is also called in a dictLoader thread, so it must not put up a
+    # message; failures are exceptions for the caller.
+    def openDict(self, tag, files):
+        obj = spellDict(*files)
+        obj.tag = unicode(tag)
+        obj.cache = self.getCache(unicode(tag), *files)
+        return obj
+
+    # Report a dict that could not be opened, once per tag.
+    def dictError(self, tag, err):
+        if tag in self.errTags :
+            return
+        self.errTags.add(tag)
+        if isinstance(err, (LookupError, IOError, OSError)) :
+            pqMsgs.warningMsg(u'Could not open dictionary',str(err))
+        else : # some other error?
             print("unexpected error opening a spell dict")
-            return None
+
+    # Get the verdict cache for a dictionary, reading it from its file the
+    # first time. The name of the file is the tag and a hash of the contents
+    # of the .dic and .aff files.
+    def getCache(self, tag, dic_path, aff_path):
+        with self.cacheLock :
+            return self.lockedGetCache(tag, dic_path, aff_path)
+
+    def lockedGetCache(self, tag, dic_path, aff_path):
+        name = self.lockedKey(tag, dic_path, aff_path) + u'.txt'
+        if name not in self.caches :
+            path = None
+            if self.cachePath is not None :
+                path = os.path.join(self.cachePath, name)
+            self.caches[name] = verdictCache(path)
+        return self.caches[name]
+
+    # The key of a dictionary, the tag and a hash of its files, which is
+    # also the name of its verdict cache. Any verdict of the dict is good
+    # for as long as its key is the same. A tag of u'' means the main dict
+    # now in use. The key is u'' if there is no such dict.
+    def dictKey(self, tag=u''):
+        if not tag :
+            if self.mainDict is None :
+                return u''
+            tag = self.mainDict.tag
+        files = self.dictFiles(tag)
+        if files is None :
+            return u''
+        with self.cacheLock :
+            return self.lockedKey(unicode(tag), *files)
+
+    def lockedKey(self, tag, dic_path, aff_path):
+        key = self.cacheNames.get(tag)
+        if key is None :
+            sha = hashlib.sha1()
+            for path in (dic_path, aff_path) :
+                with open(path, 'rb') as f :
+                    sha.update(f.read())
+            key = u'{0}-{1}'.format(tag, sha.hexdigest()[:16])
+            self.cacheNames[tag] = key
+        return key
 
     # Check one word, a python u-string, against the main or an alt dictionary.
     # If an alt dict is specified, it is likely the same as the last one
     # requested, but if not, then try to load a dict of the given tag.
     # We used to split up hyphenated phrases, but Hunspell handles them.
     def check(self, aword, dicTag = ''):
-        if 0 == len(dicTag):
-            d = self.mainDict # which is None, if we are not up
-        else:
-            if dicTag == self.altTag :
-                d = self.altDict # same alt as the last one
-            else:
-                # Different alt dictionary, open it
-                d = self.loadDict(dicTag)
-                if d is not None :
-                    self.altDict = d # that worked, save new alt dict
-                    self.altTag = dicTag
+        d = self.getDict(dicTag)
         if d is not None: # one way or another we have a dict
             return d.spell(aword)
         return False # null word, or main or alt dict not available
 
+    # Check a list of words against one dictionary. The words the cache
+    # knows are answered from it and the rest go to Hunspell together,
+    # and their verdicts into the cache.
+    def checkMany(self, words, dicTag = ''):
+        d = self.getDict(dicTag)
+        if d is None :
+            return [False] * len(words)
+        verdicts = [d.cache.get(w) for w in words]
+        misses = [j for (j, v) in enumerate(verdicts) if v is None]
+        for j in misses :
+            verdicts[j] = d.hspell(words[j])
+        d.cache.putMany( (words[j], verdicts[j]) for j in misses )
+        return verdicts
+
+    # Check words of several dictionaries, in parallel if there are enough
+    # that the caches don't know. See the note at the top.
+    def checkAll(self, groups):
+        main = self.mainDict # which the GUI thread may change meanwhile
+        results = {}
+        work = [] # (tag, dict files, cache, words, indexes of misses)
+        for (tag, words) in groups.iteritems() :
+            results[tag] = [None] * len(words)
+            if not tag and main is None :
+                continue
+            files = self.dictFiles(tag if tag else main.tag)
+            if files is None :
+                continue
+            cache = self.getCache(unicode(tag) if tag else main.tag, *files)
+            verdicts = [cache.get(w) for w in words]
+            results[tag] = verdicts
+            misses = [j for (j, v) in enumerate(verdicts) if v is None]
+            if misses :
+                work.append( (tag, files, cache, words, misses) )
+        nmisses = sum(len(w[4]) for w in work)
+        if (IMC.pool is not None) and (nmisses >= ParallelSpellMinWords) :
+            # Cut each dictionary's misses into a few slices per process.
+            size = max(nmisses // (4 * multiprocessing.cpu_count()), 64)
+            jobs = []
+            for (tag, files, cache, words, misses) in work :
+                for k in range(0, len(misses), size) :
+                    jobs.append( (files, [words[j] for j in misses[k:k+size]]) )
+            answers = iter(IMC.pool.map(spellChunk, jobs))
+            for (tag, files, cache, words, misses) in work :
+                for k in range(0, len(misses), size) :
+                    for (j, v) in zip(misses[k:k+size], next(answers)) :
+                        results[tag][j] = v
+        else :
+            # Check serially, but only in the main dict, already loaded.
+            for (tag, files, cache, words, misses) in work :
+                if not tag :
+                    for j in misses :
+                        results[tag][j] = main.hspell(words[j])
+        for (tag, files, cache, words, misses) in work :
+            cache.putMany( (words[j], results[tag][j]) for j in misses
+                           if results[tag][j] is not None )
+        return results
+
+    # Return the spellDict for the main dictionary, or an alt one, or None.
+    # An alt dict comes from the pool if we have it, else we load it.
+    def getDict(self, dicTag = ''):
+        if 0 == len(dicTag):
+            self.ready()
+            return self.mainDict # which is None, if we are not up
+        tag = unicode(dicTag)
+        for loader in list(self.loaders) :
+            if unicode(loader.tag) == tag : # being loaded, wait for it
+                loader.wait()
+                self.loaded(loader)
+        if self.mainDict is not None and self.mainDict.tag == tag :
+            return self.mainDict
+        d = self.altDicts.pop(tag, None)
+        if d is not None :
+            self.altCounts[u'hits'] += 1
+        else :
+            self.altCounts[u'misses'] += 1
+            if tag in self.errTags :
+                return None # we already failed to load it
+            d = self.loadDict(dicTag)
+            if d is None :
+                self.errTags.add(tag) # don't try again
+                return None
+            self.altCounts[u'loads'] += 1
+        self.keepAlt(tag, d)
+        return d
+
+    # Put an alt dict in the pool as the most recently used, then drop the
+    # least recently used while there are too many or they are too big,
+    # always keeping the new one.
+    def keepAlt(self, tag, d):
+        self.altDicts[tag] = d
+        while len(self.altDicts) > 1 and (
+            len(self.altDicts) > AltDictMaxCount or
+            sum(a.size for a in self.altDicts.itervalues()) > AltDictMaxBytes) :
+            self.altDicts.popitem(last=False)
+            self.altCounts[u'evictions'] += 1
+
+    def altStats(self):
+        stats = dict(self.altCounts)
+        stats[u'loaded'] = len(self.altDicts)
+        return stats
+
 
 # Represent access to one Myspell-compatible dictionary, by way of
 # a Hunspell object. Called from within a try block, so make no
@@ -226,6 +536,35 @@ class makeSpellCheck():
 # if a word has a letter that can't be encoded to match the dictionary,
 # obviously the word cannot appear in the dictionary.
 
+# A thread that loads one dictionary, the future of a main dict. When run()
+# ends, .dict is the spellDict or None, .error the exception if it failed,
+# and .complete is True. makeSpellCheck.loaded() sets .taken.
+
+class dictLoader(QThread):
+    def __init__(self, spell, tag, files):
+        super(dictLoader, self).__init__()
+        self.spell = spell
+        self.tag = QString(tag)
+        self.files = files
+        self.dict = None
+        self.error = None
+        self.complete = False
+        self.taken = False
+        self.installed = False # as the main dict
+
+    def run(self):
+        try :
+            self.dict = self.spell.openDict(self.tag, self.files)
+        except Exception as err :
+            self.error = err
+        self.complete = True
+
+# The limits on the pool of loaded alt dicts. The memory a Hunspell dict
+# takes is estimated as AltDictSizeFactor times the size of its files.
+AltDictMaxCount = 6
+AltDictMaxBytes = 200 * 1024 * 1024
+AltDictSizeFactor = 4
+
 class spellDict():
     def __init__(self,dic_path,aff_path):
         self.hobj = hunspell.HunSpell(
@@ -233,14 +572,120 @@ class spellDict():
             aff_path.encode('ISO-8859-1') )
         # Get the encoding Hunspell is using for this dict.
         self.encoding = self.hobj.get_dic_encoding()
+        # Hunspell's memory for a dict, guessed from the size of its files.
+        self.size = AltDictSizeFactor * (
+            os.path.getsize(dic_path) + os.path.getsize(aff_path) )
 
+    # Check a word, first in our verdict cache (set by loadDict).
     def spell(self, aword):
+        verdict = self.cache.get(aword)
+        if verdict is None :
+            verdict = self.hspell(aword)
+            self.cache.put(aword, verdict)
+        return verdict
+
+    # Check a word with Hunspell.
+    def hspell(self, aword):
         try :
             encword = aword.encode(self.encoding,'replace')
             return self.hobj.spell(encword)
         except : # presumably UnicodeError but whatever, misspelled
             return False
 
+# Parallel spellcheck is used when ppqt could fork its pool of processes,
+# IMC.pool (on Windows each process would start by re-running ppqt.py), and
+# there are ParallelSpellMinWords words or more. That figure is a guess; the
+# pool has not been timed against a serial check on more than one processor.
+# checkAll runs in the census thread, which must not fork a pool of its own.
+ParallelSpellMinWords = 2000
+
+# This runs in a process of the spellcheck pool. Check a list of words in the
+# dict whose .dic and .aff paths are given, returning a list of verdicts, or
+# of None if the dict won't load. Each process loads a dict the first time
+# it needs it and keeps it in poolDicts.
+poolDicts = {}
+
+def spellChunk(job):
+    ((dic_path, aff_path), words) = job
+    d = poolDicts.get(dic_path)
+    if d is None :
+        try :
+            d = spellDict(dic_path, aff_path)
+        except : # no messages from here, let the caller find out
+            d = False
+        poolDicts[dic_path] = d
+    if not d :
+        return [None] * len(words)
+    return [d.hspell(w) for w in words]
+
+# The cache of one dictionary's verdicts, an OrderedDict of word:True/False
+# in order of last use, oldest first. The file has one word per line,
+# prefixed with 1 for a good word or 0 for a bad one, oldest first. If path
+# is None, or the file can't be read, we start empty; if it can't be written
+# we lose the cache, no big deal. A cache is used from both the GUI thread
+# (check, checkMany) and the census thread (checkAll), and even get() changes
+# the order, so every use of the OrderedDict is under the cache's lock.
+
+VerdictCacheMax = 200000
+
+class verdictCache():
+    def __init__(self, path):
+        self.path = path
+        self.verdicts = OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path) :
+            try :
+                with io.open(path, 'r', encoding='UTF-8') as f :
+                    for line in f :
+                        self.verdicts[line[1:].rstrip(u'\n')] = line[0] == u'1'
+            except (IOError, OSError, UnicodeError) :
+                self.verdicts = OrderedDict()
+
+    # Return the verdict on a word, or None if we don't know it. A word
+    # that is used moves to the new end of the order.
+    def get(self, word):
+        with self.lock :
+            verdict = self.verdicts.pop(word, None)
+            if verdict is not None :
+                self.verdicts[word] = verdict
+            return verdict
+
+    def put(self, word, verdict):
+        with self.lock :
+            self.lockedPut(word, verdict)
+
+    def putMany(self, pairs):
+        pairs = list(pairs) # generate them before taking the lock
+        with self.lock :
+            for (word, verdict) in pairs :
+                self.lockedPut(word, verdict)
+
+    def lockedPut(self, word, verdict):
+        self.verdicts[word] = verdict
+        self.dirty = True
+        if len(self.verdicts) > VerdictCacheMax :
+            self.verdicts.popitem(last=False) # drop the oldest
+
+    # Write the cache to its file if it has changed. Write a new file and
+    # then replace the old one, so a crash can't leave a partial cache.
+    def save(self):
+        if (self.path is None) or not self.dirty :
+            return
+        with self.lock :
+            verdicts = list(self.verdicts.iteritems())
+        temp = self.path + u'.new'
+        try :
+            with io.open(temp, 'w', encoding='UTF-8') as f :
+                for (word, verdict) in verdicts :
+                    f.write((u'1' if verdict else u'0') + word + u'\n')
+            if os.path.exists(self.path) :
+                os.remove(self.path) # Windows rename won't replace
+            os.rename(temp, self.path)
+            self.dirty = False
+        except (IOError, OSError) :
+            pass
+
 if __name__ == "__main__":
     from PyQt4.QtCore import (QSettings)
     from PyQt4.QtGui import (QApplication)
@@ -251,9 +696,19 @@ if __name__ == "__main__":
     IMC.settings = QSettings()
     base = os.path.dirname(__file__)
     IMC.dictPath = os.path.join(base,u"dict")
+    IMC.pool = multiprocessing.Pool() # as ppqt does, before any thread
+    import time
+    t0 = time.time()
     IMC.spellCheck = makeSpellCheck()
     sp = IMC.spellCheck
-    print("spellcheck is up: ",sp.isUp())
+    t1 = time.time()
+    sp.startLoading() # as ppqt does when the window is shown
+    print("spellcheck is up: ",sp.isUp()) # not yet, it doesn't wait
+    t2 = time.time()
+    sp.ready(True)
+    print(u'makeSpellCheck returned in {0:.3f}s, isUp() in {1:.3f}s, '
+          u'main dict loaded in {2:.3f}s'.format(
+        t1 - t0, t2 - t1, time.time() - t0))
     if sp.isUp():
         #print("Junk as main: ", sp.setMainDict(u"Foobar"))
         #print("en_GB as main: ", sp.setMainDict(u"en_GB"))
@@ -261,6 +716,7 @@ if __name__ == "__main__":
         #print("fr_FR as main: ", sp.setMainDict(u"fr_FR"))
         #words = 'basse-terre lait oiseau oiseaux Paris fraise'
         print("de_DE as main: ", sp.setMainDict(u"de_DE"))
+        sp.ready(True) # don't check with the old main dict
         words = u'erschien Heldengedicht unbewu\u00dft \u00fcberall \xfcberwinden \xfcberwindende \xfcberwindet \xfcbertragen \xfcbertragenen \xfcberstark \xfcberschreibt \xfcberschreitet \xfcberraschender \xfcberraschend'
         words = words + u' Lateinschule Vaterstadt Kindererz\xe4hlungen Selbstvertrauen Kuchenteig Grundlage Grundverm\xf6gen Dichtkunst Marktstrasse Wohnhaus Heldengedicht'
 
@@ -277,4 +733,39 @@ if __name__ == "__main__":
             tf = sp.check(aword, adict)
             print((' ' if tf else '*'), aword ,('is' if tf else "isn't"),'a word')
 
-        sp.terminate()
\ No newline at end of file
+        # Time a serial and a parallel spellcheck of a vocabulary of 30k
+        # words, 27k of en_US and 3k of an alt dict, half of them garbled,
+        # with empty verdict caches.
+        import random
+        altTag = [unicode(t) for t in sp.dictList() if t != u'en_US'][:1]
+        if sp.setMainDict(QString(u'en_US')) and altTag :
+            sp.ready(True)
+            altTag = altTag[0]
+            random.seed(7)
+            def sample(tag, n):
+                with io.open(os.path.join(IMC.dictPath, tag+u'.dic'),
+                             encoding=sp.mainDict.encoding, errors='replace') as f:
+                    ws = [line.split(u'/')[0].strip() for line in f][1:]
+                ws = random.sample(ws, min(n, len(ws)))
+                return [w[::-1] if random.random() < 0.5 else w for w in ws]
+            groups = {u'': sample(u'en_US', 27000), altTag: sample(altTag, 3000)}
+            t0 = time.time()
+            serial = {}
+            for (tag, ws) in groups.iteritems() :
+                d = spellDict(*sp.dictFiles(tag if tag else u'en_US'))
+                serial[tag] = [d.hspell(w) for w in ws]
+            t1 = time.time()
+            sp.cachePath = None # don't read or write the real caches
+            sp.caches = {}
+            sp.cacheNames = {}
+            parallel = sp.checkAll(groups)
+            t2 = time.time()
+            print(u'{0} words, en_US + {1}, {2} processes'.format(
+                sum(len(ws) for ws in groups.itervalues()), altTag,
+                multiprocessing.cpu_count()))
+            print(u'serial {0:.2f}s, parallel {1:.2f}s (incl. dict loading)'.format(
+                t1 - t0, t2 - t1))
+            print(u'verdicts agree' if serial == parallel else u'VERDICTS DIFFER')
+
+        sp.terminate()
+    IMC.pool.terminate()
\ No newline at end of file
@@ -579,9 +579,11 @@ class tableCells:
         return self.tProps.columnDecimal(c)
 
 # Reflow a table, based on the sequence of "work units" as developed in
-# pqFlow. Arguments are: doc is a QTextDocument, tc is the textCursor over
-# it on which a single undo/redo macro has been started. unitList is the
-# slice of the pqFlow unitList from the /T[M] line to the T/ line inclusive.
+# pqFlow. Arguments are: doc is a QTextDocument, tc is a textCursor over
+# it we may move about. unitList is the slice of the pqFlow unitList from
+# the /T[M] line to the T/ line inclusive. The document is not changed; we
+# return the edit that reflows the table as (start, end, text), for pqFlow
+# to make along with the rest of the reflow.
 # For reference the relevant elements of a work unit are (see pqFlow for
 # the full general list):
 # 'T' : type of work unit, specifically
@@ -812,16 +814,14 @@ def tableReflow(tc,doc,unitList):
         if (r < tcells.rowCount()) or (botChar is not None):
             tableText.append(cellBottom) # finish logical row
 
-    # Finally, point the text cursor at the entire span of lines between
-    # but not including the /T and T/ lines and replace it with tableText.
+    # Finally, return the entire span of lines between but not including
+    # the /T and T/ lines, which tableText replaces.
     firstTableLine = unitList[1]['A']
     lastTableLine = unitList[-2]['A']
     firstBlock = doc.findBlockByNumber(firstTableLine)
     lastBlock = doc.findBlockByNumber(lastTableLine)
-    tc.setPosition(firstBlock.position()) # click
-    tc.setPosition(lastBlock.position()+lastBlock.length(),
-		               QTextCursor.KeepAnchor) # and shift-click
-    tc.insertText(tableText)
+    return (firstBlock.position(),
+            lastBlock.position()+lastBlock.length(), tableText)
     # bye-eeeeee
 
 # Given the data of one cell as a single QString, fold or stretch it into a
@@ -0,0 +1,324 @@
+# must precede anything except #comments, including the docstring
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from future_builtins import *
+
+__version__ = "1.3.0"
+__author__  = "David Cortesi"
+__copyright__ = "Copyright 2011, 2012, 2013 David Cortesi"
+__maintainer__ = "David Cortesi"
+__email__ = "tallforasmurf@yahoo.com"
+__license__ = '''
+ License (GPL-3.0) :
+    This file is part of PPQT.
+    PPQT is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You can find a copy of the GNU General Public License in the file
+    extras/COPYING.TXT included in the distribution of this program, or see:
+    <http://www.gnu.org/licenses/>.
+'''
+
+'''
+Break text into words and HTML tags for the word census and the syntax
+highlighter, using the Python re module on Python strings rather than
+QRegExp on one QString line at a time. The regexes here accept exactly the
+same tokens as the QRegExps reWord and reTokens in pqEdit, and the unit test
+at the end checks that they do. Nothing here uses Qt, so the census scan can
+run in a worker process.
+
+  * censusScan(lines, state) yields the census record of each of a list of
+    lines, making one re.finditer pass over the whole text.
+  * wordSpans(text, units) yields (start, length, word) for each word of
+    one line, for the syntax highlighter.
+  * censusSpans(text, state, units) yields (start, length, word) for each
+    word of one text line as censusScan counts it, with its /dict suffix,
+    for the index of word occurrences.
+  * tokenFlags(word) returns the IMC.WordHas* feature flags of a word,
+    computing them only the first time it sees the word.
+'''
+
+import re
+import unicodedata
+
+# QRegExp \w matches a letter, number, or mark (QChar::isLetterOrNumber()
+# or isMark()) or underscore, where a "char" is a 16-bit unit. The Python
+# re \w doesn't match marks, and on a wide build it would match letters
+# outside the BMP, which QRegExp sees as surrogate pairs, not letters. So
+# we build the class ourselves from the Unicode categories of the BMP.
+
+def makeWordClass():
+    ranges = []
+    first = None
+    for i in range(0x10000) :
+        c = unichr(i)
+        if c == u'_' or unicodedata.category(c)[0] in u'LNM' :
+            if first is None :
+                first = c
+            last = c
+        elif first is not None :
+            ranges.append(first if first == last else first + u'-' + last)
+            first = None
+    return u'[' + u''.join(ranges) + u']'
+
+xw = makeWordClass()
+
+# Regexes for parsing a line into word-like tokens, as in pqEdit. First,
+# a word composed of digits and/or letters, where the letters may include
+# PGDP ligature notation: [OE]dipus ma[~n]ana. pqEdit writes this as
+# (\w*(\[..\])?\w+)+ which QRegExp handles fine, but Python's backtracking
+# re takes time exponential in the length of a word that is followed by
+# a hyphen and no more word, as at the end of a line. The form here
+# accepts the same strings with no ambiguity: no adjacent or terminal
+# ligatures, an optional leading one.
+
+xp_word = u'(?:\\[..\\])?' + xw + u'+(?:\\[..\\]' + xw + u'+)*'
+
+# Next: the above with embedded hyphens or apostrophes (incl. u2019's):
+# she's my mother-in-law's 100-year-old bric-a-brac ph[oe]nix
+
+xp_hyap = u"(?:" + xp_word + u"['\\-\u2019])*" + xp_word
+
+# HTML start tag with possible attributes, and HTML end tag. The group
+# numbers are the same as in pqEdit: group(2) is the tag name of a start
+# tag and group(3) its attributes; group(5) is the tag name of an end tag.
+# The attributes stop at a newline because we scan many lines at once.
+
+xp_start = u'(<(' + xw + u'+)([^>\\n]*)>)'
+xp_end = u'(</(' + xw + u'+)>)'
+xp_any = xp_start + u'|' + xp_end + u'|' + xp_hyap
+
+reWord = re.compile(xp_hyap, re.UNICODE)
+reTokens = re.compile(xp_any, re.UNICODE)
+reLang = re.compile(u'''lang=['"]*((?:''' + xw + u'''|-)+)['"]*''', re.UNICODE)
+
+# All of a page separator line, as pqEdit's reLineSep.exactMatch().
+
+reLineSep = re.compile(
+    u'-----File: ([^\\.]+)\\.png---((\\\\[^\\\\]*)+)\\\\-*\\Z', re.UNICODE)
+
+# The census record of a line is a tuple (kind, entry, exit, words) where
+# kind is one of the LineKind values of pqEdit; entry and exit are the scan
+# states at the start and end of the line; and words is a tuple of the words
+# in the line, each with a "/dict" suffix when inside a lang= tag. The scan
+# state is a tuple (skipping, alt_dict_tag, alt_dict) as in pqEdit.
+# Only text lines have words; a skipped HTML header line or a page separator
+# has none.
+
+LineKind_Skip = 0
+LineKind_Psep = 1
+LineKind_Text = 2
+
+# Yield the census record of each of a list of Python strings. All lines are
+# scanned with one finditer over their concatenation; no token can span a
+# line, so we hand each match to the line it starts in.
+
+def censusScan(lines, state):
+    text = u'\n'.join(lines)
+    matches = reTokens.finditer(text)
+    match = next(matches, None)
+    end = -1
+    for line in lines :
+        end += len(line) + 1 # offset of the newline after line
+        entry = state
+        (skipping, alt_dict_tag, alt_dict) = state
+        if skipping and not line.startswith(u'<body') :
+            kind = LineKind_Skip
+        elif reLineSep.match(line) :
+            kind = LineKind_Psep
+            skipping = False
+        else : # text line, <body> line ends an HTML header
+            kind = LineKind_Text
+            skipping = False
+        words = []
+        while (match is not None) and (match.start() < end) :
+            if kind == LineKind_Text :
+                if match.group(2) : # HTML open tag, look for lang='dict'
+                    lang = reLang.search(match.group(3))
+                    if lang : # save tag and dict name as "/en_GB"
+                        alt_dict_tag = match.group(2)
+                        alt_dict = u'/' + lang.group(1)
+                elif match.group(5) : # HTML close tag, does it end alt dict?
+                    if match.group(5) == alt_dict_tag :
+                        alt_dict_tag = u''
+                        alt_dict = u''
+                else : # a word
+                    words.append(match.group(0) + alt_dict)
+            match = next(matches, None)
+        state = (skipping, alt_dict_tag, alt_dict)
+        yield (kind, entry, state, tuple(words))
+
+# Yield (start, length, word) for each word in a Python string that came
+# from a QString of units 16-bit chars. On a wide Python build a char beyond
+# the BMP is one Python char but two Qt ones, so when the lengths differ we
+# add the count of such chars before each word to get Qt positions.
+
+def wordSpans(text, units=None):
+    shift = 0
+    k = 0
+    wide = (units is not None) and (units != len(text))
+    for match in reWord.finditer(text) :
+        (i, j) = match.span()
+        if wide :
+            shift += sum(1 for c in text[k:i] if ord(c) > 0xffff)
+            k = i
+        yield (i + shift, j - i, match.group(0))
+
+# Yield (start, length, word) for each word of one text line, starting in
+# the scan state given, where word has the "/dict" suffix censusScan gives
+# it. Positions are in 16-bit units as for wordSpans.
+
+def censusSpans(text, state, units=None):
+    (skipping, alt_dict_tag, alt_dict) = state
+    shift = 0
+    k = 0
+    wide = (units is not None) and (units != len(text))
+    for match in reTokens.finditer(text) :
+        if match.group(2) : # HTML open tag, look for lang='dict'
+            lang = reLang.search(match.group(3))
+            if lang :
+                alt_dict_tag = match.group(2)
+                alt_dict = u'/' + lang.group(1)
+        elif match.group(5) : # HTML close tag, does it end alt dict?
+            if match.group(5) == alt_dict_tag :
+                alt_dict_tag = u''
+                alt_dict = u''
+        else : # a word
+            (i, j) = match.span()
+            if wide :
+                shift += sum(1 for c in text[k:i] if ord(c) > 0xffff)
+                k = i
+            yield (i + shift, j - i, match.group(0) + alt_dict)
+
+# The feature flags of a word, given as a Python string possibly with a
+# "/dict" suffix. A book has many more words than distinct words, so we keep
+# the flags of the words we have seen and compute them for a new one only.
+# A session may open many books, so the memo is emptied when it holds
+# WordFlagMemoSize words, which is more than one book has.
+# The tests are those pqEdit made with QString: a word has upper (lower) case
+# if it differs from its lowercase (uppercase) version; \d is category Nd.
+
+WordFlagMemoSize = 200000
+wordFlagMemo = {}
+
+def tokenFlags(word):
+    w = word.split(u'/')[0]
+    flag = wordFlagMemo.get(w)
+    if flag is None :
+        flag = 0
+        if w != w.lower() :
+            flag |= IMC.WordHasUpper
+        if w != w.upper() :
+            flag |= IMC.WordHasLower
+        if u'-' in w :
+            flag |= IMC.WordHasHyphen
+        if (u"'" in w) or (u'\u2019' in w) :
+            flag |= IMC.WordHasApostrophe
+        for c in w :
+            if unicodedata.category(c) == u'Nd' :
+                flag |= IMC.WordHasDigit
+                break
+        if len(wordFlagMemo) >= WordFlagMemoSize :
+            wordFlagMemo.clear()
+        wordFlagMemo[w] = flag
+    return flag
+
+if __name__ == "__main__":
+    # Conformance test: tokenize a set of tricky lines plus many random ones
+    # with the QRegExps of pqEdit and with the regexes here, and compare the
+    # tokens, the captured tag names and attributes, and the word flags.
+    #   python pqToken.py [number of random lines]
+    import random
+    import sys
+    import time
+    from PyQt4.QtCore import (QChar, QRegExp, QString)
+    import pqIMC
+    IMC = pqIMC.tricorder()
+    import pqEdit
+    def qtTokens(line):
+        qs = QString(line)
+        toks = []
+        j = pqEdit.reTokens.indexIn(qs, 0)
+        while j >= 0 :
+            tok = pqEdit.reTokens.cap(0)
+            toks.append( (j, unicode(tok), unicode(pqEdit.reTokens.cap(2)),
+                          unicode(pqEdit.reTokens.cap(3)),
+                          unicode(pqEdit.reTokens.cap(5))) )
+            j = pqEdit.reTokens.indexIn(qs, j + tok.size())
+        return toks
+    def pyTokens(line):
+        return [ (m.start(), m.group(0), m.group(2) or u'', m.group(3) or u'',
+                  m.group(5) or u'') for m in reTokens.finditer(line) ]
+    def qtFlags(word):
+        qsWord = QString(word)
+        flag = 0
+        if 0 != qsWord.compare(qsWord.toLower()) :
+            flag |= IMC.WordHasUpper
+        if 0 != qsWord.compare(qsWord.toUpper()) :
+            flag |= IMC.WordHasLower
+        if qsWord.contains(QChar(u'-')) :
+            flag |= IMC.WordHasHyphen
+        if qsWord.contains(QChar(u"'")) or qsWord.contains(QChar(8217)) :
+            flag |= IMC.WordHasApostrophe
+        if qsWord.contains(QRegExp(u'\\d')) :
+            flag |= IMC.WordHasDigit
+        return flag
+    lines = [
+        u"she's my mother-in-law's 100-year-old bric-a-brac ph[oe]nix",
+        u"[OE]dipus ma[~n]ana a[oe][ae]b footnote[12] word[ab]",
+        u"don\u2019t 'tis dogs' -dash- end-of-line-",
+        u'<span lang="fr_FR">\u00e9t\u00e9</span> <i>it</i> <br /> <hr class=x>',
+        u'<p lang=en_GB>colour <<a>> </ span> </span>> <a<b>',
+        u"e\u0301te\u0301 Mu\u0308ller \u00bd 1850-1910 snake_case \u00c6sop",
+        u"\u0661\u0662\u0663 \u0928\u092e\u0938\u094d\u0924\u0947 \u4e2d\u6587 \u00b2",
+        u"-----File: 001.png---\\JulietS\\-----",
+        u"aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa-",
+        u"", u" ", u"[", u"[]", u"[ab]", u"<", u"</>", u"<>", u"'", u"-a-",
+    ]
+    alphabet = u"aZ\u00e9\u00c6_1\u0661\u00bd\u0301[]-'\u2019<>/=\" \t.,;" \
+               u"\u00a0\u4e2d\u2029"
+    random.seed(4)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for i in range(count) :
+        lines.append(u''.join(random.choice(alphabet)
+                              for j in range(random.randint(0, 40))))
+    failures = 0
+    for line in lines :
+        qt = qtTokens(line)
+        py = pyTokens(line)
+        if qt != py :
+            failures += 1
+            print(u'tokens differ:', repr(line), qt, py)
+            continue
+        for (j, tok, t2, t3, t5) in py :
+            if not tok.startswith(u'<') and qtFlags(tok) != tokenFlags(tok) :
+                failures += 1
+                print(u'flags differ:', repr(tok))
+    # censusScan over all lines at once must equal a scan of one line at a
+    # time, as the incremental census does it.
+    state = (False, u'', u'')
+    single = []
+    for line in lines :
+        record = next(censusScan([line], state))
+        state = record[2]
+        single.append(record)
+    if single != list(censusScan(lines, (False, u'', u''))) :
+        failures += 1
+        print(u'census records differ')
+    t0 = time.time()
+    for line in lines :
+        qtTokens(line)
+    t1 = time.time()
+    for record in censusScan(lines, (False, u'', u'')) :
+        pass
+    t2 = time.time()
+    print(u'{0} lines, {1} failures; QRegExp {2:.2f}s, re {3:.2f}s'.format(
+        len(lines), failures, t1 - t0, t2 - t1))
@@ -131,6 +131,13 @@ class myTableModel(QAbstractTableModel):
                 return QString(features)
         elif (role == Qt.TextAlignmentRole) :
             return self.alignDict[index.column()]
+        elif (role == Qt.ToolTipRole) and (1 == index.column()) :
+            # the tooltip of a count says where the word is, if not too often
+            (qs,count,flag) = IMC.wordCensus.get(index.row())
+            note = IMC.editWidget.occurrenceNote(u'word', unicode(qs))
+            if note is None :
+                note = self.tipDict[1]
+            return QString(note)
         elif (role == Qt.ToolTipRole) or (role == Qt.StatusTipRole) :
             return QString(self.tipDict[index.column()])
         elif (role == Qt.UserRole) and (2 == index.column()):
@@ -277,6 +284,7 @@ class myTableView(QTableView):
             mtxt = u'Add {0} words to the good-words list?'.format(len(lix))
         b = pqMsgs.okCancelMsg(mtxt,"This action cannot be undone.")
         if b : # user says do it, so let's do it.
+            added = set()
             for ix in lix :
                 qs = self.model().data(ix, Qt.DisplayRole).toString()
                 # If the word has an alt spellcheck dictionary it has the
@@ -284,6 +292,7 @@ class myTableView(QTableView):
                 # 'word'.split('/')[0] ==> 'word'
                 word = unicode(qs).split('/')[0]
                 IMC.goodWordList.insert(word)
+                added.add(word)
                 # fabricate an index to the flags field of the indexed row
                 findex = self.model().index(ix.row(), 2)
                 # get flag as an int instead of a fancy char string
@@ -292,7 +301,9 @@ class myTableView(QTableView):
                 self.model().setData(findex,flag,Qt.UserRole)
                 IMC.needMetadataSave |= IMC.wordlistsChanged
                 IMC.mainWindow.setWinModStatus()
-            # and, having done it, spellcheck is now appropriate
+            # and, having done it, spellcheck is now appropriate, of the
+            # same words in any other dictionary, whose lines are redone.
+            IMC.editWidget.wordsMadeGood(added)
             IMC.needSpellCheck = True
 
     # The actual code of First and Second Harmonic. Run through the word list
@@ -466,6 +477,10 @@ class wordsPanel(QWidget):
         qs = qmi.data(Qt.DisplayRole).toString()
         # Put the text in the paste buffer
         QApplication.clipboard().setText(qs)
+        # The word as counted, with any /tag, so the editor can go straight
+        # to its occurrences (and not those of the same word in another
+        # dictionary).
+        occurs = (u'word', unicode(qs))
         # If it contains a /tag, split that off and keep just the word
         if qs.contains(QChar(u'/')) :
             qs = qs.split(QChar(u'/'))[0]
@@ -479,8 +494,9 @@ class wordsPanel(QWidget):
             qs.prepend(QString(u'\\b'))
             qs.append(QString(u'\\b'))
             rex = True
+            occurs = None # the regex finds more than the census counted
         # Call for a find with no replace, whole word true, regex as req'd
-        IMC.findPanel.censusFinder(qs, None, rex, True)
+        IMC.findPanel.censusFinder(qs, None, rex, True, occurs)
 
     # This slot receives a change of the respect case checkbox. Set the
     # case sensitivity of the sort proxy model accordingly.
@@ -530,6 +546,27 @@ class wordsPanel(QWidget):
         self.tableModel.endResetModel()
         self.setUpTableView()
 
+    # These slots receive the editor's incremental-census signals, sent when
+    # the user pauses after an edit, and as a census or spellcheck running in
+    # the background sends its results. When words were added to or dropped
+    # from the census, the rows change, so reset the model as for a refresh.
+    # Otherwise only counts or flags changed, and we just tell the view to
+    # repaint the count and features columns.
+    def censusWillChange(self, structural):
+        if structural :
+            self.tableModel.beginResetModel()
+
+    def censusHasChanged(self, structural):
+        if structural :
+            self.tableModel.endResetModel()
+            self.rowCountLabel.setNum(self.proxy.rowCount())
+        else :
+            rows = self.tableModel.rowCount(QModelIndex())
+            if rows :
+                self.tableModel.emit(SIGNAL("dataChanged(QModelIndex,QModelIndex)"),
+                                     self.tableModel.index(0,1),
+                                     self.tableModel.index(rows-1,2))
+
     # This slot receives the click of the refresh button. Tell the
     # model we are resetting everything so the view will suck up new
     # data. Then call our editor to rebuild the metadata.